@@ -0,0 +1,387 @@
+"""
+An asyncio client for `TDProxy`, with async versions of `bridge`, `topo_sort_handles`
+and `layout_nodes`.
+
+`AsyncTDProxy` makes each call on one of a small pool of Pyro5 proxies (one connection
+each), from a thread pool, so independent calls are in flight at the same time and are
+served by TouchDesigner in the same frame instead of one frame each. Planning runs in
+the default executor, so a single client process can drive several TouchDesigner
+instances, overlapping the planning for one with the I/O of the others:
+
+    python async_client.py --port 60883 --port 60884 --test-network
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import logging
+import queue
+import threading
+from typing import Callable, Dict, List
+
+import Pyro5.api
+
+from graph_utils import (COMPONENTS_DIR, DEFAULT_MAX_PLAN_DEPTH, DEFAULT_MAX_PLAN_NODES,
+                         LAYOUT_MODES, ComponentRegistry, GraphPlan, PlanCancelled, diff_plan,
+                         layered_positions, load_components, plan_for_bridge, row_positions,
+                         topo_sort_snapshot)
+
+logger = logging.getLogger(__name__)
+
+# Connections per TouchDesigner instance.
+POOL_SIZE = 4
+
+
+class AsyncTDProxy:
+    """
+    Awaitable `TDProxy` calls over a pool of connections, e.g. `await td.get_io_handles()`.
+
+    Args:
+        uri: The URI of the TDProxy, e.g. "PYRO:td@localhost:60883".
+        pool_size: Number of connections, and so of calls in flight at the same time.
+    """
+
+    def __init__(self, uri: str, pool_size: int = POOL_SIZE):
+        self.uri = uri
+        self.proxies = queue.SimpleQueue()
+        for _ in range(pool_size):
+            self.proxies.put(Pyro5.api.Proxy(uri))
+        self.pool_size = pool_size
+        self.executor = concurrent.futures.ThreadPoolExecutor(pool_size,
+                                                              thread_name_prefix="td-proxy")
+
+    async def call(self, method: str, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor,
+                                          functools.partial(self._call, method, args, kwargs))
+
+    def _call(self, method, args, kwargs):
+        proxy = self.proxies.get()
+        try:
+            # Pyro5 proxies belong to a thread, and the pool threads take turns using them.
+            proxy._pyroClaimOwnership()
+            return getattr(proxy, method)(*args, **kwargs)
+        finally:
+            self.proxies.put(proxy)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return functools.partial(self.call, name)
+
+    def close(self):
+        self.executor.shutdown()
+        while not self.proxies.empty():
+            proxy = self.proxies.get()
+            proxy._pyroClaimOwnership()
+            proxy._pyroRelease()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+@Pyro5.api.expose
+class IOEvents:
+    """
+    Receives the I/O callbacks of a TDProxy as an awaitable event, instead of a lock
+    released from the callback daemon's thread.
+
+    Usage:
+        io_events = IOEvents()
+        await io_events.register(td_proxy)
+        io_args = await io_events.wait()
+    """
+
+    def __init__(self):
+        self.loop = None
+        self.event = asyncio.Event()
+        self.io_args = None
+        self.daemon = None
+
+    def notify(self, args):
+        # Called on the daemon's thread.
+        self.loop.call_soon_threadsafe(self._set, args)
+
+    def _set(self, args):
+        self.io_args = args
+        self.event.set()
+
+    async def register(self, td_proxy: AsyncTDProxy):
+        """Serve the callback and register it with the TDProxy."""
+        self.loop = asyncio.get_running_loop()
+        self.daemon = Pyro5.api.Daemon()
+        uri = self.daemon.register(self)
+        threading.Thread(target=self.daemon.requestLoop, daemon=True).start()
+        await td_proxy.register_io_callback(uri)
+
+    async def wait(self):
+        """Wait for the next callback, returning its I/O args."""
+        await self.event.wait()
+        self.event.clear()
+        return self.io_args
+
+    def close(self):
+        if self.daemon is not None:
+            self.daemon.shutdown()
+            self.daemon = None
+
+
+async def apply_plan(td_proxy: AsyncTDProxy,
+                     plan: GraphPlan,
+                     batch: bool = True,
+                     chunked: bool = False,
+                     poll_interval: float = 0.005,
+                     cancel: Callable[[], bool] = None) -> Dict[str, int]:
+    """
+    Async `graph_utils.apply_plan`. Without `batch`, independent calls are concurrent, and
+    `cancel` is only checked between the polls of a `chunked` plan.
+    """
+    if batch:
+        if chunked:
+            job_id = await td_proxy.submit_plan(plan.to_dict())
+            while not (status := await td_proxy.get_plan_status(job_id))["finished"]:
+                if cancel is not None and cancel():
+                    status = await td_proxy.cancel_plan(job_id)
+                    if not status["finished"]:
+                        raise PlanCancelled(f"Plan cancelled after {status['done']} of "
+                                            f"{status['total']} steps")
+                    raise PlanCancelled("Plan cancelled")
+                await asyncio.sleep(poll_interval)
+            if "error" in status:
+                raise RuntimeError(f"Plan job {job_id} failed after {status['done']} of "
+                                   f"{status['total']} steps: {status['error']}")
+            result = status["result"]
+        else:
+            result = await td_proxy.apply_plan(plan.to_dict())
+        if result["failed_edges"] or result["failed_attributes"]:
+            logger.warning("Plan partially applied, failed edges: %s, failed attributes: %s",
+                           result["failed_edges"], result["failed_attributes"])
+        return result["handles"]
+
+    await asyncio.gather(*(
+        td_proxy.disconnect(handle, [input_index], []) for handle, input_index in plan.disconnects))
+    await asyncio.gather(*(td_proxy.delete_op(handle) for handle in plan.destroys))
+    loaded = await asyncio.gather(*(td_proxy.load(node["component"]) for node in plan.nodes))
+    handles = {node["id"]: handle for node, handle in zip(plan.nodes, loaded)}
+
+    def resolve(node):
+        return handles[node] if isinstance(node, str) else node
+
+    await asyncio.gather(
+        *(td_proxy.connect(resolve(source), source_index, resolve(target), target_index)
+          for source, source_index, target, target_index in plan.edges),
+        *(td_proxy.set_op_attribute(resolve(node), attribute, value)
+          for node, attribute, value in plan.attributes))
+    return handles
+
+
+async def get_io_descriptors(td_proxy: AsyncTDProxy,
+                             input_handles: List[int],
+                             output_handles: List[int],
+                             batch: bool = True):
+    """Async `graph_utils.get_io_descriptors`, with concurrent calls unless `batch`."""
+    handles = input_handles + output_handles
+    if batch:
+        descriptors = await td_proxy.get_op_descriptors(handles)
+    else:
+        descriptors = await asyncio.gather(
+            *(td_proxy.get_op_descriptor(handle) for handle in handles))
+    descriptors = dict(zip(handles, descriptors))
+    return ({
+        handle: descriptors[handle] for handle in input_handles
+    }, {
+        handle: descriptors[handle] for handle in output_handles
+    })
+
+
+async def bridge(td_proxy: AsyncTDProxy,
+                 input_handles: List[int],
+                 output_handles: List[int],
+                 reuse_weight: float = 0.7,
+                 exclude_components: List[str] = (),
+                 include_io_config: bool = True,
+                 batch: bool = True,
+                 registry: ComponentRegistry = None,
+                 incremental: bool = False,
+                 chunked: bool = False,
+                 seed: int = None,
+                 cancel: Callable[[], bool] = None,
+                 candidates: int = 1,
+                 score_weights: Dict[str, float] = None,
+                 search_deadline: float = None,
+                 max_nodes: int = DEFAULT_MAX_PLAN_NODES,
+                 max_depth: int = DEFAULT_MAX_PLAN_DEPTH,
+                 max_seconds: float = None,
+                 cost_budget: float = None,
+                 costs: Dict[str, float] = None) -> List[int]:
+    """
+    Async `graph_utils.bridge`.
+
+    The components are loaded and the network planned (and validated) in the default
+    executor, while the I/O handles and descriptors (and, when `incremental`, the
+    snapshot) are fetched.
+    """
+    loop = asyncio.get_running_loop()
+    loading = None
+    if registry is None:
+        loading = loop.run_in_executor(
+            None, lambda: ComponentRegistry(
+                load_components(COMPONENTS_DIR, exclude=list(exclude_components))))
+
+    input_handles, output_handles = list(input_handles), list(output_handles)
+    if include_io_config:
+        io_config = await td_proxy.get_io_handles()
+        input_handles = list(set(input_handles + io_config["inputs"]))
+        output_handles = list(set(output_handles + io_config["outputs"]))
+
+    snapshot = asyncio.create_task(td_proxy.get_graph_snapshot()) if incremental else None
+    input_descriptors, output_descriptors = await get_io_descriptors(td_proxy, input_handles,
+                                                                     output_handles, batch)
+    if loading is not None:
+        registry = await loading
+    plan = await loop.run_in_executor(None, plan_for_bridge, registry, input_descriptors,
+                                      output_descriptors, reuse_weight, seed, candidates,
+                                      score_weights, search_deadline, max_nodes, max_depth,
+                                      max_seconds, cost_budget, costs)
+    if cancel is not None and cancel():
+        raise PlanCancelled("Plan cancelled before being applied")
+
+    if incremental:
+        patch, kept = diff_plan(await snapshot, plan)
+        handles = await apply_plan(td_proxy, patch, batch, chunked, cancel=cancel)
+        handles.update(kept)
+    else:
+        handles = await apply_plan(td_proxy, plan, batch, chunked, cancel=cancel)
+    return [handles[node_id] for node_id in plan.node_ids()]
+
+
+async def topo_sort_handles(td_proxy: AsyncTDProxy, handles, snapshot=None) -> List[int]:
+    """Async `graph_utils.topo_sort_handles`."""
+    if snapshot is None:
+        snapshot = await td_proxy.get_graph_snapshot(list(handles))
+    return topo_sort_snapshot(snapshot)
+
+
+async def layout_nodes(td_proxy: AsyncTDProxy, sorted_handles, mode: str = "row", snapshot=None):
+    """Async `graph_utils.layout_nodes`, fetching the geometry and snapshot concurrently."""
+    if mode not in LAYOUT_MODES:
+        raise ValueError(f"Unknown layout mode {mode}, expected one of {LAYOUT_MODES}")
+    MARGIN = 20  # Units between nodes
+
+    reads = [td_proxy.get_nodes_geometry(list(sorted_handles))]
+    if mode == "layered" and snapshot is None:
+        reads.append(td_proxy.get_graph_snapshot(list(sorted_handles)))
+    geometry, *fetched = await asyncio.gather(*reads)
+    if fetched:
+        snapshot = fetched[0]
+
+    if mode == "layered":
+        positions = layered_positions(sorted_handles, snapshot["edges"], geometry, MARGIN)
+    else:
+        positions = row_positions(sorted_handles, geometry, MARGIN)
+    await td_proxy.set_nodes_positions(positions)
+
+
+async def rebuild_graph(td_proxy: AsyncTDProxy,
+                        layout="row",
+                        incremental=False,
+                        double_buffered=False,
+                        chunked=False,
+                        seed=None,
+                        registry=None):
+    """Async `client.rebuild_graph`."""
+    if not incremental:
+        await td_proxy.clear()
+    created_nodes = await bridge(td_proxy, [], [],
+                                 exclude_components=["io/*"],
+                                 registry=registry,
+                                 incremental=incremental,
+                                 chunked=chunked,
+                                 seed=seed)
+
+    io_handles = await td_proxy.get_io_handles()
+    all_nodes = created_nodes + io_handles["inputs"] + io_handles["outputs"]
+    snapshot = await td_proxy.get_graph_snapshot(all_nodes)
+    sorted_handles = await topo_sort_handles(td_proxy, all_nodes, snapshot)
+    await layout_nodes(td_proxy, sorted_handles, layout, snapshot)
+
+    if double_buffered:
+        await td_proxy.swap_buffers()
+
+
+async def drive(uri: str, args, registry: ComponentRegistry):
+    """Rebuild the graph of one TouchDesigner instance on every I/O callback."""
+    async with AsyncTDProxy(uri, args.pool_size) as td_proxy:
+        io_events = IOEvents()
+        await io_events.register(td_proxy)
+        await td_proxy.set_double_buffered(args.double_buffer)
+        logger.info("Connected to %s", uri)
+
+        rebuilds = 0
+
+        async def rebuild():
+            nonlocal rebuilds
+            seed = None if args.seed is None else args.seed + rebuilds
+            rebuilds += 1
+            try:
+                await rebuild_graph(td_proxy, args.layout, args.incremental, args.double_buffer,
+                                    args.chunked, seed, registry)
+            except Exception as e:
+                logger.error("Rebuilding %s failed: %s", uri, e)
+
+        try:
+            if args.test_network:
+                await rebuild()
+            while True:
+                io_args = await io_events.wait()
+                logger.info("Callback received from %s: %s", uri, io_args)
+                await rebuild()
+        finally:
+            io_events.close()
+
+
+async def main_async(args):
+    loop = asyncio.get_running_loop()
+    registry = await loop.run_in_executor(
+        None, lambda: ComponentRegistry(load_components(COMPONENTS_DIR, exclude=["io/*"])))
+    await asyncio.gather(
+        *(drive(f"PYRO:td@{args.host}:{port}", args, registry) for port in args.port))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port",
+                        type=int,
+                        action="append",
+                        help="Port of a TouchDesigner instance, can be given several times "
+                        "(default 60883)")
+    parser.add_argument("--pool-size",
+                        type=int,
+                        default=POOL_SIZE,
+                        help="Connections per TouchDesigner instance")
+    parser.add_argument("--test-network", action="store_true")
+    parser.add_argument("--layout", choices=LAYOUT_MODES, default="row")
+    parser.add_argument("--incremental", action="store_true")
+    parser.add_argument("--double-buffer", action="store_true")
+    parser.add_argument("--chunked", action="store_true")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--log-level",
+                        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                        default="INFO")
+    args = parser.parse_args()
+    args.port = args.port or [60883]
+
+    logging.basicConfig(level=args.log_level, format='%(name)s - %(levelname)s - %(message)s')
+    try:
+        asyncio.run(main_async(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+
+from async_client import AsyncTDProxy, IOEvents, bridge, rebuild_graph
+from graph_utils import topo_sort_snapshot
+from local_td import LocalTouchDesigner
+
+
+class TestAsyncClient(unittest.TestCase):
+
+    def setUp(self):
+        self.local_tds = [LocalTouchDesigner(fps=100) for _ in range(2)]
+        for local_td in self.local_tds:
+            local_td.start()
+
+    def tearDown(self):
+        for local_td in self.local_tds:
+            local_td.stop()
+
+    def test_rebuild_several_instances(self):
+
+        async def rebuild(local_td):
+            async with AsyncTDProxy(local_td.uri) as td_proxy:
+                await rebuild_graph(td_proxy, layout="layered", seed=0)
+                return await td_proxy.get_graph_snapshot(), await td_proxy.get_io_handles()
+
+        async def rebuild_all():
+            return await asyncio.gather(*(rebuild(local_td) for local_td in self.local_tds))
+
+        results = asyncio.run(rebuild_all())
+
+        # Both instances got the same network, seeded the same way.
+        for snapshot, io_handles in results:
+            self.assertEqual(topo_sort_snapshot(snapshot)[-1], io_handles["outputs"][0])
+        self.assertEqual(*(sorted(snapshot["components"], key=str) for snapshot, _ in results))
+
+    def test_bridge_budgets(self):
+
+        async def run():
+            async with AsyncTDProxy(self.local_tds[0].uri) as td_proxy:
+                created = await bridge(td_proxy, [], [],
+                                       exclude_components=["io/*"],
+                                       seed=0,
+                                       max_nodes=4)
+                await td_proxy.clear()
+                # The plan is checked before anything is created.
+                with self.assertRaises(ValueError):
+                    await bridge(td_proxy, [], [], exclude_components=["io/*"], max_depth=0)
+                snapshot = await td_proxy.get_graph_snapshot()
+                return created, snapshot
+
+        created, snapshot = asyncio.run(run())
+
+        self.assertLessEqual(len(created), 4)
+        self.assertTrue(all(snapshot["reserved"]))
+
+    def test_concurrent_reads(self):
+        local_td = self.local_tds[0]
+
+        async def read():
+            async with AsyncTDProxy(local_td.uri, pool_size=4) as td_proxy:
+                handles = (await td_proxy.get_io_handles())["inputs"]
+                frames = local_td.frames
+                descriptors = await asyncio.gather(
+                    *(td_proxy.get_op_descriptor(handle) for handle in handles * 2))
+                return descriptors, local_td.frames - frames
+
+        descriptors, frames = asyncio.run(read())
+
+        # One request per frame would take a frame per read.
+        self.assertEqual(len(descriptors), 10)
+        self.assertLess(frames, 10)
+
+    def test_unbatched_bridge_and_io_events(self):
+        local_td = self.local_tds[0]
+
+        async def run():
+            async with AsyncTDProxy(local_td.uri) as td_proxy:
+                io_events = IOEvents()
+                await io_events.register(td_proxy)
+                try:
+                    created = await bridge(td_proxy, [], [],
+                                           exclude_components=["io/*"],
+                                           batch=False,
+                                           seed=1)
+                    snapshot = await td_proxy.get_graph_snapshot()
+                    local_td.pulse("Iocallback")
+                    io_args = await asyncio.wait_for(io_events.wait(), 5)
+                finally:
+                    io_events.close()
+                return created, snapshot, io_args
+
+        created, snapshot, io_args = asyncio.run(run())
+
+        self.assertTrue(set(created) <= set(snapshot["handles"]))
+        self.assertEqual(len(topo_sort_snapshot(snapshot)), len(snapshot["handles"]))
+        self.assertEqual(io_args, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,370 @@
+"""
+Benchmarks of the graph generation pipeline over synthetic component libraries.
+
+Each run generates a library of random components, then times `load_components`,
+`bridge`, `topo_sort_handles` and `layout_nodes` separately against an in-memory stand-in
+for `TDProxy`, counting the proxy calls each step makes. Results are written as JSON so
+that runs on different commits can be compared:
+
+    python benchmark.py --sizes 10 100 1000 10000 --output benchmark.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Dict, List
+
+from graph_utils import (bridge, topo_sort_handles, layout_nodes, load_components, ComponentCache,
+                         ComponentRegistry, LAYOUT_MODES)
+from rpc_instrumentation import InstrumentedProxy
+
+logger = logging.getLogger(__name__)
+
+
+def generate_library(components_dir: str,
+                     num_components: int,
+                     num_types: int = 8,
+                     max_inputs: int = 3,
+                     max_outputs: int = 3,
+                     source_fraction: float = 0.1,
+                     num_inputs: int = 1,
+                     num_outputs: int = 1,
+                     rng: random.Random = None) -> Dict[str, List[str]]:
+    """
+    Write a synthetic component library to `components_dir`.
+
+    Every type has at least one producer, and a `source_fraction` of the components
+    (at least one per type) have no inputs, so every network can be completed. The other
+    components take 1 to `max_inputs` inputs of random types.
+
+    Returns:
+        An I/O config with `num_inputs` input ops and `num_outputs` output ops, cycling
+        through the types, in the format of `config/io_config.json`.
+    """
+    rng = rng or random.Random(0)
+    types = [f"type_{i}" for i in range(num_types)]
+
+    def write(name, descriptor):
+        path = os.path.join(components_dir, f"{name}.json")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(descriptor, f)
+
+    def ports(port_types):
+        return [{"name": f"port_{i}", "type": t} for i, t in enumerate(port_types)]
+
+    write("types", [{"type": t, "description": "Synthetic type."} for t in types])
+    for t in types:
+        write(f"io/{t}_in", {"inputs": [], "outputs": ports([t])})
+        write(f"io/{t}_out", {"inputs": ports([t]), "outputs": []})
+
+    num_sources = max(num_types, int(num_components * source_fraction))
+    for i in range(num_components):
+        # The first output cycles through the types, so that each has a producer.
+        outputs = [types[i % num_types]]
+        outputs += rng.choices(types, k=rng.randint(0, max_outputs - 1))
+        inputs = [] if i < num_sources else rng.choices(types, k=rng.randint(1, max_inputs))
+        write(f"component_{i:05d}", {
+            "inputs": ports(inputs),
+            "outputs": ports(outputs),
+            "description": "Synthetic component."
+        })
+
+    return {
+        "inputs": [f"io/{types[i % num_types]}_in" for i in range(num_inputs)],
+        "outputs": [f"io/{types[i % num_types]}_out" for i in range(num_outputs)],
+    }
+
+
+class SimulatedTDProxy:
+    """
+    An in-memory stand-in for `TDProxy`, implementing the calls made by `bridge`,
+    `topo_sort_handles` and `layout_nodes` on plain dicts.
+    """
+
+    def __init__(self, components: Dict[str, dict], io_config: Dict[str, List[str]]):
+        self.components = components
+        self.next_handle = 0
+        self.loaded = {}  # handle -> component name
+        self.inputs = {}  # (handle, input_index) -> (source handle, source index)
+        self.positions = {}
+        self.input_handles = [self.load(name) for name in io_config["inputs"]]
+        self.output_handles = [self.load(name) for name in io_config["outputs"]]
+        self.io_handles = set(self.input_handles + self.output_handles)
+
+    def get_io_handles(self):
+        return {"inputs": self.input_handles, "outputs": self.output_handles}
+
+    def get_op_descriptor(self, handle):
+        return self.components[self.loaded[handle]]
+
+    def get_op_descriptors(self, handles):
+        return [self.get_op_descriptor(handle) for handle in handles]
+
+    def load(self, name):
+        handle = self.next_handle
+        self.next_handle += 1
+        self.loaded[handle] = name
+        self.positions[handle] = (0, 0)
+        return handle
+
+    def connect(self, output_handle, output_index, input_handle, input_index):
+        self.inputs[(input_handle, input_index)] = (output_handle, output_index)
+        return True
+
+    def disconnect(self, handle, in_indices, out_indices):
+        for index in in_indices:
+            self.inputs.pop((handle, index), None)
+        return True
+
+    def delete_op(self, handle):
+        del self.loaded[handle]
+        self.inputs = {
+            target: source
+            for target, source in self.inputs.items()
+            if target[0] != handle and source[0] != handle
+        }
+        return True
+
+    def set_op_attribute(self, handle, attribute, value):
+        return True
+
+    def clear(self):
+        for handle in list(self.loaded):
+            if handle not in self.io_handles:
+                self.delete_op(handle)
+
+    def apply_plan(self, plan):
+        for handle, input_index in plan.get("disconnect", []):
+            self.disconnect(handle, [input_index], [])
+        for handle in plan.get("destroy", []):
+            self.delete_op(handle)
+        handles = {node["id"]: self.load(node["component"]) for node in plan.get("nodes", [])}
+
+        def resolve(node):
+            return handles[node] if isinstance(node, str) else node
+
+        for source, source_index, target, target_index in plan.get("edges", []):
+            self.connect(resolve(source), source_index, resolve(target), target_index)
+        return {"handles": handles, "failed_edges": [], "failed_attributes": []}
+
+    def get_graph_snapshot(self, handles=None):
+        edges = [(source, source_index, target, target_index)
+                 for (target, target_index), (source, source_index) in self.inputs.items()]
+        nodes = set(self.loaded if handles is None else handles)
+        nodes.update(source for source, _, target, _ in edges if target in nodes)
+        return {
+            "handles": list(nodes),
+            "components": [self.loaded[handle] for handle in nodes],
+            "reserved": [handle in self.io_handles for handle in nodes],
+            "edges": [edge for edge in edges if edge[0] in nodes and edge[2] in nodes],
+        }
+
+    def get_nodes_geometry(self, handles):
+        return [self.positions[handle] + (100, 100) for handle in handles]
+
+    def set_nodes_positions(self, positions):
+        self.positions.update(positions)
+        return True
+
+
+def _time_ms(function, repeats: int):
+    """Run `function` `repeats` times, returning its last result and the times in ms."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1000)
+    return result, times
+
+
+def _summary(times: List[float]) -> dict:
+    if not times:
+        return {"runs": 0}
+    return {
+        "median_ms": statistics.median(times),
+        "min_ms": min(times),
+        "max_ms": max(times),
+        "runs": len(times),
+    }
+
+
+def _call_counts(td_proxy: InstrumentedProxy) -> Dict[str, int]:
+    counts = {name: stats["count"] for name, stats in td_proxy.get_client_stats().items()}
+    td_proxy.reset_client_stats()
+    return counts
+
+
+def run_benchmark(num_components: int,
+                  num_types: int = 8,
+                  max_inputs: int = 3,
+                  max_outputs: int = 3,
+                  num_inputs: int = 1,
+                  num_outputs: int = 1,
+                  reuse_weight: float = 0.7,
+                  repeats: int = 5,
+                  batch: bool = True,
+                  layout: str = "row",
+                  seed: int = 0) -> dict:
+    """
+    Benchmark each step of a rebuild on a freshly generated library.
+
+    Returns:
+        The median, min and max time of each step, the proxy calls made by one run of
+        each step, and the size of the generated networks.
+    """
+    rng = random.Random(seed)
+    with tempfile.TemporaryDirectory() as components_dir:
+        io_config = generate_library(components_dir,
+                                     num_components,
+                                     num_types,
+                                     max_inputs,
+                                     max_outputs,
+                                     num_inputs=num_inputs,
+                                     num_outputs=num_outputs,
+                                     rng=rng)
+
+        # Every run parses every file, then the cache is only checked for changes.
+        _, cold_times = _time_ms(lambda: load_components(components_dir, cache=None), repeats)
+        cache = ComponentCache()
+        load_components(components_dir, cache=cache)
+        all_components, warm_times = _time_ms(lambda: load_components(components_dir, cache=cache),
+                                              repeats)
+
+    components = {
+        name: descriptor
+        for name, descriptor in all_components.items()
+        if not name.startswith("io/")
+    }
+    registry = ComponentRegistry(components)
+    simulated = SimulatedTDProxy(all_components, io_config)
+    td_proxy = InstrumentedProxy(simulated, measure_payload=False)
+
+    results = {
+        "load_components_cold": _summary(cold_times),
+        "load_components_cached": _summary(warm_times),
+    }
+    calls = {}
+    bridge_times, topo_times, layout_times, network_sizes = [], [], [], []
+    failures = []
+    random.seed(seed)
+    for _ in range(repeats):
+        simulated.clear()
+        td_proxy.reset_client_stats()
+
+        try:
+            start = time.perf_counter()
+            created = bridge(td_proxy, [], [], reuse_weight, batch=batch, registry=registry)
+            bridge_times.append((time.perf_counter() - start) * 1000)
+            calls["bridge"] = _call_counts(td_proxy)
+
+            handles = created + simulated.input_handles + simulated.output_handles
+            snapshot = simulated.get_graph_snapshot(handles)
+            network_sizes.append((len(snapshot["handles"]), len(snapshot["edges"])))
+
+            start = time.perf_counter()
+            sorted_handles = topo_sort_handles(td_proxy, handles)
+            topo_times.append((time.perf_counter() - start) * 1000)
+            calls["topo_sort_handles"] = _call_counts(td_proxy)
+
+            start = time.perf_counter()
+            layout_nodes(td_proxy, sorted_handles, layout)
+            layout_times.append((time.perf_counter() - start) * 1000)
+            calls["layout_nodes"] = _call_counts(td_proxy)
+        except ValueError as e:
+            # A generated network can be invalid (e.g. have a cycle); record it and go on.
+            logger.warning("Run failed with %d components: %s", num_components, e)
+            failures.append(str(e))
+
+    results["bridge"] = _summary(bridge_times)
+    results["topo_sort_handles"] = _summary(topo_times)
+    results["layout_nodes"] = _summary(layout_times)
+    return {
+        "params": {
+            "num_components": num_components,
+            "num_types": num_types,
+            "max_inputs": max_inputs,
+            "max_outputs": max_outputs,
+            "num_inputs": num_inputs,
+            "num_outputs": num_outputs,
+            "reuse_weight": reuse_weight,
+            "repeats": repeats,
+            "batch": batch,
+            "layout": layout,
+            "seed": seed,
+        },
+        "timings": results,
+        "proxy_calls": calls,
+        "network": {
+            "nodes": statistics.median(nodes for nodes, _ in network_sizes),
+            "edges": statistics.median(edges for _, edges in network_sizes),
+        } if network_sizes else None,
+        "failures": failures,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"],
+                              cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True,
+                              text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--types", type=int, default=8, help="Number of port types")
+    parser.add_argument("--max-inputs", type=int, default=3, help="Maximum inputs per component")
+    parser.add_argument("--max-outputs", type=int, default=3, help="Maximum outputs per component")
+    parser.add_argument("--inputs", type=int, default=1, help="Number of I/O config inputs")
+    parser.add_argument("--outputs", type=int, default=1, help="Number of I/O config outputs")
+    parser.add_argument("--reuse-weight", type=float, default=0.7)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--unbatched",
+                        action="store_true",
+                        help="Make one proxy call per node and edge instead of batched calls")
+    parser.add_argument("--layout", choices=LAYOUT_MODES, default="row")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark.json")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(name)s - %(levelname)s - %(message)s')
+
+    runs = []
+    for size in args.sizes:
+        run = run_benchmark(size, args.types, args.max_inputs, args.max_outputs, args.inputs,
+                            args.outputs, args.reuse_weight, args.repeats, not args.unbatched,
+                            args.layout, args.seed)
+        timings = run["timings"]
+        print(f"{size:>6} components: " +
+              ", ".join(f"{step} {timing['median_ms']:.2f} ms" for step, timing in timings.items()
+                        if timing["runs"]) + f", {len(run['failures'])} failed runs")
+        runs.append(run)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "commit": _git_commit(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "timestamp": time.time(),
+                "runs": runs,
+            },
+            f,
+            indent=2)
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,127 @@
 import Pyro5.api
 import argparse
-from graph_utils import bridge, topo_sort_handles, layout_nodes
+from graph_utils import (bridge, topo_sort_handles, layout_nodes, COMPONENT_CACHE, LAYOUT_MODES,
+                         CompactGraph, CostDatabase, PlanCancelled)
+from rpc_instrumentation import InstrumentedProxy
+from rpc_trace import RecordingProxy
+import collections
 import logging
 import threading
+import time
 
 td_proxy_container = [None]
 
-rebuild_lock = threading.Lock()
+LOG_LEVELS = ("DEBUG", "INFO", "WARNING", "ERROR")
+
+# Number of rebuilds the queue latency stats are kept for.
+REBUILD_STATS_WINDOW = 100
+
+logger = logging.getLogger(__name__)
+
+
+class RebuildRequests:
+    """
+    The pending rebuild, requested by the I/O callback.
+
+    Requests made while a rebuild is pending are coalesced into it, and a request made
+    while a rebuild is running supersedes it, so that the rebuild can be cancelled (see
+    `superseded`). However many requests come in, at most one rebuild is waiting.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.generation = 0  # Incremented by every request
+        self.pending_since = None  # Time of the oldest request not being rebuilt yet
+        self.io_args = None
+        self.requests = 0
+        self.coalesced = 0
+        self.rebuilds = 0
+        self.cancelled = 0
+        self.queue_ms = collections.deque(maxlen=REBUILD_STATS_WINDOW)
+
+    def request(self, io_args=None):
+        with self.condition:
+            self.generation += 1
+            self.requests += 1
+            self.io_args = io_args
+            if self.pending_since is None:
+                self.pending_since = time.perf_counter()
+            else:
+                self.coalesced += 1
+            self.condition.notify()
+
+    def wait(self, timeout=None):
+        """Wait for a request and take it.
+
+        Returns:
+            The generation and I/O args of the latest request, and how long the oldest
+            pending request waited in milliseconds, or None after `timeout` seconds.
+        """
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.pending_since is not None, timeout):
+                return None
+            queue_ms = (time.perf_counter() - self.pending_since) * 1000
+            self.queue_ms.append(queue_ms)
+            self.pending_since = None
+            self.rebuilds += 1
+            return self.generation, self.io_args, queue_ms
+
+    def superseded(self, generation):
+        """Whether a request came in after the one of `generation` was taken."""
+        return self.generation != generation
+
+    def stats(self):
+        with self.condition:
+            queue_ms = list(self.queue_ms)
+            return {
+                "requests": self.requests,
+                "rebuilds": self.rebuilds,
+                "coalesced": self.coalesced,
+                "cancelled": self.cancelled,
+                "mean_queue_ms": sum(queue_ms) / len(queue_ms) if queue_ms else 0.0,
+                "max_queue_ms": max(queue_ms, default=0.0),
+            }
 
 
 @Pyro5.api.expose  # Expose this class to be accessible over Pyro
 class IOCallback:
 
-    def __init__(self, td_proxy):
-        self.td_proxy = td_proxy  # Store the original proxy
+    def __init__(self, rebuild_requests):
+        self.rebuild_requests = rebuild_requests
 
     @Pyro5.api.expose  # Make sure to expose the method
     def notify(self, args):  # Changed from __call__ to a named method
-        print(f"Callback received: {args}")
-        rebuild_lock.release()
+        logger.info("Callback received: %s", args)
+        self.rebuild_requests.request(args)
+
 
+def rebuild_graph(td_proxy,
+                  layout="row",
+                  incremental=False,
+                  double_buffered=False,
+                  chunked=False,
+                  seed=None,
+                  pipelined=False,
+                  cancel=None,
+                  candidates=1,
+                  search_deadline=None,
+                  cost_budget=None,
+                  costs=None):
+    """
+    Build a new network from the I/O config and lay it out.
 
-def rebuild_graph(td_proxy):
-    td_proxy.clear()
+    `cancel` is checked between steps (see `graph_utils.apply_plan`), stopping the
+    rebuild with `PlanCancelled` when it returns True. With a `cost_budget`, the network
+    is planned to cook within that many milliseconds per frame, given the `costs` of the
+    components.
+    """
+
+    def check_cancelled(step):
+        if cancel is not None and cancel():
+            raise PlanCancelled(f"Rebuild cancelled before {step}")
+
+    if not incremental:
+        td_proxy.clear()
     # Create a test network by bridging to the output handles from the I/O config.
     created_nodes = bridge(td_proxy,
                            input_handles=[],
@@ -30,62 +129,170 @@ def rebuild_graph(td_proxy):
                            exclude_components=[
                                "io/*",
                            ],
-                           include_io_config=True)
+                           include_io_config=True,
+                           batch=True,
+                           incremental=incremental,
+                           chunked=chunked,
+                           seed=seed,
+                           pipelined=pipelined,
+                           cancel=cancel,
+                           candidates=candidates,
+                           search_deadline=search_deadline,
+                           cost_budget=cost_budget,
+                           costs=costs)
+    check_cancelled("layout")
 
     # Sort and layout the created nodes
     io_handles = td_proxy.get_io_handles()
     all_nodes = created_nodes + io_handles["inputs"] + io_handles["outputs"]
-    print(f"All nodes: {all_nodes}")
-    sorted_handles = topo_sort_handles(td_proxy, all_nodes)
-    layout_nodes(td_proxy, sorted_handles)
+    logger.debug("All nodes: %s", all_nodes)
+    graph = CompactGraph.from_snapshot(td_proxy.get_graph_snapshot(all_nodes))
+    sorted_handles = topo_sort_handles(td_proxy, all_nodes, graph)
+    layout_nodes(td_proxy, sorted_handles, layout, graph, pipelined)
+
+    if double_buffered:
+        # The graph was built in the back network, show it.
+        check_cancelled("swapping buffers")
+        td_proxy.swap_buffers()
 
 
 def main():
     global rebuild_flag
-    # Add at the top of the file, before any other imports
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(name)s - %(levelname)s - %(message)s',
-        force=True  # This ensures we override any existing configuration
-    )
-
-    # Set up root logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.DEBUG)
-
     parser = argparse.ArgumentParser()
     parser.add_argument("--port", type=int, default=60883)
     parser.add_argument("--test-network", action="store_true")
+    parser.add_argument("--layout", choices=LAYOUT_MODES, default="row")
+    parser.add_argument("--incremental",
+                        action="store_true",
+                        help="Keep the ops shared with the new network instead of rebuilding")
+    parser.add_argument("--double-buffer",
+                        action="store_true",
+                        help="Build each graph in a hidden network and swap it in when done")
+    parser.add_argument("--chunked",
+                        action="store_true",
+                        help="Apply each graph over several frames instead of in a single one, "
+                        "so that a newer request can cancel it in between")
+    parser.add_argument("--pipelined",
+                        action="store_true",
+                        help="Send the node positions as oneway calls, checking for errors "
+                        "with a single flush")
+    parser.add_argument("--candidates",
+                        type=int,
+                        default=1,
+                        help="Plan this many networks on all cores and build the best scoring one")
+    parser.add_argument("--search-deadline",
+                        type=float,
+                        help="Seconds to plan the candidates for, at most")
+    parser.add_argument("--cost-budget",
+                        type=float,
+                        help="Milliseconds per frame the generated network may cook for, "
+                        "as estimated from the component costs")
+    parser.add_argument("--cost-db",
+                        metavar="PATH",
+                        help="Measure the cook times of each network before replacing it, "
+                        "and keep them in PATH to estimate component costs from")
+    parser.add_argument("--frame-budget",
+                        type=float,
+                        help="Milliseconds per frame TouchDesigner spends on requests")
+    parser.add_argument("--profile",
+                        metavar="PATH",
+                        help="Record RPC counts, latencies and payload sizes, written as JSON to "
+                        "PATH after each rebuild")
+    parser.add_argument("--seed",
+                        type=int,
+                        help="Seed the generated networks, for reproducible runs (the n-th "
+                        "rebuild uses SEED + n)")
+    parser.add_argument("--record-trace",
+                        metavar="PATH",
+                        help="Record every RPC, written to PATH after each rebuild for replay "
+                        "with rpc_trace.py")
+    parser.add_argument("--log-level",
+                        choices=LOG_LEVELS,
+                        default="INFO",
+                        help="Level of the client's log")
+    parser.add_argument("--td-log-level",
+                        choices=LOG_LEVELS,
+                        help="Level of the TouchDesigner script DAT's log")
+    parser.add_argument("--component-cache",
+                        help="File to persist parsed component descriptors in between runs")
 
     args = parser.parse_args()
 
+    logging.basicConfig(
+        level=args.log_level,
+        format='%(name)s - %(levelname)s - %(message)s',
+        force=True  # This ensures we override any existing configuration
+    )
+
+    if args.component_cache:
+        COMPONENT_CACHE.load_snapshot(args.component_cache)
+
     uri = f"PYRO:td@localhost:{args.port}"
     td_proxy = Pyro5.api.Proxy(uri)
     print("Connected to TouchDesigner!")
+    if args.profile:
+        td_proxy = profiler = InstrumentedProxy(td_proxy)
+        td_proxy.enable_rpc_stats()
+    if args.record_trace:
+        td_proxy = recorder = RecordingProxy(td_proxy, {"seed": args.seed})
 
     # Create a Pyro daemon for the callback object
+    rebuild_requests = RebuildRequests()
     daemon = Pyro5.api.Daemon()
-    callback = IOCallback(td_proxy)  # Pass the original proxy
+    callback = IOCallback(rebuild_requests)
     uri = daemon.register(callback)
 
     # Register the callback's URI instead of the function
     td_proxy.register_io_callback(uri)
 
+    td_proxy.set_double_buffered(args.double_buffer)
+    if args.frame_budget is not None:
+        td_proxy.set_frame_budget(args.frame_budget)
+    if args.td_log_level:
+        td_proxy.set_log_level(args.td_log_level)
+
+    rebuilds = 0
+    cost_db = CostDatabase(args.cost_db) if args.cost_db else None
+
+    def rebuild(cancel=None):
+        nonlocal rebuilds
+        seed = None if args.seed is None else args.seed + rebuilds
+        rebuilds += 1
+        costs = None
+        if cost_db is not None:
+            # The network being replaced has been cooking since the last rebuild.
+            measured = cost_db.update(td_proxy.get_cook_times())
+            cost_db.save()
+            costs = cost_db.costs()
+            logger.debug("Measured %d cook times, costs: %s", measured, costs)
+        try:
+            rebuild_graph(td_proxy, args.layout, args.incremental, args.double_buffer, args.chunked,
+                          seed, args.pipelined, cancel, args.candidates, args.search_deadline,
+                          args.cost_budget, costs)
+        finally:
+            if args.profile:
+                profiler.dump_json(args.profile)
+            if args.record_trace:
+                recorder.save(args.record_trace)
+
     if args.test_network:
-        rebuild_graph(td_proxy)
+        rebuild()
 
     # Start the daemon loop in a separate thread
     thread = threading.Thread(target=daemon.requestLoop, daemon=True)
     thread.start()
 
-    rebuild_lock.acquire()
-
     while True:
-        rebuild_lock.acquire()
+        generation, io_args, queue_ms = rebuild_requests.wait()
+        logger.info("Rebuilding for %s, queued for %.1f ms", io_args, queue_ms)
         try:
-            rebuild_graph(td_proxy)
+            rebuild(cancel=lambda: rebuild_requests.superseded(generation))
+        except PlanCancelled as e:
+            rebuild_requests.cancelled += 1
+            logger.info("%s, a newer request came in", e)
         except Exception as e:
-            print(f"Error: {e}")
+            logger.error("Error: %s", e)
+        logger.debug("Rebuild stats: %s", rebuild_requests.stats())
 
 
 if __name__ == "__main__":
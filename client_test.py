@@ -0,0 +1,80 @@
+import threading
+import unittest
+
+import Pyro5.api
+
+from client import RebuildRequests, rebuild_graph
+from graph_utils import PlanCancelled
+from local_td import LocalTouchDesigner
+from rpc_trace import RecordingProxy
+
+
+class TestRebuildRequests(unittest.TestCase):
+
+    def test_coalescing(self):
+        requests = RebuildRequests()
+        self.assertIsNone(requests.wait(timeout=0))
+
+        for i in range(5):
+            requests.request({"press": i})
+        generation, io_args, queue_ms = requests.wait()
+
+        # The burst is a single rebuild, for the latest args.
+        self.assertEqual(io_args, {"press": 4})
+        self.assertGreaterEqual(queue_ms, 0)
+        self.assertIsNone(requests.wait(timeout=0))
+        self.assertFalse(requests.superseded(generation))
+
+        requests.request({"press": 5})
+        self.assertTrue(requests.superseded(generation))
+        stats = requests.stats()
+        self.assertEqual((stats["requests"], stats["rebuilds"], stats["coalesced"]), (6, 1, 4))
+
+    def test_wait_wakes_up(self):
+        requests = RebuildRequests()
+        threading.Timer(0.01, requests.request, [{"press": 0}]).start()
+        self.assertEqual(requests.wait(timeout=5)[1], {"press": 0})
+
+
+class TestRebuildCancellation(unittest.TestCase):
+
+    def setUp(self):
+        self.local_td = LocalTouchDesigner(fps=200, latencies={"loadTox": 0.001})
+        self.local_td.start()
+        self.td_proxy = Pyro5.api.Proxy(self.local_td.uri)
+
+    def tearDown(self):
+        self.td_proxy._pyroRelease()
+        self.local_td.stop()
+
+    def test_cancel_chunked_rebuild(self):
+        self.td_proxy.set_frame_budget(0.5)
+        requests = RebuildRequests()
+        requests.request()
+        generation, _, _ = requests.wait()
+        polls = []
+
+        def cancel():
+            # A newer request comes in while the plan is being applied.
+            polls.append(generation)
+            if len(polls) == 2:
+                requests.request()
+            return requests.superseded(generation)
+
+        recording = RecordingProxy(self.td_proxy)
+        with self.assertRaises(PlanCancelled):
+            rebuild_graph(recording, chunked=True, seed=0, cancel=cancel)
+
+        # The job was dropped from TouchDesigner's queue, and the next rebuild goes through.
+        job_id, = [call["result"] for call in recording.calls if call["method"] == "submit_plan"]
+        with self.assertRaises(KeyError):
+            self.td_proxy.get_plan_status(job_id)
+        generation, _, _ = requests.wait()
+        rebuild_graph(self.td_proxy,
+                      chunked=True,
+                      seed=0,
+                      cancel=lambda: requests.superseded(generation))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,257 @@
+"""
+A pure Python stand-in for the parts of TouchDesigner's `td` module that `script_dat.py`
+uses: ops with parents and children, `loadTox`/`create`, connectors, `store`/`fetch`,
+node geometry, cook times and `destroy`.
+
+Ops loaded from a `.tox` get their connectors from the component descriptor next to
+it, and in/out ops inside a COMP give it input/output connectors, as in TouchDesigner.
+Each operation can be given a latency (in seconds) to emulate the cost of the real
+thing, e.g. `FakeTD(latencies={"loadTox": 0.02})`.
+"""
+import json
+import os
+import re
+import sys
+import time
+import types
+from typing import Dict, List, Tuple
+
+# The operations that can be given a latency.
+LATENCY_OPERATIONS = ("loadTox", "create", "connect", "disconnect", "destroy", "store", "fetch")
+
+# (inputs, outputs) connector counts of the built-in op types that TDProxy and the bundled
+# components create. Other types get one of each.
+_BUILTIN_CONNECTORS = {
+    "displaceTOP": (2, 1),
+    "edgeTOP": (1, 1),
+    "mergeCHOP": (16, 1),  # Takes any number of inputs in TouchDesigner
+    "speedCHOP": (2, 1),
+    "inTOP": (0, 1),
+    "inCHOP": (0, 1),
+    "outTOP": (1, 0),
+    "outCHOP": (1, 0),
+    "switchTOP": (2, 1),
+    "switchCHOP": (2, 1),
+    "nullTOP": (1, 1),
+    "nullCHOP": (1, 1),
+    "baseCOMP": (0, 0),
+}
+
+
+class Connector:
+
+    def __init__(self, owner, index, is_top):
+        self.owner = owner
+        self.index = index
+        self.isTOP = is_top
+        self.isCHOP = not is_top
+        self.connections = []
+
+    def connect(self, other):
+        """Connect an output connector to an input connector (or the other way round)."""
+        self.owner.td.simulate("connect")
+        output, input_ = (self, other) if self in self.owner.outputConnectors else (other, self)
+        # An input takes a single connection.
+        for previous in list(input_.connections):
+            previous.connections.remove(input_)
+        input_.connections = [output]
+        output.connections.append(input_)
+
+    def disconnect(self):
+        self.owner.td.simulate("disconnect")
+        for other in self.connections:
+            other.connections.remove(self)
+        self.connections = []
+
+    def __repr__(self):
+        direction = "out" if self in self.owner.outputConnectors else "in"
+        return f"Connector({self.owner.path}, {direction}{self.index})"
+
+
+class FakeOp:
+
+    def __init__(self, td, name, op_type, parent=None, input_tops=(), output_tops=()):
+        self.td = td
+        self.name = name
+        self.OPType = op_type
+        self._parent = parent
+        self.children: List[FakeOp] = []
+        self.storage = {}
+        self.par = types.SimpleNamespace()
+        self.customPars = []
+        self.inputConnectors = [Connector(self, i, top) for i, top in enumerate(input_tops)]
+        self.outputConnectors = [Connector(self, i, top) for i, top in enumerate(output_tops)]
+        self.nodeX = 0
+        self.nodeY = 0
+        self.nodeWidth = 130
+        self.nodeHeight = 90
+        self.allowCooking = True
+        self.totalCooks = 0
+        self.cpuCookTime = 0.0
+        self.gpuCookTime = 0.0
+        self.childrenCPUCookTime = 0.0
+        self.childrenGPUCookTime = 0.0
+        self.bypass = False
+        self.expose = True
+        self.valid = True
+
+    @property
+    def path(self):
+        if self._parent is None:
+            return ""
+        return f"{self._parent.path}/{self.name}"
+
+    @property
+    def isCOMP(self):
+        return self.OPType.endswith("COMP")
+
+    def parent(self):
+        return self._parent
+
+    def op(self, name):
+        return next((child for child in self.children if child.name == name), None)
+
+    def store(self, key, value):
+        self.td.simulate("store")
+        self.storage[key] = value
+
+    def fetch(self, key, default=None):
+        self.td.simulate("fetch")
+        return self.storage.get(key, default)
+
+    def unstore(self, key):
+        self.storage.pop(key, None)
+
+    def create(self, op_type):
+        self.td.simulate("create")
+        num_inputs, num_outputs = _BUILTIN_CONNECTORS.get(op_type, (1, 1))
+        is_top = op_type.endswith("TOP")
+        return self._add_child(op_type, op_type, [is_top] * num_inputs, [is_top] * num_outputs)
+
+    def loadTox(self, tox_path):
+        """Load a component, with the connectors of the descriptor next to the `.tox`."""
+        self.td.simulate("loadTox")
+        descriptor = self.td.tox_descriptor(tox_path)
+        name = os.path.splitext(os.path.basename(tox_path))[0]
+        child = self._add_child(name, "baseCOMP",
+                                [self.td.is_top(port["type"]) for port in descriptor["inputs"]],
+                                [self.td.is_top(port["type"]) for port in descriptor["outputs"]])
+        if name in self.td.cook_times:
+            # As if it had cooked since, in that many milliseconds.
+            child.totalCooks = 1
+            child.cpuCookTime, child.gpuCookTime = self.td.cook_times[name]
+        return child
+
+    def destroy(self):
+        self.td.simulate("destroy")
+        for child in list(self.children):
+            child.destroy()
+        for connector in self.inputConnectors + self.outputConnectors:
+            for other in connector.connections:
+                other.connections.remove(connector)
+            connector.connections = []
+        if self._parent is not None:
+            self._parent.children.remove(self)
+            self._parent._update_io_connectors(self, added=False)
+        self.valid = False
+
+    def _add_child(self, base_name, op_type, input_tops, output_tops):
+        # Names are unique within a COMP, e.g. "inTOP" -> "in1", "in2", ...
+        base_name = re.sub(r"(TOP|CHOP|SOP|DAT|COMP|MAT)$", "", base_name) or base_name
+        names = {child.name for child in self.children}
+        index = 1
+        while f"{base_name}{index}" in names:
+            index += 1
+        child = FakeOp(self.td, f"{base_name}{index}", op_type, self, input_tops, output_tops)
+        self.children.append(child)
+        self._update_io_connectors(child, added=True)
+        return child
+
+    def _update_io_connectors(self, child, added):
+        """In and out ops inside a COMP are its input and output connectors."""
+        if child.OPType in ("inTOP", "inCHOP"):
+            connectors = self.inputConnectors
+        elif child.OPType in ("outTOP", "outCHOP"):
+            connectors = self.outputConnectors
+        else:
+            return
+        if added:
+            connectors.append(Connector(self, len(connectors), child.OPType.endswith("TOP")))
+        else:
+            # The connectors of the remaining in/out ops keep their order.
+            removed = connectors.pop()
+            for other in removed.connections:
+                other.connections.remove(removed)
+
+    def __repr__(self):
+        return f"FakeOp({self.path})"
+
+
+class FakeTD:
+    """
+    An emulated TouchDesigner project with a `/project1` COMP.
+
+    Args:
+        components_dir: The components directory, whose `types.json` tells TOP types
+            (`"td_type": "top"`) from CHOP ones.
+        latencies: Seconds to sleep in each operation of `LATENCY_OPERATIONS`.
+        cook_times: The (CPU, GPU) cook times in milliseconds reported by the ops loaded
+            from a `.tox`, by file name without extension. Other ops never cook.
+    """
+
+    def __init__(self,
+                 components_dir: str,
+                 latencies: Dict[str, float] = None,
+                 cook_times: Dict[str, Tuple[float, float]] = None):
+        self.latencies = dict(latencies or {})
+        self.cook_times = dict(cook_times or {})
+        unknown = set(self.latencies) - set(LATENCY_OPERATIONS)
+        if unknown:
+            raise ValueError(f"Unknown operations {sorted(unknown)}, "
+                             f"expected some of {LATENCY_OPERATIONS}")
+        self.counts = dict.fromkeys(LATENCY_OPERATIONS, 0)
+        self.top_types = set()
+        types_path = os.path.join(components_dir, "types.json")
+        if os.path.exists(types_path):
+            with open(types_path) as f:
+                self.top_types = {t["type"] for t in json.load(f) if t.get("td_type") == "top"}
+        self.descriptors = {}
+
+        self.root = FakeOp(self, "", "root")
+        self.project = FakeOp(self, "project1", "baseCOMP", self.root)
+        self.root.children.append(self.project)
+
+    def simulate(self, operation):
+        self.counts[operation] += 1
+        latency = self.latencies.get(operation)
+        if latency:
+            time.sleep(latency)
+
+    def is_top(self, port_type):
+        return port_type in self.top_types
+
+    def tox_descriptor(self, tox_path):
+        descriptor = self.descriptors.get(tox_path)
+        if descriptor is None:
+            json_path = os.path.splitext(tox_path)[0] + ".json"
+            with open(json_path) as f:
+                descriptor = self.descriptors[tox_path] = json.load(f)
+        return descriptor
+
+    def op(self, path):
+        current = self.root
+        for name in path.strip("/").split("/"):
+            current = current.op(name) if current is not None else None
+        return current
+
+    def module(self):
+        """A module to install as `td`."""
+        module = types.ModuleType("td")
+        module.op = self.op
+        module.fake = self
+        return module
+
+    def install(self):
+        """Make `import td` return this project."""
+        sys.modules["td"] = self.module()
+        return sys.modules["td"]
@@ -2,67 +2,1735 @@ import json
 import os
 import random
 import logging
-from typing import Dict, List, Set, Tuple
+from typing import Callable, Dict, List, Optional, Set, Tuple, Union
 from pathlib import Path
+import array
 import fnmatch  # Add this to the imports at the top
+import functools
+import itertools
+import multiprocessing
+import time
+import uuid
+from collections import Counter, deque
 
-# Configure logger
+import numpy as np
+
+# The level is left to the application (see `--log-level` in client.py). Debug messages
+# in loops are guarded with `logger.isEnabledFor`, so they cost nothing when disabled.
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)  # Change from INFO to DEBUG
 
+# The components directory lives next to this file.
+COMPONENTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "components")
+
+
+class ComponentCache:
+    """
+    Parsed component descriptors, keyed by file path and invalidated by mtime and size.
+
+    Lives for the whole process, so repeated `load_components` calls only re-parse the
+    files that changed. When `snapshot_path` is given, the cache is also persisted there
+    as compact JSON, so that a new process starts warm.
+
+    Cached descriptors are shared between calls and must not be modified.
+    """
+
+    SNAPSHOT_VERSION = 1
+
+    def __init__(self, snapshot_path: str = None):
+        self.entries = {}  # path -> (mtime_ns, size, parsed JSON)
+        self.snapshot_path = snapshot_path
+        self.dirty = False
+        self.parsed_count = 0
+        self.last_stats = None  # Stats of the last load_components call
+
+        if snapshot_path:
+            self.load_snapshot(snapshot_path)
+
+    def load_snapshot(self, snapshot_path: str):
+        """Persist the cache at `snapshot_path`, starting from its contents if it exists."""
+        self.snapshot_path = snapshot_path
+        if not os.path.exists(snapshot_path):
+            return
+        try:
+            with open(snapshot_path) as f:
+                snapshot = json.load(f)
+            if snapshot.get("version") == self.SNAPSHOT_VERSION:
+                self.entries.update(
+                    (path, tuple(entry)) for path, entry in snapshot["entries"].items())
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Ignoring unreadable component cache %s: %s", snapshot_path, e)
+
+    def load(self, path: str):
+        """Return the parsed JSON at `path`, re-parsing it only if it changed."""
+        stat = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry[0] == stat.st_mtime_ns and entry[1] == stat.st_size:
+            return entry[2]
+
+        with open(path) as f:
+            value = json.load(f)
+        self.entries[path] = (stat.st_mtime_ns, stat.st_size, value)
+        self.dirty = True
+        self.parsed_count += 1
+        return value
+
+    def retain(self, directory: str, paths: Set[str]):
+        """Drop the entries under `directory` that are not in `paths` (e.g. deleted files)."""
+        prefix = os.path.join(directory, "")
+        stale = [path for path in self.entries if path.startswith(prefix) and path not in paths]
+        for path in stale:
+            del self.entries[path]
+        self.dirty = self.dirty or bool(stale)
+
+    def save(self):
+        """Write the snapshot, if there is one and anything changed since it was read."""
+        if not self.snapshot_path or not self.dirty:
+            return
+        snapshot = {"version": self.SNAPSHOT_VERSION, "entries": self.entries}
+        tmp_path = self.snapshot_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(tmp_path, self.snapshot_path)
+        self.dirty = False
+
+
+# Process-wide descriptor cache used by `load_components` by default.
+COMPONENT_CACHE = ComponentCache()
+
+
+def load_components(components_dir: str,
+                    exclude: List[str] = [],
+                    cache: ComponentCache = COMPONENT_CACHE) -> Dict[str, dict]:
+    """
+    Load all component descriptors from the components directory.
+
+    Descriptors are read through `cache`, so only new or modified files are parsed.
+    Pass `cache=None` to parse every file.
+    """
+    start_time = time.perf_counter()
+    if cache is None:
+        cache = ComponentCache()
+    parsed_before = cache.parsed_count
 
-def load_components(components_dir: str, exclude: List[str] = []) -> Dict[str, dict]:
-    """Load all component descriptors from the components directory."""
     components = {}
-    components_path = Path(components_dir)
+    seen_paths = set()
 
     # Load types.json first
-    with open(os.path.join(components_dir, "types.json")) as f:
-        types = json.load(f)
-        logger.debug(f"[DEBUG] Loaded types: {types}")
+    types_path = os.path.join(components_dir, "types.json")
+    cache.load(types_path)
+    seen_paths.add(types_path)
 
-    # Recursively walk through all directories
+    # Recursively walk through all directories, in a fixed order so that seeded plans
+    # don't depend on the file system's listing order
     for root, dirs, files in os.walk(components_dir):
-        for filename in files:
+        dirs.sort()
+        for filename in sorted(files):
             if filename.endswith('.json') and filename != 'types.json':
-
                 json_path = os.path.join(root, filename)
-                with open(json_path) as f:
-                    # Get name without .json, but keep subdirectory structure
-                    rel_path = os.path.relpath(json_path, components_dir)
+                # Get name without .json, but keep subdirectory structure
+                rel_path = os.path.relpath(json_path, components_dir)
+                seen_paths.add(json_path)
+
+                # Exclude patterns are given relative to the components directory
+                if any(fnmatch.fnmatch(rel_path, pattern) for pattern in exclude):
+                    continue
+
+                name = rel_path[:-5]  # Remove .json
+                components[name] = cache.load(json_path)
+
+    cache.retain(components_dir, seen_paths)
+    cache.save()
+
+    parsed = cache.parsed_count - parsed_before
+    cache.last_stats = {
+        "files": len(seen_paths),
+        "parsed": parsed,
+        "seconds": time.perf_counter() - start_time,
+    }
+    logger.info("Loaded %d components (%d of %d files parsed) in %.2f ms", len(components), parsed,
+                len(seen_paths), cache.last_stats["seconds"] * 1000)
+    return components
 
-                    # Exclude patterns are given relative to the components directory
-                    logger.debug(f"[DEBUG] Checking {rel_path} against {exclude}")
-                    if any(fnmatch.fnmatch(rel_path, pattern) for pattern in exclude):
-                        logger.debug(f"[DEBUG] Excluding {rel_path}")
-                        continue
 
-                    name = rel_path[:-5]  # Remove .json
-                    descriptor = json.load(f)
-                    components[name] = descriptor
-                    logger.debug(f"[DEBUG] Loaded component {name}: {descriptor}")
+class ComponentRegistry:
+    """
+    Component descriptors, indexed for the lookups made while generating a network.
 
-    return components
+    Built once from the result of `load_components`. Holds, for every component, the
+    types of its input and output ports, and for every type, the components producing
+    and consuming it together with cumulative weights for sampling producers.
+
+    Descriptors may set an optional "weight" (default 1) to make a component more or
+    less likely to be chosen.
+    """
+
+    def __init__(self, components: Dict[str, dict]):
+        self.components = components
+        self.input_types = {}  # component name -> (type, ...)
+        self.output_types = {}  # component name -> (type, ...)
+        self.weights = {}  # component name -> weight
+        self.producers = {}  # type -> [component name]
+        self.consumers = {}  # type -> [component name]
+
+        for name, descriptor in components.items():
+            inputs = tuple(port["type"] for port in descriptor.get("inputs", []))
+            outputs = tuple(port["type"] for port in descriptor.get("outputs", []))
+            self.input_types[name] = inputs
+            self.output_types[name] = outputs
+            self.weights[name] = float(descriptor.get("weight", 1.0))
+
+            for type_name in dict.fromkeys(outputs):
+                self.producers.setdefault(type_name, []).append(name)
+            for type_name in dict.fromkeys(inputs):
+                self.consumers.setdefault(type_name, []).append(name)
+
+        # type -> cumulative producer weights, or None when all producers weigh the same.
+        self.producer_cum_weights = {}
+        for type_name, names in self.producers.items():
+            weights = [self.weights[name] for name in names]
+            if len(set(weights)) > 1:
+                self.producer_cum_weights[type_name] = list(itertools.accumulate(weights))
+            else:
+                self.producer_cum_weights[type_name] = None
+
+    def __contains__(self, name):
+        return name in self.components
+
+    def __getitem__(self, name):
+        return self.components[name]
+
+    def __len__(self):
+        return len(self.components)
+
+    def producers_of(self, type_name: str) -> List[str]:
+        return self.producers.get(type_name, [])
+
+    def consumers_of(self, type_name: str) -> List[str]:
+        return self.consumers.get(type_name, [])
+
+    def sample_producer(self,
+                        type_name: str,
+                        rng=random,
+                        allowed: List[str] = None,
+                        scale: Callable[[str], float] = None) -> str:
+        """
+        Pick a component producing the given type, according to component weights, among
+        the `allowed` ones if given. The weights are multiplied by `scale` of the
+        component if given.
+        """
+        producers = self.producers[type_name]
+        cum_weights = self.producer_cum_weights[type_name]
+        if allowed is not None and len(allowed) < len(producers) or scale is not None:
+            allowed = producers if allowed is None else allowed
+            weights = [
+                self.weights[name] * (1.0 if scale is None else scale(name)) for name in allowed
+            ]
+            return rng.choices(allowed, weights=weights)[0]
+        if cum_weights is None:
+            return rng.choice(producers)
+        return rng.choices(producers, cum_weights=cum_weights)[0]
 
 
 def find_components_producing_type(type_name: str, components: Dict[str, dict]) -> List[str]:
     """Find all components that have an output of the given type."""
+    if isinstance(components, ComponentRegistry):
+        return components.producers_of(type_name)
+
     matching_components = []
     for name, descriptor in components.items():
         for output in descriptor.get("outputs", []):
             if output["type"] == type_name:
                 matching_components.append(name)
                 break
-    logger.debug(f"[DEBUG] Components producing {type_name}: {matching_components}")
+    logger.debug("Components producing %s: %s", type_name, matching_components)
     return matching_components
 
 
+class IncrementalDAG:
+    """
+    A directed acyclic graph that keeps a topological order as edges are added, so that
+    whether an edge would close a cycle is answered without a search of the whole graph.
+
+    This is the dynamic topological order of Pearce and Kelly: every node has an order
+    index. An edge from an earlier node to a later one can't close a cycle. Otherwise
+    only the nodes ordered between its endpoints are searched (forward from the target,
+    backward from the source), and those found are reordered, reusing their indices.
+    New nodes go last, or first with `add_node(node, first=True)`: `plan_bridge` builds
+    networks from the outputs up, adding each node first, so that most of its edges take
+    the first case.
+
+    Nodes are any hashable, e.g. handles and plan node ids, and parallel edges (between
+    different ports of the same nodes) are counted. Removing edges keeps the order valid.
+    """
+
+    def __init__(self):
+        self.order_of = {}  # node -> order index, increasing along every edge
+        self.successors = {}  # node -> {successor: edge count}
+        self.predecessors = {}  # node -> {predecessor: edge count}
+        self.next_order = 0
+        self.first_order = 0
+
+    @classmethod
+    def from_edges(cls, nodes, edges) -> "IncrementalDAG":
+        """
+        Build a DAG of `nodes`, plus the (source, source_index, target, target_index)
+        `edges` between them, e.g. those of a graph snapshot.
+
+        Raises:
+            ValueError: The edges have cycles.
+        """
+        dag = cls()
+        for node in nodes:
+            dag.add_node(node)
+        for source, _, target, _ in edges:
+            if source in dag and target in dag and not dag.add_edge(source, target):
+                raise ValueError("Graph has cycles")
+        return dag
+
+    def __contains__(self, node):
+        return node in self.order_of
+
+    def __len__(self):
+        return len(self.order_of)
+
+    def add_node(self, node, first: bool = False):
+        """Add a node, after (or before, when `first`) every other node in the order."""
+        if node not in self.order_of:
+            if first:
+                self.first_order -= 1
+                self.order_of[node] = self.first_order
+            else:
+                self.order_of[node] = self.next_order
+                self.next_order += 1
+            self.successors[node] = {}
+            self.predecessors[node] = {}
+
+    def remove_node(self, node):
+        for successor in self.successors.pop(node):
+            del self.predecessors[successor][node]
+        for predecessor in self.predecessors.pop(node):
+            del self.successors[predecessor][node]
+        del self.order_of[node]
+
+    def _search(self, start, neighbors, in_range) -> Set:
+        """The nodes reachable from `start` through nodes for which `in_range` holds."""
+        visited = {start}
+        stack = [start]
+        while stack:
+            for neighbor in neighbors[stack.pop()]:
+                if neighbor not in visited and in_range(self.order_of[neighbor]):
+                    visited.add(neighbor)
+                    stack.append(neighbor)
+        return visited
+
+    def would_create_cycle(self, source, target) -> bool:
+        """Check if an edge from `source` to `target` would close a cycle."""
+        if source == target:
+            return True
+        upper = self.order_of[source]
+        if upper < self.order_of[target]:
+            return False
+        # Only nodes ordered up to the source can be on a path from the target to it.
+        return source in self._search(target, self.successors, lambda order: order <= upper)
+
+    def add_edge(self, source, target) -> bool:
+        """Add an edge, unless it would close a cycle. Returns whether it was added."""
+        self.add_node(source)
+        self.add_node(target)
+        lower, upper = self.order_of[target], self.order_of[source]
+        if source == target:
+            return False
+        if lower < upper:
+            forward = self._search(target, self.successors, lambda order: order <= upper)
+            if source in forward:
+                return False
+            backward = self._search(source, self.predecessors, lambda order: order > lower)
+            # Everything reaching the source now comes before everything the target
+            # reaches, in the indices these nodes had between them.
+            indices = sorted(self.order_of[node] for node in forward | backward)
+            for index, node in zip(
+                    indices,
+                    sorted(backward, key=self.order_of.get) +
+                    sorted(forward, key=self.order_of.get)):
+                self.order_of[node] = index
+        successors = self.successors[source]
+        successors[target] = successors.get(target, 0) + 1
+        predecessors = self.predecessors[target]
+        predecessors[source] = predecessors.get(source, 0) + 1
+        return True
+
+    def remove_edge(self, source, target):
+        """Remove one of the edges from `source` to `target`."""
+        for edges, node, other in ((self.successors, source, target), (self.predecessors, target,
+                                                                       source)):
+            edges[node][other] -= 1
+            if not edges[node][other]:
+                del edges[node][other]
+
+    def topological_order(self) -> list:
+        """The nodes, every one after the nodes feeding it."""
+        return sorted(self.order_of, key=self.order_of.get)
+
+
+class CompactGraph:
+    """
+    A network of ops kept in flat arrays, so that large networks (100k nodes and more)
+    take little memory and their queries are vectorized.
+
+    Nodes are numbered in the order they are added, and known by a key: a handle, or a
+    plan node id. Their typed ports and the edges are appended to `array`s as the graph
+    is built; the compressed sparse row (CSR) adjacency, i.e. the edges sorted by source
+    (and by target) with an offset per node, is built with NumPy on the first query
+    after a change.
+
+    Adjacency lists keep the order edges were added in, and have an entry per edge, so
+    parallel edges (between different ports) appear more than once.
+    """
+
+    def __init__(self):
+        self.keys = []  # node -> handle or plan node id
+        self.index = {}  # handle or plan node id -> node
+        self.components = []  # node -> component name, or None
+        self.type_names = []  # type id -> type name
+        self.type_ids = {}  # type name -> type id
+        # Port type ids of all nodes, concatenated, and where each node's start.
+        self.input_types = array.array("i")
+        self.input_offsets = array.array("q", [0])
+        self.output_types = array.array("i")
+        self.output_offsets = array.array("q", [0])
+        # One entry per edge
+        self.sources = array.array("q")
+        self.source_indices = array.array("i")
+        self.targets = array.array("q")
+        self.target_indices = array.array("i")
+        self._csr = None
+
+    @classmethod
+    def from_snapshot(cls, snapshot) -> "CompactGraph":
+        """Build the graph of a snapshot, as returned by `TDProxy.get_graph_snapshot`."""
+        graph = cls()
+        components = snapshot.get("components") or [None] * len(snapshot["handles"])
+        for handle, component in zip(snapshot["handles"], components):
+            graph.add_node(handle, component=component)
+        for source, source_index, target, target_index in snapshot["edges"]:
+            if source in graph.index and target in graph.index:
+                graph.add_edge(source, source_index, target, target_index)
+        return graph
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.sources)
+
+    def _type_id(self, type_name) -> int:
+        type_id = self.type_ids.get(type_name)
+        if type_id is None:
+            type_id = self.type_ids[type_name] = len(self.type_names)
+            self.type_names.append(type_name)
+        return type_id
+
+    def add_node(self, key, input_types=(), output_types=(), component: str = None) -> int:
+        """Add a node with ports of the given types, returning its number."""
+        if key in self.index:
+            raise ValueError(f"Node {key} is already in the graph")
+        node = self.index[key] = len(self.keys)
+        self.keys.append(key)
+        self.components.append(component)
+        self.input_types.extend(self._type_id(t) for t in input_types)
+        self.input_offsets.append(len(self.input_types))
+        self.output_types.extend(self._type_id(t) for t in output_types)
+        self.output_offsets.append(len(self.output_types))
+        self._csr = None
+        return node
+
+    def add_edge(self, source, source_index, target, target_index):
+        self.sources.append(self.index[source])
+        self.source_indices.append(source_index)
+        self.targets.append(self.index[target])
+        self.target_indices.append(target_index)
+        self._csr = None
+
+    def ports(self, key) -> Dict[str, List[str]]:
+        """The port types of a node, like `GraphPlan.ports`."""
+        node = self.index[key]
+        return {
+            "inputs": [
+                self.type_names[t]
+                for t in self.input_types[self.input_offsets[node]:self.input_offsets[node + 1]]
+            ],
+            "outputs": [
+                self.type_names[t]
+                for t in self.output_types[self.output_offsets[node]:self.output_offsets[node + 1]]
+            ],
+        }
+
+    def edge_arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """The source and target node of every edge, as arrays."""
+        # Copies, since arrays can't grow while a buffer of theirs is in use.
+        return (np.frombuffer(self.sources,
+                              dtype=np.int64).copy(), np.frombuffer(self.targets,
+                                                                    dtype=np.int64).copy())
+
+    def edges(self):
+        """The edges as (source, source_index, target, target_index), by key."""
+        keys = self.keys
+        for source, source_index, target, target_index in zip(self.sources, self.source_indices,
+                                                              self.targets, self.target_indices):
+            yield keys[source], source_index, keys[target], target_index
+
+    def _adjacency(self):
+        """The (out offsets, successors, in offsets, predecessors) CSR arrays."""
+        if self._csr is None:
+            sources, targets = self.edge_arrays()
+            n = len(self.keys)
+            by_source = np.argsort(sources, kind="stable")
+            by_target = np.argsort(targets, kind="stable")
+            out_offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(sources, minlength=n), out=out_offsets[1:])
+            in_offsets = np.zeros(n + 1, dtype=np.int64)
+            np.cumsum(np.bincount(targets, minlength=n), out=in_offsets[1:])
+            self._csr = (out_offsets, targets[by_source], in_offsets, sources[by_target])
+        return self._csr
+
+    def successors(self, key) -> list:
+        out_offsets, successors, _, _ = self._adjacency()
+        node = self.index[key]
+        return [self.keys[n] for n in successors[out_offsets[node]:out_offsets[node + 1]]]
+
+    def predecessors(self, key) -> list:
+        _, _, in_offsets, predecessors = self._adjacency()
+        node = self.index[key]
+        return [self.keys[n] for n in predecessors[in_offsets[node]:in_offsets[node + 1]]]
+
+    def out_degrees(self) -> np.ndarray:
+        """The number of edges out of each node, by node number."""
+        return np.diff(self._adjacency()[0])
+
+    def in_degrees(self) -> np.ndarray:
+        """The number of edges into each node, by node number."""
+        return np.diff(self._adjacency()[2])
+
+    def out_degree(self, key) -> int:
+        out_offsets = self._adjacency()[0]
+        node = self.index[key]
+        return int(out_offsets[node + 1] - out_offsets[node])
+
+    def in_degree(self, key) -> int:
+        in_offsets = self._adjacency()[2]
+        node = self.index[key]
+        return int(in_offsets[node + 1] - in_offsets[node])
+
+    def _kahn(self) -> Tuple[List[int], List[int]]:
+        """Kahn's algorithm: the nodes in topological order, and the longest path to each."""
+        out_offsets, successors, _, _ = self._adjacency()
+        # Python lists index faster than arrays in this loop.
+        out_offsets, successors = out_offsets.tolist(), successors.tolist()
+        in_degree = self.in_degrees().tolist()
+        rank = [0] * len(in_degree)
+        queue = deque(node for node, degree in enumerate(in_degree) if degree == 0)
+        order = []
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            next_rank = rank[node] + 1
+            for successor in successors[out_offsets[node]:out_offsets[node + 1]]:
+                if rank[successor] < next_rank:
+                    rank[successor] = next_rank
+                in_degree[successor] -= 1
+                if in_degree[successor] == 0:
+                    queue.append(successor)
+        if len(order) != len(in_degree):
+            raise ValueError("Graph has cycles")
+        return order, rank
+
+    def topological_order(self) -> list:
+        """
+        The node keys, every one after the nodes feeding it. Nodes that don't depend on
+        each other keep the order they were added in, breadth first.
+
+        Raises:
+            ValueError: The graph has cycles.
+        """
+        keys = self.keys
+        return [keys[node] for node in self._kahn()[0]]
+
+    def ranks(self) -> np.ndarray:
+        """The number of edges on the longest path to each node, by node number."""
+        return np.array(self._kahn()[1], dtype=np.int64)
+
+
+class GraphPlan:
+    """
+    An in-memory network: the nodes to create, their typed ports, and the edges and
+    attribute writes between them. Plans are produced by `plan_bridge` without
+    touching TouchDesigner, and applied with `apply_plan`.
+
+    Nodes created by the plan are referred to by string ids ("n0", "n1", ...);
+    existing ops (e.g. the I/O ops) are referred to by their integer handles.
+
+    A plan can also disconnect inputs of, and destroy, existing ops; `diff_plan`
+    uses this to turn the current network into a planned one.
+    """
+
+    def __init__(self):
+        self.nodes = []  # [{"id": node_id, "component": component_name}]
+        self.edges = []  # [(source, source_index, target, target_index)]
+        self.attributes = []  # [(node, attribute, value)]
+        self.ports = {}  # node id or handle -> {"inputs": [type], "outputs": [type]}
+        self.disconnects = []  # [(handle, input_index)], applied before everything else
+        self.destroys = []  # [handle], applied after disconnects
+
+    def add_existing(self, handle, descriptor):
+        """Register the typed ports of an op that already exists in the network."""
+        self.ports[handle] = _port_types(descriptor)
+
+    def load(self, component_name, descriptor=None):
+        node_id = f"n{len(self.nodes)}"
+        self.nodes.append({"id": node_id, "component": component_name})
+        if descriptor is not None:
+            self.ports[node_id] = _port_types(descriptor)
+        return node_id
+
+    def connect(self, source, source_index, target, target_index):
+        self.edges.append((source, source_index, target, target_index))
+        return True
+
+    def set_op_attribute(self, node, attribute, value):
+        self.attributes.append((node, attribute, value))
+        return True
+
+    def disconnect_input(self, handle, input_index):
+        self.disconnects.append((handle, input_index))
+
+    def destroy(self, handle):
+        self.destroys.append(handle)
+
+    def node_ids(self):
+        return [node["id"] for node in self.nodes]
+
+    def to_graph(self) -> CompactGraph:
+        """The planned network as a `CompactGraph`: the existing ops, then the new nodes."""
+        graph = CompactGraph()
+        components = {node["id"]: node["component"] for node in self.nodes}
+        keys = [key for key in self.ports if key not in components] + list(components)
+        for source, _, target, _ in self.edges:
+            keys.extend((source, target))
+        for key in dict.fromkeys(keys):
+            ports = self.ports.get(key, {})
+            graph.add_node(key, ports.get("inputs", ()), ports.get("outputs", ()),
+                           components.get(key))
+        for edge in self.edges:
+            graph.add_edge(*edge)
+        return graph
+
+    def to_dict(self):
+        """The wire format accepted by `TDProxy.apply_plan` (and by `from_dict`)."""
+        return {
+            "disconnect": self.disconnects,
+            "destroy": self.destroys,
+            "nodes": self.nodes,
+            "edges": self.edges,
+            "attributes": self.attributes,
+        }
+
+    @classmethod
+    def from_dict(cls, plan_dict, components=None):
+        """Rebuild a plan, e.g. one precomputed ahead of time and stored as JSON."""
+        plan = cls()
+        for node in plan_dict.get("nodes", []):
+            plan.nodes.append({"id": node["id"], "component": node["component"]})
+            if components is not None and node["component"] in components:
+                plan.ports[node["id"]] = _port_types(components[node["component"]])
+        plan.edges = [tuple(edge) for edge in plan_dict.get("edges", [])]
+        plan.attributes = [tuple(attribute) for attribute in plan_dict.get("attributes", [])]
+        plan.disconnects = [tuple(disconnect) for disconnect in plan_dict.get("disconnect", [])]
+        plan.destroys = list(plan_dict.get("destroy", []))
+        return plan
+
+
+def _port_types(descriptor):
+    return {
+        "inputs": [port["type"] for port in descriptor.get("inputs", [])],
+        "outputs": [port["type"] for port in descriptor.get("outputs", [])],
+    }
+
+
+# Budgets of `plan_bridge`: new nodes in a plan, and new nodes on a path from an input op
+# to an output op.
+DEFAULT_MAX_PLAN_NODES = 256
+DEFAULT_MAX_PLAN_DEPTH = 16
+
+# Cook cost, in milliseconds per frame, of a component whose descriptor doesn't give one.
+DEFAULT_COMPONENT_COST = 1.0
+# Cook time samples kept per component by `CostDatabase`.
+COST_WINDOW = 64
+# Smallest share of the cost budget weighting a component's choice, so that a component
+# using up the rest of the budget can still be drawn.
+MIN_COST_SCALE = 0.05
+
+
+def descriptor_cost(descriptor: dict) -> float:
+    """
+    The cook cost of a component in milliseconds per frame, from the optional "cost" of
+    its descriptor: either a number, or {"cpu_ms": ..., "gpu_ms": ...}.
+    """
+    cost = descriptor.get("cost", DEFAULT_COMPONENT_COST)
+    if isinstance(cost, dict):
+        return float(cost.get("cpu_ms", 0.0)) + float(cost.get("gpu_ms", 0.0))
+    return float(cost)
+
+
+def component_cost(name: str,
+                   registry: ComponentRegistry = None,
+                   costs: Dict[str, float] = None) -> float:
+    """The cost of a component from `costs`, else its descriptor, else the default."""
+    if costs is not None and name in costs:
+        return costs[name]
+    if registry is not None and name in registry:
+        return descriptor_cost(registry[name])
+    return DEFAULT_COMPONENT_COST
+
+
+class CostDatabase:
+    """
+    Rolling measured cook times of components, in milliseconds per frame.
+
+    Fed with the results of `TDProxy.get_cook_times` as networks run, it keeps the last
+    `window` samples (CPU plus GPU time of an op) of each component and estimates its
+    cost as their mean. When `path` is given, the samples are persisted there as JSON,
+    so that a new process starts with the costs measured before.
+    """
+
+    VERSION = 1
+
+    def __init__(self, path: str = None, window: int = COST_WINDOW):
+        self.path = path
+        self.window = window
+        self.samples = {}  # component name -> deque of milliseconds, oldest first
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    saved = json.load(f)
+                if saved.get("version") == self.VERSION:
+                    for name, samples in saved["samples"].items():
+                        self.samples[name] = deque(samples, maxlen=window)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning("Ignoring unreadable cost database %s: %s", path, e)
+
+    def record(self, component: str, milliseconds: float):
+        self.samples.setdefault(component, deque(maxlen=self.window)).append(milliseconds)
+
+    def update(self, cook_times: Dict[int, dict]) -> int:
+        """Record the cook times returned by `TDProxy.get_cook_times`, returning how many."""
+        recorded = 0
+        for cook_time in cook_times.values():
+            if cook_time.get("component"):
+                self.record(cook_time["component"], cook_time["cpu_ms"] + cook_time["gpu_ms"])
+                recorded += 1
+        return recorded
+
+    def estimate(self, component: str) -> Optional[float]:
+        """The mean measured cook time of a component, or None if it was never measured."""
+        samples = self.samples.get(component)
+        if not samples:
+            return None
+        return sum(samples) / len(samples)
+
+    def costs(self) -> Dict[str, float]:
+        """The estimated cost of every component measured, to give to `bridge`."""
+        return {name: self.estimate(name) for name, samples in self.samples.items() if samples}
+
+    def save(self):
+        if not self.path:
+            return
+        with open(self.path, "w") as f:
+            json.dump(
+                {
+                    "version": self.VERSION,
+                    "samples": {
+                        name: list(samples) for name, samples in self.samples.items()
+                    }
+                }, f)
+
+
+class Feasibility:
+    """
+    The cheapest way of producing each type from a set of available types, computed as
+    a fixed point over the components of a registry.
+
+    A type is feasible when it is available, or produced by a component whose inputs are
+    all feasible. For every feasible type, `type_depth` is the fewest components on a
+    path producing it and `type_cost` the smallest total cost of the components needed
+    when no output is shared (with the default unit cost, the number of components of
+    the smallest tree producing it). Components get the depth and cost of producing
+    their outputs through them.
+
+    Args:
+        registry: The components.
+        available_types: Types available for free, e.g. the outputs of the input ops.
+        cost: Cost of a component, by name (1 when not given).
+    """
+
+    def __init__(self,
+                 registry: ComponentRegistry,
+                 available_types,
+                 cost: Callable[[str], float] = None):
+        self.type_depth = dict.fromkeys(available_types, 0)
+        self.type_cost = dict.fromkeys(available_types, 0.0)
+        self.component_depth = {}
+        self.component_cost = {}
+
+        # Depths and costs only decrease, and are bounded, so this reaches a fixed point
+        # within a pass per component.
+        changed = True
+        while changed:
+            changed = False
+            for name, input_types in registry.input_types.items():
+                if not all(t in self.type_cost for t in input_types):
+                    continue
+                depth = 1 + max((self.type_depth[t] for t in input_types), default=0)
+                total = (1.0 if cost is None else cost(name)) + sum(
+                    self.type_cost[t] for t in input_types)
+                self.component_depth[name] = depth
+                self.component_cost[name] = total
+                for output_type in registry.output_types[name]:
+                    if depth < self.type_depth.get(output_type, float("inf")):
+                        self.type_depth[output_type] = depth
+                        changed = True
+                    if total < self.type_cost.get(output_type, float("inf")):
+                        self.type_cost[output_type] = total
+                        changed = True
+
+    def is_feasible(self, type_name: str) -> bool:
+        return type_name in self.type_cost
+
+
+def plan_bridge(components: Union[Dict[str, dict], ComponentRegistry],
+                input_descriptors: Dict[int, dict],
+                output_descriptors: Dict[int, dict],
+                reuse_weight: float = 0.7,
+                rng: random.Random = None,
+                max_nodes: int = DEFAULT_MAX_PLAN_NODES,
+                max_depth: int = DEFAULT_MAX_PLAN_DEPTH,
+                max_seconds: float = None,
+                cost_budget: float = None,
+                costs: Dict[str, float] = None) -> GraphPlan:
+    """
+    Plan a network connecting input nodes to output nodes, without side effects.
+
+    This is the generation half of `bridge`: it only needs the component descriptors
+    and the descriptors of the I/O ops, so it can run without TouchDesigner.
+
+    Components are only chosen when they fit in the budgets, as told by the
+    `Feasibility` of their inputs from the input ops' types. When the time budget runs
+    out, the remaining inputs are satisfied the cheapest way. Either way the planning
+    terminates, within the node and depth budgets.
+
+    With a `cost_budget`, the summed cook cost of the created components stays within it
+    too, and components are drawn with their weight scaled by the share of the remaining
+    budget they leave, so that cheaper ones are favored as the budget runs out.
+
+    Args:
+        components: A `ComponentRegistry`, or component descriptors by name as returned
+            by `load_components`.
+        input_descriptors: Descriptors of the input ops, by handle.
+        output_descriptors: Descriptors of the output ops, by handle.
+        reuse_weight: The weight of the reuse operation.
+        rng: Random number generator to draw from (defaults to the `random` module).
+        max_nodes: The most nodes to create.
+        max_depth: The most created nodes on a path from an input op to an output op, or
+            None for no depth budget. Any output is reused as long as it doesn't close a
+            cycle and keeps the paths through it within the budget.
+        max_seconds: Seconds after which the random choices stop, if given.
+        cost_budget: The most milliseconds per frame the created components may cook for.
+        costs: Cook cost of the components in milliseconds per frame, by name, e.g. from
+            `CostDatabase.costs`. Those missing cost what their descriptor says.
+
+    Returns:
+        A `GraphPlan` with a node per component to create and an edge per connection.
+
+    Raises:
+        ValueError: An output can't be produced from the inputs within the budgets.
+    """
+    start = time.perf_counter()
+    rng = rng or random
+    debug = logger.isEnabledFor(logging.DEBUG)
+    registry = components
+    if not isinstance(registry, ComponentRegistry):
+        registry = ComponentRegistry(components)
+    plan = GraphPlan()
+
+    # Get types for input and output nodes from their descriptors
+    # Keep track of available outputs by type
+    available_outputs = {}  # type -> List[(handle, index)]
+    for handle, descriptor in input_descriptors.items():
+        if not descriptor or "outputs" not in descriptor:
+            raise ValueError(f"No descriptor found for input handle {handle}")
+        plan.add_existing(handle, descriptor)
+        for idx, output_type in enumerate(plan.ports[handle]["outputs"]):
+            available_outputs.setdefault(output_type, []).append((handle, idx))
+            if debug:
+                logger.debug("Input node %s output[%d] provides type %s", handle, idx, output_type)
+
+    feasibility = Feasibility(registry, available_outputs)
+    cost_feasibility = None
+    if cost_budget is not None:
+        cost_feasibility = Feasibility(registry, available_outputs,
+                                       lambda name: component_cost(name, registry, costs))
+
+    # Keep track of unsatisfied outputs we need to connect
+    outputs_to_satisfy = deque()
+    for handle, descriptor in output_descriptors.items():
+        if not descriptor or "inputs" not in descriptor:
+            raise ValueError(f"No descriptor found for output handle {handle}")
+        plan.add_existing(handle, descriptor)
+        for idx, input_type in enumerate(plan.ports[handle]["inputs"]):
+            if not feasibility.is_feasible(input_type):
+                raise ValueError(f"Type {input_type} of output {handle} can't be produced "
+                                 f"from the inputs' types {sorted(available_outputs)}")
+            if max_depth is not None and feasibility.type_depth[input_type] > max_depth:
+                raise ValueError(f"Type {input_type} of output {handle} needs "
+                                 f"{feasibility.type_depth[input_type]} nodes deep, more than "
+                                 f"the budget of {max_depth}")
+            outputs_to_satisfy.append((handle, idx, input_type))
+            if debug:
+                logger.debug("Output node %s input[%d] requires type %s", handle, idx, input_type)
+
+    # The nodes created, plus those the inputs still to satisfy need without reusing
+    # outputs. Choices keep it within the node budget.
+    committed = sum(feasibility.type_cost[t] for _, _, t in outputs_to_satisfy)
+    if committed > max_nodes:
+        raise ValueError(f"The outputs need {committed:.0f} nodes without reusing outputs, "
+                         f"more than the budget of {max_nodes}")
+    committed_cost = 0.0
+    if cost_feasibility is not None:
+        committed_cost = sum(cost_feasibility.type_cost[t] for _, _, t in outputs_to_satisfy)
+        if committed_cost > cost_budget:
+            raise ValueError(f"The outputs cost {committed_cost:.2f} ms without reusing "
+                             f"outputs, more than the budget of {cost_budget} ms")
+
+    # Level of each created node: the most created nodes on a path from it to an output
+    # op, itself included. Output ops are at level 0.
+    levels = dict.fromkeys(output_descriptors, 0)
+    # Depth of each created node: the most created nodes on a path to it from an input
+    # op, itself included, counting the inputs still to satisfy the cheapest way. A path
+    # through a node is then levels + depths - 1 nodes deep, at least.
+    depths = {}
+
+    # The network so far, to prevent cycles. Nothing feeds the input ops, so their edges
+    # can't close one and they're left out.
+    dag = IncrementalDAG()
+    for handle in output_descriptors:
+        dag.add_node(handle)
+
+    def raise_bound(bounds, node, bound, neighbors):
+        """Raise the level (or depth) of a node to at least `bound`, and of those it
+        reaches through `neighbors` accordingly."""
+        stack = [(node, bound)]
+        while stack:
+            node, bound = stack.pop()
+            if node in bounds and bound > bounds[node]:
+                bounds[node] = bound
+                stack.extend((neighbor, bound + 1) for neighbor in neighbors[node])
+
+    def connect(source_handle, target_handle):
+        """Add an edge between created nodes (or to an output op) to the network so far."""
+        dag.add_edge(source_handle, target_handle)
+        raise_bound(levels, source_handle, levels[target_handle] + 1, dag.predecessors)
+        raise_bound(depths, target_handle, depths[source_handle] + 1, dag.successors)
+
+    def can_reuse(source_handle, target_handle) -> bool:
+        """Check if an existing output can feed a node, without a cycle or going deeper
+        than the depth budget."""
+        if source_handle not in dag:
+            return True
+        if max_depth is not None and depths[source_handle] + levels[target_handle] > max_depth:
+            return False
+        return not dag.would_create_cycle(source_handle, target_handle)
+
+    def fits(component, level) -> bool:
+        """Check if a component can feed a node of the given level within the budgets."""
+        if component not in feasibility.component_cost:
+            return False
+        if cost_feasibility is not None and (
+                committed_cost + cost_feasibility.component_cost[component] > cost_budget):
+            return False
+        if max_depth is not None and level + feasibility.component_depth[component] > max_depth:
+            return False
+        return committed + feasibility.component_cost[component] <= max_nodes
+
+    def cost_scale(component) -> float:
+        """The share of the remaining cost budget left after choosing a component."""
+        remaining = cost_budget - committed_cost
+        if remaining <= 0:
+            return 1.0
+        return max(MIN_COST_SCALE, 1 - cost_feasibility.component_cost[component] / remaining)
+
+    while outputs_to_satisfy:
+        output_handle, output_index, required_type = outputs_to_satisfy.popleft()
+        # Reusing outputs may have moved the node further from the output ops since its
+        # inputs were queued.
+        level = levels[output_handle]
+        committed -= feasibility.type_cost[required_type]
+        if cost_feasibility is not None:
+            committed_cost -= cost_feasibility.type_cost[required_type]
+        out_of_time = max_seconds is not None and time.perf_counter() - start > max_seconds
+
+        # Try to find an existing output of the required type
+        valid_existing_outputs = [(h, idx)
+                                  for h, idx in available_outputs.get(required_type, [])
+                                  if can_reuse(h, output_handle)]
+
+        # Components fitting both budgets, given the cheapest way to satisfy their inputs
+        fitting_components = [
+            name for name in registry.producers_of(required_type) if fits(name, level)
+        ]
+
+        use_existing = valid_existing_outputs and (out_of_time or not fitting_components or
+                                                   rng.random() < reuse_weight)
+        if use_existing:
+            # Use an existing output
+            source_handle, source_index = rng.choice(valid_existing_outputs)
+            plan.connect(source_handle, source_index, output_handle, output_index)
+            if source_handle in dag:
+                connect(source_handle, output_handle)
+            if debug:
+                logger.debug("Reusing existing output %s:%d -> %s:%d", source_handle, source_index,
+                             output_handle, output_index)
+            continue
+
+        if not fitting_components:
+            raise ValueError(f"No component can produce type {required_type} within "
+                             f"{max_nodes} nodes, a depth of {max_depth} and a cost of "
+                             f"{cost_budget} ms")
+        if out_of_time:
+            # The cheapest component, whose inputs are each cheaper than its output, so
+            # this terminates.
+            chosen_component = min(fitting_components, key=feasibility.component_cost.get)
+        else:
+            chosen_component = registry.sample_producer(
+                required_type, rng, fitting_components,
+                cost_scale if cost_feasibility is not None else None)
+        new_handle = plan.load(chosen_component, registry[chosen_component])
+        levels[new_handle] = level + 1
+        depths[new_handle] = feasibility.component_depth[chosen_component]
+        dag.add_node(new_handle, first=True)
+        committed += feasibility.component_cost[chosen_component]
+        if cost_feasibility is not None:
+            committed_cost += cost_feasibility.component_cost[chosen_component]
+
+        # Connect its output of the required type to our target
+        ports = plan.ports[new_handle]
+        used_index = ports["outputs"].index(required_type)
+        plan.connect(new_handle, used_index, output_handle, output_index)
+        connect(new_handle, output_handle)
+        if debug:
+            logger.debug("Created %s as %s -> %s:%d", chosen_component, new_handle, output_handle,
+                         output_index)
+
+        # Register all outputs as available
+        for i, output_type in enumerate(ports["outputs"]):
+            if i != used_index:  # Skip the output we just used
+                available_outputs.setdefault(output_type, []).append((new_handle, i))
+
+        # Add its inputs to our list of outputs we need to satisfy
+        for i, input_type in enumerate(ports["inputs"]):
+            outputs_to_satisfy.append((new_handle, i, input_type))
+
+    return plan
+
+
+def validate_plan(plan: GraphPlan,
+                  registry: ComponentRegistry = None,
+                  max_nodes: int = None,
+                  max_depth: int = None,
+                  cost_budget: float = None,
+                  costs: Dict[str, float] = None):
+    """
+    Check a plan before applying it, so that a bad plan doesn't leave a half built
+    network in TouchDesigner.
+
+    Checks that the components exist, that edges connect existing ports of the same
+    type, that every input of a created node is connected exactly once (and no input
+    more than once), that there are no cycles, and the budgets.
+
+    Raises:
+        ValueError: Listing every problem found.
+    """
+    problems = []
+    if registry is not None:
+        problems += [
+            f"Unknown component {node['component']}" for node in plan.nodes
+            if node["component"] not in registry
+        ]
+
+    connected = Counter((target, target_index) for _, _, target, target_index in plan.edges)
+    for source, source_index, target, target_index in plan.edges:
+        source_ports = plan.ports.get(source, {}).get("outputs", [])
+        target_ports = plan.ports.get(target, {}).get("inputs", [])
+        if source_index >= len(source_ports) or target_index >= len(target_ports):
+            problems.append(f"Edge {source}:{source_index} -> {target}:{target_index} "
+                            f"connects a missing port")
+        elif source_ports[source_index] != target_ports[target_index]:
+            problems.append(f"Edge {source}:{source_index} -> {target}:{target_index} connects "
+                            f"{source_ports[source_index]} to {target_ports[target_index]}")
+    problems += [
+        f"Input {target}:{target_index} is connected {count} times"
+        for (target, target_index), count in connected.items()
+        if count > 1
+    ]
+    for node_id in plan.node_ids():
+        problems += [
+            f"Input {node_id}:{i} is not connected"
+            for i in range(len(plan.ports.get(node_id, {}).get("inputs", [])))
+            if (node_id, i) not in connected
+        ]
+
+    try:
+        # Paths go from an input op to an output op, one edge more than created nodes.
+        depth = plan_depth(plan) - 1
+    except ValueError:
+        problems.append("The plan has cycles")
+    else:
+        if max_depth is not None and depth > max_depth:
+            problems.append(f"{depth} nodes deep, more than {max_depth}")
+    if max_nodes is not None and len(plan.nodes) > max_nodes:
+        problems.append(f"{len(plan.nodes)} nodes, more than {max_nodes}")
+    if cost_budget is not None and (cost := plan_cook_cost(plan, registry, costs)) > cost_budget:
+        problems.append(f"Costs {cost:.2f} ms, more than {cost_budget} ms")
+
+    if problems:
+        raise ValueError("Invalid plan: " + "; ".join(problems))
+
+
+def plan_depth(plan: GraphPlan, graph: CompactGraph = None) -> int:
+    """
+    The number of edges on the longest path of a plan (existing ops included), using its
+    `graph` if already built.
+    """
+    graph = plan.to_graph() if graph is None else graph
+    return int(graph.ranks().max()) if len(graph) else 0
+
+
+def plan_type_diversity(plan: GraphPlan) -> int:
+    """The number of distinct types flowing through the edges of a plan."""
+    types = set()
+    for source, source_index, _, _ in plan.edges:
+        if source in plan.ports:
+            types.add(plan.ports[source]["outputs"][source_index])
+    return len(types)
+
+
+def plan_cook_cost(plan: GraphPlan,
+                   registry: ComponentRegistry,
+                   costs: Dict[str, float] = None) -> float:
+    """
+    The summed cook cost of the plan's components, from `costs` when given (e.g. those of
+    a `CostDatabase`), else from their descriptors.
+    """
+    return sum(component_cost(node["component"], registry, costs) for node in plan.nodes)
+
+
+def plan_reuse_ratio(plan: GraphPlan) -> float:
+    """The fraction of edges reusing an existing output rather than a new node's.
+
+    Every node of a `plan_bridge` plan is created to feed a single input, any other
+    edge reuses an output.
+    """
+    if not plan.edges:
+        return 0.0
+    return max(0, len(plan.edges) - len(plan.nodes)) / len(plan.edges)
+
+
+def plan_max_fan_out(plan: GraphPlan) -> int:
+    """The most inputs fed by a single output, e.g. a constant feeding everything."""
+    fan_out = Counter((source, source_index) for source, source_index, _, _ in plan.edges)
+    return max(fan_out.values(), default=0)
+
+
+# Metrics to score candidate plans with, see `score_plan`.
+PLAN_METRICS = {
+    "node_count": lambda plan, registry: len(plan.nodes),
+    "depth": lambda plan, registry: plan_depth(plan),
+    "type_diversity": lambda plan, registry: plan_type_diversity(plan),
+    "cook_cost": plan_cook_cost,
+    "reuse_ratio": lambda plan, registry: plan_reuse_ratio(plan),
+    "max_fan_out": lambda plan, registry: plan_max_fan_out(plan),
+}
+
+# Weight of each metric in the score of a plan: smaller, shallower networks of varied
+# types, without one output feeding everything, score higher.
+DEFAULT_SCORE_WEIGHTS = {
+    "node_count": -0.02,
+    "depth": -0.05,
+    "type_diversity": 0.2,
+    "cook_cost": 0.0,
+    "reuse_ratio": -0.5,
+    "max_fan_out": -0.1,
+}
+
+
+def score_plan(plan: GraphPlan,
+               registry: ComponentRegistry,
+               weights: Dict[str, float] = None,
+               metrics: Dict[str, Callable] = None) -> Tuple[float, Dict[str, float]]:
+    """
+    Score a plan as the weighted sum of its metrics.
+
+    Args:
+        plan: The plan to score.
+        registry: The components of the plan.
+        weights: Weight of each metric, by name. Metrics without a weight aren't computed.
+        metrics: Functions of (plan, registry) by name, on top of `PLAN_METRICS`.
+
+    Returns:
+        The score, and the value of each weighted metric.
+    """
+    weights = DEFAULT_SCORE_WEIGHTS if weights is None else weights
+    metrics = {**PLAN_METRICS, **(metrics or {})}
+    values = {name: metrics[name](plan, registry) for name in weights}
+    return sum(weights[name] * value for name, value in values.items()), values
+
+
+# The process pool of `search_plans`, kept from one search to the next. Its workers are
+# spawned rather than forked, since the client forking would copy its Pyro threads' locks.
+_search_pool = None
+_search_pool_size = None
+
+
+def _get_search_pool(processes: int):
+    global _search_pool, _search_pool_size
+    if _search_pool is None or _search_pool_size != processes:
+        _drop_search_pool()
+        _search_pool = multiprocessing.get_context("spawn").Pool(processes)
+        _search_pool_size = processes
+    return _search_pool
+
+
+def _drop_search_pool():
+    """Terminate the search pool, and with it the candidates still being planned."""
+    global _search_pool
+    if _search_pool is not None:
+        _search_pool.terminate()
+        _search_pool = None
+
+
+def candidate_seeds(seed: int, candidates: int) -> List[int]:
+    """
+    The seeds of the candidates of a search, drawn from its base seed.
+
+    Unlike `seed + i`, the candidates of consecutive base seeds (e.g. of consecutive
+    rebuilds) don't overlap.
+    """
+    rng = random.Random(seed)
+    return [rng.getrandbits(32) for _ in range(candidates)]
+
+
+def _plan_candidate(args, seed):
+    registry, input_descriptors, output_descriptors, reuse_weight, budgets = args
+    try:
+        plan = plan_bridge(registry, input_descriptors, output_descriptors, reuse_weight,
+                           random.Random(seed), **budgets)
+        validate_plan(plan, registry, budgets["max_nodes"], budgets["max_depth"],
+                      budgets["cost_budget"], budgets["costs"])
+        return plan
+    except ValueError as e:
+        logger.debug("Candidate %d failed: %s", seed, e)
+        return None
+
+
+def search_plans(registry: ComponentRegistry,
+                 input_descriptors: Dict[int, dict],
+                 output_descriptors: Dict[int, dict],
+                 candidates: int = 8,
+                 reuse_weight: float = 0.7,
+                 weights: Dict[str, float] = None,
+                 metrics: Dict[str, Callable] = None,
+                 seed: int = None,
+                 deadline: float = None,
+                 processes: int = None,
+                 max_nodes: int = DEFAULT_MAX_PLAN_NODES,
+                 max_depth: int = DEFAULT_MAX_PLAN_DEPTH,
+                 max_seconds: float = None,
+                 cost_budget: float = None,
+                 costs: Dict[str, float] = None) -> Tuple[GraphPlan, List[dict]]:
+    """
+    Plan several candidate networks in parallel and pick the best scoring one.
+
+    Args:
+        registry: The components to generate from.
+        input_descriptors: Descriptors of the input ops, by handle.
+        output_descriptors: Descriptors of the output ops, by handle.
+        candidates: The number of plans to generate.
+        reuse_weight: The weight of the reuse operation.
+        weights: Weights of the metrics, see `score_plan`.
+        metrics: Extra metrics, see `score_plan`.
+        seed: Base seed, the candidates are planned with `candidate_seeds(seed,
+            candidates)`. Random when not given.
+        deadline: Seconds to wait for the candidates. The ones not planned by then are
+            dropped (the pool's workers terminated, and spawned again by the next search).
+        processes: Size of the process pool, one per CPU when not given. The pool is kept
+            for the next searches of the same size. With 0 the candidates are planned in
+            this process, and the deadline is only checked in between them.
+        max_nodes: Budgets of each candidate, see `plan_bridge`. Candidates that don't
+            pass `validate_plan` are dropped.
+        max_depth: See `plan_bridge`.
+        max_seconds: See `plan_bridge`.
+        cost_budget: See `plan_bridge`.
+        costs: See `plan_bridge`. The "cook_cost" metric uses them too.
+
+    Returns:
+        The best plan, and the seed, score and metrics of every candidate planned, best
+        first.
+
+    Raises:
+        TimeoutError: No candidate was planned by the deadline.
+        ValueError: No candidate could be planned.
+    """
+    start = time.perf_counter()
+    if seed is None:
+        seed = random.randrange(2**32)
+    seeds = candidate_seeds(seed, candidates)
+    budgets = {
+        "max_nodes": max_nodes,
+        "max_depth": max_depth,
+        "max_seconds": max_seconds,
+        "cost_budget": cost_budget,
+        "costs": costs,
+    }
+    if costs is not None:
+        metrics = {"cook_cost": functools.partial(plan_cook_cost, costs=costs), **(metrics or {})}
+    args = (registry, input_descriptors, output_descriptors, reuse_weight, budgets)
+
+    plans = {}
+    if processes == 0:
+        for candidate_seed in seeds:
+            if deadline is not None and time.perf_counter() - start >= deadline:
+                break
+            plans[candidate_seed] = _plan_candidate(args, candidate_seed)
+    else:
+        pool = _get_search_pool(processes or os.cpu_count())
+        try:
+            results = {
+                candidate_seed: pool.apply_async(_plan_candidate, (args, candidate_seed))
+                for candidate_seed in seeds
+            }
+            for candidate_seed, result in results.items():
+                timeout = None if deadline is None else max(
+                    0.0, deadline - (time.perf_counter() - start))
+                try:
+                    plans[candidate_seed] = result.get(timeout)
+                except multiprocessing.TimeoutError:
+                    pass
+        except BaseException:
+            _drop_search_pool()
+            raise
+        if len(plans) < len(results):
+            # Stop the candidates still being planned.
+            _drop_search_pool()
+
+    report = []
+    for candidate_seed, plan in plans.items():
+        if plan is not None:
+            score, values = score_plan(plan, registry, weights, metrics)
+            report.append({"seed": candidate_seed, "score": score, "metrics": values})
+    if not report:
+        if len(plans) < candidates:
+            raise TimeoutError(f"No candidate planned within {deadline} s")
+        raise ValueError(f"None of the {candidates} candidates could be planned")
+
+    # Stable, so ties go to the lowest seed.
+    report.sort(key=lambda candidate: -candidate["score"])
+    best_plan = plans[report[0]["seed"]]
+    logger.info("Picked candidate %d (score %.3f) of %d planned in %.1f ms", report[0]["seed"],
+                report[0]["score"], len(report), (time.perf_counter() - start) * 1000)
+    return best_plan, report
+
+
+class PlanCancelled(Exception):
+    """Raised when a plan stops being applied because its `cancel` callback returned True."""
+
+
+class MutationPipeline:
+    """
+    Sends `connect`, `disconnect`, `set_op_attribute` and `set_nodes_positions` calls to
+    TouchDesigner as oneway `TDProxy.post_mutation` calls, which return right away instead
+    of waiting a frame for the result.
+
+    The calls are applied in order, but only among themselves: `flush` waits until they
+    are all applied, and must be called before any other call that depends on them. Each
+    pipeline has its own id, so that several clients (or pipelines) can post to the same
+    TouchDesigner without mixing their sequences.
+    """
+
+    def __init__(self, td_proxy):
+        self.td_proxy = td_proxy
+        self.id = uuid.uuid4().hex
+        self.posted = 0
+
+    def post(self, method: str, *args):
+        self.td_proxy.post_mutation(self.id, self.posted, method, args)
+        self.posted += 1
+
+    def connect(self, output_handle, output_index, input_handle, input_index):
+        self.post("connect", output_handle, output_index, input_handle, input_index)
+
+    def disconnect(self, handle, in_indices, out_indices):
+        self.post("disconnect", handle, in_indices, out_indices)
+
+    def set_op_attribute(self, handle, attribute, value):
+        self.post("set_op_attribute", handle, attribute, value)
+
+    def set_nodes_positions(self, positions):
+        self.post("set_nodes_positions", positions)
+
+    def flush(self) -> List[dict]:
+        """Wait until the posted calls are applied, and return the ones that failed."""
+        result = self.td_proxy.flush_mutations(self.id, self.posted)
+        self.posted = 0
+        if result["errors"]:
+            logger.warning("%d of %d pipelined calls failed: %s", len(result["errors"]),
+                           result["applied"] + len(result["errors"]), result["errors"])
+        return result["errors"]
+
+
+def apply_plan(td_proxy,
+               plan: GraphPlan,
+               batch: bool = True,
+               chunked: bool = False,
+               poll_interval: float = 0.005,
+               pipelined: bool = False,
+               cancel: Callable[[], bool] = None) -> Dict[str, int]:
+    """
+    Create the nodes and edges of a plan in TouchDesigner (after applying its
+    disconnects and destroys, if any).
+
+    Args:
+        td_proxy: The TouchDesigner proxy object.
+        plan: The plan to apply.
+        batch: Apply the plan with a single `apply_plan` RPC, rather than one `load` or
+            `connect` call per node and edge.
+        chunked: With `batch`, submit the plan as a job that TouchDesigner applies over
+            several frames, within its per-frame budget, and wait for it to finish.
+        poll_interval: Seconds between job status polls, when `chunked`.
+        pipelined: Without `batch`, send the disconnects, connects and attributes without
+            waiting for each result, with a single `MutationPipeline.flush` at the end.
+        cancel: Called between steps (job polls when `chunked`, loads when not batched),
+            stopping the plan with `PlanCancelled` when it returns True. The ops created
+            until then are left in the network.
+
+    Returns:
+        The handle of each created node, by plan node id.
+
+    Raises:
+        RuntimeError: When `chunked`, if a step of the job failed in TouchDesigner.
+    """
+    if batch:
+        if chunked:
+            job_id = td_proxy.submit_plan(plan.to_dict())
+            while not (status := td_proxy.get_plan_status(job_id))["finished"]:
+                logger.debug("Plan job %d: %d/%d steps", job_id, status["done"], status["total"])
+                if cancel is not None and cancel():
+                    status = td_proxy.cancel_plan(job_id)
+                    if not status["finished"]:
+                        raise PlanCancelled(f"Plan cancelled after {status['done']} of "
+                                            f"{status['total']} steps")
+                    # It finished in the meantime, but its result went with the job.
+                    raise PlanCancelled("Plan cancelled")
+                time.sleep(poll_interval)
+            if "error" in status:
+                raise RuntimeError(f"Plan job {job_id} failed after {status['done']} of "
+                                   f"{status['total']} steps: {status['error']}")
+            result = status["result"]
+        else:
+            result = td_proxy.apply_plan(plan.to_dict())
+        if result["failed_edges"] or result["failed_attributes"]:
+            logger.warning("Plan partially applied, failed edges: %s, failed attributes: %s",
+                           result["failed_edges"], result["failed_attributes"])
+        return result["handles"]
+
+    mutations = MutationPipeline(td_proxy) if pipelined else td_proxy
+
+    def check_cancelled(done):
+        if cancel is not None and cancel():
+            if pipelined:
+                mutations.flush()
+            raise PlanCancelled(f"Plan cancelled after loading {done} of {len(plan.nodes)} nodes")
+
+    for handle, input_index in plan.disconnects:
+        mutations.disconnect(handle, [input_index], [])
+    if pipelined and plan.destroys:
+        mutations.flush()  # Disconnect before destroying, like the other modes
+    for handle in plan.destroys:
+        td_proxy.delete_op(handle)
+
+    handles = {}
+    for node in plan.nodes:
+        check_cancelled(len(handles))
+        handles[node["id"]] = td_proxy.load(node["component"])
+    check_cancelled(len(handles))
+
+    def resolve(node):
+        return handles[node] if isinstance(node, str) else node
+
+    for source, source_index, target, target_index in plan.edges:
+        mutations.connect(resolve(source), source_index, resolve(target), target_index)
+    for node, attribute, value in plan.attributes:
+        mutations.set_op_attribute(resolve(node), attribute, value)
+    if pipelined:
+        mutations.flush()
+    return handles
+
+
+def _plan_order(plan: GraphPlan) -> List[str]:
+    """The plan node ids, ordered so that every node comes after the nodes feeding it."""
+    node_ids = plan.node_ids()
+    in_degree = dict.fromkeys(node_ids, 0)
+    successors = {node_id: [] for node_id in node_ids}
+    for source, _, target, _ in plan.edges:
+        if source in in_degree and target in in_degree:
+            successors[source].append(target)
+            in_degree[target] += 1
+    queue = deque(node_id for node_id in node_ids if in_degree[node_id] == 0)
+    order = []
+    while queue:
+        current = queue.popleft()
+        order.append(current)
+        for target in successors[current]:
+            in_degree[target] -= 1
+            if in_degree[target] == 0:
+                queue.append(target)
+    if len(order) != len(node_ids):
+        raise ValueError("Plan has cycles")
+    return order
+
+
+def diff_plan(snapshot, plan: GraphPlan) -> Tuple[GraphPlan, Dict[str, int]]:
+    """
+    Compute the changes turning the current network into the planned one.
+
+    Existing (non-reserved) ops are kept for plan nodes of the same component,
+    preferring ops whose inputs are already wired as planned. Only the remaining plan
+    nodes are created, only the remaining ops are destroyed, and only the inputs
+    whose source differs are rewired.
+
+    Args:
+        snapshot: The current network, as returned by `TDProxy.get_graph_snapshot()`.
+        plan: The planned network.
+
+    Returns:
+        A patch plan, and the existing handle kept for each matched plan node id.
+
+    Raises:
+        ValueError: The network or the patched network has cycles.
+    """
+    # Existing ops that can be reused, by component
+    unused = {}  # component -> [handle]
+    for handle, component, reserved in zip(snapshot["handles"], snapshot["components"],
+                                           snapshot["reserved"]):
+        if not reserved:
+            unused.setdefault(component, []).append(handle)
+    unused_handles = {handle for handles in unused.values() for handle in handles}
+
+    # Current source of each connected input
+    current_sources = {}  # (target, target_index) -> (source, source_index)
+    for source, source_index, target, target_index in snapshot["edges"]:
+        current_sources[(target, target_index)] = (source, source_index)
+
+    # Ops whose inputs are wired exactly as given, by (component, inputs)
+    current_inputs = {}  # handle -> [(target_index, source, source_index)]
+    for (target, target_index), (source, source_index) in current_sources.items():
+        if target in unused_handles:
+            current_inputs.setdefault(target, []).append((target_index, source, source_index))
+    by_signature = {}  # (component, inputs) -> [handle]
+    for component, handles in unused.items():
+        for handle in handles:
+            signature = (component, tuple(sorted(current_inputs.get(handle, []))))
+            by_signature.setdefault(signature, []).append(handle)
+
+    planned_inputs = {}  # plan node id -> [(target_index, source, source_index)]
+    for source, source_index, target, target_index in plan.edges:
+        planned_inputs.setdefault(target, []).append((target_index, source, source_index))
+
+    # Match plan nodes to existing ops, sources first, so that a node's inputs are
+    # resolved to handles by the time it is matched.
+    components = {node["id"]: node["component"] for node in plan.nodes}
+    kept = {}  # plan node id -> handle
+    for node_id in _plan_order(plan):
+        component = components[node_id]
+        inputs = tuple(
+            sorted((target_index, kept.get(source, source), source_index)
+                   for target_index, source, source_index in planned_inputs.get(node_id, [])))
+        candidates = by_signature.get((component, inputs))
+        while candidates and candidates[-1] not in unused_handles:
+            candidates.pop()
+        if not candidates:
+            candidates = unused.get(component, [])
+            while candidates and candidates[-1] not in unused_handles:
+                candidates.pop()
+        if candidates:
+            handle = candidates.pop()
+            unused_handles.discard(handle)
+            kept[node_id] = handle
+
+    def resolve(node):
+        return kept.get(node, node)
+
+    patch = GraphPlan()
+    patch.ports = plan.ports
+    patch.nodes = [node for node in plan.nodes if node["id"] not in kept]
+
+    planned_slots = set()
+    for source, source_index, target, target_index in plan.edges:
+        source, target = resolve(source), resolve(target)
+        planned_slots.add((target, target_index))
+        current = current_sources.get((target, target_index))
+        if current == (source, source_index):
+            continue
+        if current is not None:
+            patch.disconnect_input(target, target_index)
+        patch.connect(source, source_index, target, target_index)
+
+    # Inputs of the ops that remain which are not part of the plan at all
+    for (target, target_index) in current_sources:
+        if (target, target_index) not in planned_slots and target not in unused_handles:
+            patch.disconnect_input(target, target_index)
+
+    patch.destroys = sorted(unused_handles)
+    patch.attributes = [
+        (resolve(node), attribute, value) for node, attribute, value in plan.attributes
+    ]
+
+    # Replay the patch on the current network, so that one closing a cycle fails before
+    # anything is sent to TouchDesigner.
+    endpoints = [node for source, _, target, _ in snapshot["edges"] for node in (source, target)]
+    dag = IncrementalDAG.from_edges(list(snapshot["handles"]) + endpoints, snapshot["edges"])
+    for target, target_index in patch.disconnects:
+        dag.remove_edge(current_sources[(target, target_index)][0], target)
+    for handle in patch.destroys:
+        dag.remove_node(handle)
+    for source, _, target, _ in patch.edges:
+        if not dag.add_edge(source, target):
+            raise ValueError(f"Connecting {source} to {target} would close a cycle")
+    return patch, kept
+
+
+def patch_plan(td_proxy,
+               plan: GraphPlan,
+               snapshot=None,
+               batch: bool = True,
+               chunked: bool = False,
+               pipelined: bool = False,
+               cancel: Callable[[], bool] = None) -> Dict[str, int]:
+    """
+    Apply a plan on top of the current network, only changing what differs.
+
+    Unlike `apply_plan` after `TDProxy.clear`, ops matching the plan are kept, so the
+    cost scales with the size of the change rather than the size of the network.
+
+    Returns:
+        The handle of every plan node (kept or created), by plan node id.
+
+    Raises:
+        ValueError: The patched network would have cycles, checked before any change.
+    """
+    if snapshot is None:
+        snapshot = td_proxy.get_graph_snapshot()
+    patch, kept = diff_plan(snapshot, plan)
+    logger.info("Patching network: keeping %d nodes, creating %d, destroying %d, rewiring %d",
+                len(kept), len(patch.nodes), len(patch.destroys), len(patch.edges))
+    handles = apply_plan(td_proxy, patch, batch, chunked, pipelined=pipelined, cancel=cancel)
+    handles.update(kept)
+    return handles
+
+
+def get_io_descriptors(td_proxy,
+                       input_handles: List[int],
+                       output_handles: List[int],
+                       batch: bool = True) -> Tuple[Dict[int, dict], Dict[int, dict]]:
+    """Fetch the descriptors of the I/O ops, by handle."""
+    handles = input_handles + output_handles
+    if batch:
+        descriptors = dict(zip(handles, td_proxy.get_op_descriptors(handles)))
+    else:
+        descriptors = {handle: td_proxy.get_op_descriptor(handle) for handle in handles}
+    return ({
+        handle: descriptors[handle] for handle in input_handles
+    }, {
+        handle: descriptors[handle] for handle in output_handles
+    })
+
+
+def plan_for_bridge(registry: ComponentRegistry,
+                    input_descriptors: Dict[int, dict],
+                    output_descriptors: Dict[int, dict],
+                    reuse_weight: float = 0.7,
+                    seed: int = None,
+                    candidates: int = 1,
+                    score_weights: Dict[str, float] = None,
+                    search_deadline: float = None,
+                    max_nodes: int = DEFAULT_MAX_PLAN_NODES,
+                    max_depth: int = DEFAULT_MAX_PLAN_DEPTH,
+                    max_seconds: float = None,
+                    cost_budget: float = None,
+                    costs: Dict[str, float] = None) -> GraphPlan:
+    """
+    The validated plan `bridge` applies (in `graph_utils` and `async_client`), see `bridge`
+    for the arguments: the best of `candidates` (see `search_plans`), or a single
+    `plan_bridge`.
+
+    Raises:
+        ValueError: No plan within the budgets.
+    """
+    if candidates > 1:
+        plan, _ = search_plans(registry,
+                               input_descriptors,
+                               output_descriptors,
+                               candidates,
+                               reuse_weight,
+                               score_weights,
+                               seed=seed,
+                               deadline=search_deadline,
+                               max_nodes=max_nodes,
+                               max_depth=max_depth,
+                               max_seconds=max_seconds,
+                               cost_budget=cost_budget,
+                               costs=costs)
+        return plan
+    rng = random.Random(seed) if seed is not None else None
+    plan = plan_bridge(registry, input_descriptors, output_descriptors, reuse_weight, rng,
+                       max_nodes, max_depth, max_seconds, cost_budget, costs)
+    validate_plan(plan, registry, max_nodes, max_depth, cost_budget, costs)
+    return plan
+
+
 def bridge(td_proxy,
            input_handles: List[int],
            output_handles: List[int],
            reuse_weight: float = 0.7,
            exclude_components: List[str] = [],
-           include_io_config: bool = True):
+           include_io_config: bool = True,
+           batch: bool = False,
+           registry: ComponentRegistry = None,
+           incremental: bool = False,
+           chunked: bool = False,
+           seed: int = None,
+           pipelined: bool = False,
+           cancel: Callable[[], bool] = None,
+           candidates: int = 1,
+           score_weights: Dict[str, float] = None,
+           search_deadline: float = None,
+           max_nodes: int = DEFAULT_MAX_PLAN_NODES,
+           max_depth: int = DEFAULT_MAX_PLAN_DEPTH,
+           max_seconds: float = None,
+           cost_budget: float = None,
+           costs: Dict[str, float] = None):
     """
     Stochastically generate a network connecting input nodes to output nodes.
     Each handle represents a node in the TouchDesigner network.
@@ -70,6 +1738,8 @@ def bridge(td_proxy,
 
     The handles from the I/O config are automatically added to the input and output lists when `include_io_config` is True.
 
+    The network is planned with `plan_bridge` and then created with `apply_plan`.
+
     Args:
         td_proxy: The TouchDesigner proxy object.
         input_handles: A list of input handles.
@@ -77,30 +1747,47 @@ def bridge(td_proxy,
         reuse_weight: The weight of the reuse operation.
         exclude_components: List of component names or glob patterns to exclude (e.g. ["wrapped/*", "audio_*"])
         include_io_config: Whether to include handles from the IO config
+        batch: Fetch the I/O descriptors and apply the plan with a single call each,
+            instead of one call per handle, node and edge.
+        registry: Components to generate from. Loaded from `COMPONENTS_DIR` (minus
+            `exclude_components`) when not given.
+        incremental: Apply the plan with `patch_plan`, reusing the ops already in the
+            network, instead of creating every node.
+        chunked: Apply a batched plan over several TouchDesigner frames (see `apply_plan`).
+        seed: Seed of the random choices, so that the same network is generated from the
+            same components and I/O. Uses the `random` module's state when not given.
+        pipelined: Without `batch`, send the connections without waiting for each one
+            (see `MutationPipeline`).
+        cancel: Stops the network from being applied when it returns True (see
+            `apply_plan`), raising `PlanCancelled`.
+        candidates: Plan this many networks in a process pool and apply the best scoring
+            one (see `search_plans`), rather than the first one planned.
+        score_weights: Weights of the metrics candidates are scored with.
+        search_deadline: Seconds the candidates are planned for, at most.
+        max_nodes: The most nodes to create (see `plan_bridge`).
+        max_depth: The most created nodes on a path from an input to an output.
+        max_seconds: Seconds after which the planning stops making random choices.
+        cost_budget: The most milliseconds per frame the created nodes may cook for,
+            weighting the choice of components by their cost (see `plan_bridge`).
+        costs: Cook cost of the components by name, e.g. measured ones from
+            `CostDatabase.costs`, else those of their descriptors.
+
+    Returns:
+        The handles of the created nodes.
+
+    Raises:
+        ValueError: The outputs can't be produced within the budgets. Nothing is
+            created in TouchDesigner then.
     """
     logger.debug("Starting bridge with inputs=%s, outputs=%s", input_handles, output_handles)
 
-    # Get IO configuration
-    io_config = td_proxy.get_io_handles()
-    logger.debug("IO config: %s", io_config)
-
     # Get all component descriptors
-    components = load_components("/Users/kevin/Projects/graph_explorer/components",
-                                 exclude=exclude_components)
-
-    logger.debug("Available components: %s", components)
-
-    # Log the input node descriptors
-    for handle in input_handles:
-        desc = td_proxy.get_op_descriptor(handle)
-        logger.debug("Input handle %d descriptor: %s", handle, desc)
-
-    # When looking for components that can produce a type
-    producers = find_components_producing_type('waveform', components)
-    logger.debug("Found producers for 'waveform': %s", producers)
+    if registry is None:
+        registry = ComponentRegistry(load_components(COMPONENTS_DIR, exclude=exclude_components))
 
     if include_io_config:
         io_config = td_proxy.get_io_handles()
+        logger.debug("IO config: %s", io_config)
         input_handles.extend(io_config["inputs"])
         output_handles.extend(io_config["outputs"])
 
@@ -108,281 +1795,205 @@ def bridge(td_proxy,
         input_handles = list(set(input_handles))
         output_handles = list(set(output_handles))
 
-    # Get types for input and output nodes from their descriptors
-    # Each entry is (handle, index, type)
-    input_nodes = []
-    for handle in input_handles:
-        descriptor = td_proxy.get_op_descriptor(handle)
-        if descriptor and "outputs" in descriptor:
-            for idx, output in enumerate(descriptor["outputs"]):
-                output_type = output["type"]
-                input_nodes.append((handle, idx, output_type))
-                logger.debug("Input node %d output[%d] provides type %s", handle, idx, output_type)
-        else:
-            raise ValueError(f"No descriptor found for input handle {handle}")
-
-    # Keep track of unsatisfied outputs we need to connect
-    outputs_to_satisfy = []
-    for handle in output_handles:
-        descriptor = td_proxy.get_op_descriptor(handle)
-        if descriptor and "inputs" in descriptor:
-            for idx, input_desc in enumerate(descriptor["inputs"]):
-                input_type = input_desc["type"]
-                outputs_to_satisfy.append((handle, idx, input_type))
-                logger.debug("Output node %d input[%d] requires type %s", handle, idx, input_type)
-        else:
-            raise ValueError(f"No descriptor found for output handle {handle}")
-
-    # Keep track of available inputs we can connect to
-    # available_inputs = [(handle, idx, type_name)
-    #                     for handle, idx, type_name in input_nodes]
-
-    # Keep track of all nodes we create
-    created_nodes = []
-
-    # Keep track of available outputs by type
-    available_outputs = {}  # type -> List[(handle, index)]
-
-    for handle, idx, type_name in input_nodes:
-        if type_name not in available_outputs:
-            available_outputs[type_name] = []
-        available_outputs[type_name].append((handle, idx))
-
-    # Keep track of node ordering to prevent cycles
-    node_order = {}
-    current_order = 0
+    input_descriptors, output_descriptors = get_io_descriptors(td_proxy, input_handles,
+                                                               output_handles, batch)
+    plan = plan_for_bridge(registry, input_descriptors, output_descriptors, reuse_weight, seed,
+                           candidates, score_weights, search_deadline, max_nodes, max_depth,
+                           max_seconds, cost_budget, costs)
+    if cancel is not None and cancel():
+        raise PlanCancelled("Plan cancelled before being applied")
+    if incremental:
+        handles = patch_plan(td_proxy,
+                             plan,
+                             batch=batch,
+                             chunked=chunked,
+                             pipelined=pipelined,
+                             cancel=cancel)
+    else:
+        handles = apply_plan(td_proxy, plan, batch, chunked, pipelined=pipelined, cancel=cancel)
+
+    # Return all nodes created (or kept) by the bridge
+    return [handles[node_id] for node_id in plan.node_ids()]
+
+
+def topo_sort_snapshot(snapshot) -> List[int]:
+    """
+    Topologically sort the nodes of a graph snapshot, as returned by
+    `TDProxy.get_graph_snapshot` (or already turned into a `CompactGraph`), using Kahn's
+    algorithm.
+    """
+    graph = snapshot if isinstance(snapshot, CompactGraph) else CompactGraph.from_snapshot(snapshot)
+    sorted_handles = graph.topological_order()
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Topological sort complete. Order: %s", sorted_handles)
+    return sorted_handles
 
-    # Initialize output nodes with highest order
-    for handle in output_handles:
-        node_order[handle] = current_order
-        current_order += 1
 
-    def can_connect_without_cycle(source_handle: int, target_handle: int) -> bool:
-        """Check if connecting source to target would create a cycle."""
-        nonlocal current_order
+def topo_sort_handles(td_proxy, handles, snapshot=None):
+    """
+    Topologically sort the given handles, plus the handles directly feeding into them.
 
-        # If target isn't in ordering yet, assign it current_order
-        if target_handle not in node_order:
-            node_order[target_handle] = current_order
-            current_order += 1
+    The connections are fetched with a single `get_graph_snapshot` call, unless a
+    snapshot (or its `CompactGraph`) is given.
+    """
+    if snapshot is None:
+        snapshot = td_proxy.get_graph_snapshot(list(handles))
+    return topo_sort_snapshot(snapshot)
 
-        # If source isn't in ordering yet, assign it an order before target
-        if source_handle not in node_order:
-            node_order[source_handle] = node_order[target_handle] - 1
 
-        result = node_order[source_handle] < node_order[target_handle]
-        logger.debug(
-            f"[DEBUG] Cycle check: source={source_handle}(order={node_order.get(source_handle, 'None')}), "
-            f"target={target_handle}(order={node_order.get(target_handle, 'None')}), result={result}"
-        )
-        return result
+LAYOUT_MODES = ("row", "layered")
 
-    while outputs_to_satisfy:
-        output_handle, output_index, required_type = outputs_to_satisfy.pop(0)
-        logger.debug(
-            f"[DEBUG] Trying to satisfy output {output_handle}:{output_index} requiring type {required_type}"
-        )
 
-        # Try to find an existing output of the required type
-        logger.debug(f"[DEBUG] Available outputs by type: {available_outputs}")
-        valid_existing_outputs = [(h, idx)
-                                  for h, idx in available_outputs.get(required_type, [])
-                                  if can_connect_without_cycle(h, output_handle)]
-        logger.debug(
-            f"[DEBUG] Valid existing outputs for {required_type}: {valid_existing_outputs}")
-
-        rand_val = random.random()
-        use_existing = valid_existing_outputs and rand_val < reuse_weight
-        logger.debug(
-            f"[DEBUG] Random value: {rand_val}, REUSE_WEIGHT: {reuse_weight}, use_existing: {use_existing}"
-        )
-
-        # Create a new component
-        producer_components = find_components_producing_type(required_type, components)
-        logger.debug(
-            f"[DEBUG] Found producer components for {required_type}: {producer_components}")
-        if use_existing or not producer_components and len(valid_existing_outputs):
-            # Use an existing output
-            source_handle, source_index = random.choice(valid_existing_outputs)
-            logger.debug(
-                f"[DEBUG] Reusing existing output {source_handle}:{source_index} of type {required_type}"
-            )
-            td_proxy.connect(source_handle, source_index, output_handle, output_index)
-            logger.debug(
-                f"[DEBUG] Connected {source_handle}:{source_index} -> {output_handle}:{output_index}"
-            )
-
-        else:
-            if not producer_components:
-                raise ValueError(f"No components found that can produce type {required_type}")
-
-            chosen_component = random.choice(producer_components)
-            logger.debug(f"[DEBUG] Chose component {chosen_component} to produce {required_type}")
-
-            new_handle = td_proxy.load(chosen_component)
-            created_nodes.append(new_handle)
-            logger.debug(f"[DEBUG] Created component with handle {new_handle}")
-
-            # Connect its output to our target
-            td_proxy.connect(new_handle, 0, output_handle, output_index)
-            logger.debug(f"[DEBUG] Connected {new_handle}:0 -> {output_handle}:{output_index}")
-
-            # Register all outputs as available
-            component_desc = components[chosen_component]
-            for i, output_desc in enumerate(component_desc.get("outputs", [])):
-                if i != 0:  # Skip the output we just used
-                    output_type = output_desc["type"]
-                    if output_type not in available_outputs:
-                        available_outputs[output_type] = []
-                    available_outputs[output_type].append((new_handle, i))
-                    logger.debug(
-                        f"[DEBUG] Registered available output {new_handle}:{i} of type {output_type}"
-                    )
-
-            # Add its inputs to our list of outputs we need to satisfy
-            for i, input_desc in enumerate(component_desc.get("inputs", [])):
-                # First check if we have an available input of matching type
-                # matching_input_idx = None
-                # for j, (in_handle, in_index,
-                #         in_type) in enumerate(available_inputs):
-                #     if in_type == input_desc["type"]:
-                #         matching_input_idx = j
-                #         break
-
-                # if matching_input_idx is not None:
-                #     # Use this available input
-                #     in_handle, in_index, _ = available_inputs.pop(
-                #         matching_input_idx)
-                #     td_proxy.connect(in_handle, in_index, new_handle, i)
-                #     logger.debug(
-                #         f"[DEBUG] Connected available input {in_handle}:{in_index} -> {new_handle}:{i}"
-                #     )
-                # else:
-                # Add to outputs we need to satisfy
-                outputs_to_satisfy.append((new_handle, i, input_desc["type"]))
-                logger.debug(
-                    f"[DEBUG] Added new output to satisfy: {new_handle}:{i} type {input_desc['type']}"
-                )
-
-    #if available_inputs:
-    #    logger.warning(
-    #        f"[WARNING] Some inputs were not used: {available_inputs}")
-
-    # Return all nodes involved in the bridge
-    return created_nodes
-
-
-def topo_sort_handles(td_proxy, handles):
-    logger.debug("Starting topological sort")
-    # Get the connection information for each handle
-    connection_info = {}
-
-    # First pass: collect all handles including referenced inputs
-    all_handles = set(handles)
-    for handle in handles:
-        logger.debug(f"[DEBUG] Getting connectors for handle {handle}")
-        connectors = td_proxy.get_op_connectors(handle)
-        logger.debug(f"[DEBUG] Raw connector info: {connectors}")
-
-        # Look at the actual connections in the input connectors
-        for in_conn in connectors["in"]:
-            if in_conn["targets"]:  # Only look at connectors that have actual connections
-                for target_handle, _ in in_conn["targets"]:
-                    if target_handle is not None:
-                        all_handles.add(target_handle)
-
-    # Second pass: get connection info for all handles
-    for handle in all_handles:
-        connectors = td_proxy.get_op_connectors(handle)
-
-        in_connections = []
-        for in_conn in connectors["in"]:
-            if in_conn["targets"]:  # Only count connectors that have actual connections
-                in_connections.append(in_conn)
-
-        out_connections = []
-        for out_conn in connectors["out"]:
-            if out_conn["targets"]:  # Only count connectors that have actual connections
-                out_connections.append(out_conn)
-
-        connection_info[handle] = {
-            "in_connectors": in_connections,
-            "out_connectors": out_connections
-        }
-        logger.debug(
-            f"[DEBUG] Handle {handle} has {len(in_connections)} active inputs and {len(out_connections)} active outputs"
-        )
+def layout_nodes(td_proxy, sorted_handles, mode: str = "row", snapshot=None, pipelined=False):
+    """
+    Position the nodes, given in topological order.
 
-    # Kahn's algorithm for topological sort
-    # Count incoming edges for each node
-    in_degree = {handle: len(connection_info[handle]["in_connectors"]) for handle in all_handles}
+    In "row" mode the nodes are placed in a single row, in sorted order, centered
+    around 0. In "layered" mode they are placed in columns by depth (see
+    `layered_positions`), which needs the edges from a graph snapshot (or its
+    `CompactGraph`); one is fetched when not given.
 
-    # Find all nodes with no incoming edges
-    queue = [handle for handle in all_handles if in_degree[handle] == 0]
-    logger.debug(f"[DEBUG] Starting nodes with no incoming edges: {queue}")
+    Geometry is read with one `get_nodes_geometry` call and positions are written
+    with one `set_nodes_positions` call, which is pipelined (see `MutationPipeline`)
+    when `pipelined`.
+    """
+    logger.debug("Starting node layout")
+    MARGIN = 20  # Units between nodes
 
-    sorted_handles = []
-    while queue:
-        current = queue.pop(0)  # Get next node with no incoming edges
-        sorted_handles.append(current)
-        logger.debug(f"[DEBUG] Adding node {current} to sorted list")
-
-        # Remove edges from current node to its targets
-        for out_conn in connection_info[current]["out_connectors"]:
-            for target_handle, _ in out_conn["targets"]:
-                if target_handle in in_degree:  # Only process nodes we're tracking
-                    in_degree[target_handle] -= 1
-                    logger.debug(
-                        f"[DEBUG] Reduced in-degree of {target_handle} to {in_degree[target_handle]}"
-                    )
-                    if in_degree[target_handle] == 0:
-                        queue.append(target_handle)
-                        logger.debug(
-                            f"[DEBUG] Node {target_handle} has no more incoming edges, adding to queue"
-                        )
-
-    if len(sorted_handles) != len(all_handles):
-        raise ValueError("Graph has cycles")
-
-    logger.debug(f"[DEBUG] Topological sort complete. Order: {sorted_handles}")
-    return sorted_handles
+    # Get the geometry for each handle
+    geometry = td_proxy.get_nodes_geometry(list(sorted_handles))
 
+    if mode == "layered":
+        if snapshot is None:
+            snapshot = td_proxy.get_graph_snapshot(list(sorted_handles))
+        edges = snapshot if isinstance(snapshot, CompactGraph) else snapshot["edges"]
+        positions = layered_positions(sorted_handles, edges, geometry, MARGIN)
+    elif mode == "row":
+        positions = row_positions(sorted_handles, geometry, MARGIN)
+    else:
+        raise ValueError(f"Unknown layout mode {mode}, expected one of {LAYOUT_MODES}")
 
-def layout_nodes(td_proxy, sorted_handles):
-    logger.debug("Starting node layout")
+    logger.debug("Positioning nodes: %s", positions)
+    _set_positions(td_proxy, positions, pipelined)
 
-    # Get the geometry for each handle
-    geometry = {}
-    total_width = 0
-    max_height = 0
-    MARGIN = 20  # Units between nodes
 
-    logger.debug("[DEBUG] Collecting geometry information")
-    for handle in sorted_handles:
-        logger.debug(f"[DEBUG] Getting geometry for handle {handle}")
-        x, y, w, h = td_proxy.get_op_node_geometry(handle)
-        geometry[handle] = (x, y, w, h)
-        total_width += w
-        max_height = max(max_height, h)
-        logger.debug(f"[DEBUG] Node {handle} geometry: x={x}, y={y}, w={w}, h={h}")
+def row_positions(sorted_handles, geometry, margin=20):
+    """
+    Place the nodes in a single row, in sorted order, centered around 0.
 
+    Returns:
+        The (x, y) position of each handle.
+    """
     # Calculate total width including margins
-    total_width += MARGIN * (len(sorted_handles) - 1)
+    total_width = sum(w for _, _, w, _ in geometry)
+    total_width += margin * (len(sorted_handles) - 1)
 
     # Calculate starting x position to center around 0
     start_x = -total_width / 2
 
     # Set all of the node X coordinates according to the sorted order
+    positions = {}
     current_x = start_x
-    logger.debug("[DEBUG] Positioning nodes")
-    for handle in sorted_handles:
-        x, y, w, h = geometry[handle]
+    for handle, (x, y, w, h) in zip(sorted_handles, geometry):
         # Center vertically at y=0
-        center_y = -h / 2
-
-        logger.debug(f"[DEBUG] Setting position for handle {handle} to x={current_x}, y={center_y}")
-        td_proxy.set_op_attribute(handle, "nodeX", current_x)
-        td_proxy.set_op_attribute(handle, "nodeY", center_y)
+        positions[handle] = (current_x, -h / 2)
 
         # Move to next position including margin
-        current_x += w + MARGIN
+        current_x += w + margin
+    return positions
+
+
+def _set_positions(td_proxy, positions, pipelined):
+    if pipelined:
+        mutations = MutationPipeline(td_proxy)
+        mutations.set_nodes_positions(positions)
+        mutations.flush()
+    else:
+        td_proxy.set_nodes_positions(positions)
+
+
+def layered_positions(sorted_handles, edges, geometry, margin=20, sweeps=4):
+    """
+    Compute a layered (Sugiyama-style) layout, flowing left to right.
+
+    Nodes are ranked by their longest path from a source, ordered within each rank to
+    reduce edge crossings (barycenter heuristic, alternating sweeps), and stacked into
+    columns centered around 0.
+
+    Args:
+        sorted_handles: The handles to place, in topological order.
+        edges: (source, source_index, target, target_index) tuples, or a `CompactGraph`;
+            edges to or from handles that are not being placed are ignored.
+        geometry: (x, y, w, h) for each handle, in the same order as `sorted_handles`.
+        margin: Units between nodes, and between columns.
+        sweeps: Number of crossing reduction sweeps.
+
+    Returns:
+        A dict of handle -> (x, y).
+    """
+    n = len(sorted_handles)
+    if n == 0:
+        return {}
+    if isinstance(edges, CompactGraph):
+        # Renumber the graph's nodes by their place in `sorted_handles`, -1 when not placed.
+        place = np.full(len(edges), -1, dtype=np.int64)
+        place[[edges.index[handle] for handle in sorted_handles]] = np.arange(n)
+        src, dst = (place[nodes] for nodes in edges.edge_arrays())
+        placed = (src >= 0) & (dst >= 0)
+        src, dst = src[placed], dst[placed]
+    else:
+        index = {handle: i for i, handle in enumerate(sorted_handles)}
+        pairs = [(index[source], index[target])
+                 for source, _, target, _ in edges
+                 if source in index and target in index]
+        src = np.array([s for s, _ in pairs], dtype=np.int64)
+        dst = np.array([t for _, t in pairs], dtype=np.int64)
+    size = np.asarray(geometry, dtype=np.float64).reshape(n, 4)[:, 2:]
+    width, height = size[:, 0], size[:, 1]
+
+    # Rank by longest path from a source. Nodes are in topological order, so relaxing
+    # the edges by target, in a single pass, ranks every source before its targets.
+    rank = [0] * n
+    by_target = np.argsort(dst, kind="stable")
+    for source, target in zip(src[by_target].tolist(), dst[by_target].tolist()):
+        if rank[target] <= rank[source]:
+            rank[target] = rank[source] + 1
+    rank = np.array(rank, dtype=np.int64)
+    num_ranks = int(rank.max()) + 1
+
+    # Order within each rank: start from topological order, then repeatedly sort each
+    # rank by the mean position of the neighbors in the previous (or next) rank.
+    def positions_for(order):
+        # Position of each node within its rank, given the global (rank, position) order.
+        rank_start = np.searchsorted(rank[order], np.arange(num_ranks))
+        position = np.empty(n, dtype=np.float64)
+        position[order] = np.arange(n) - rank_start[rank[order]]
+        return position
+
+    order = np.lexsort((np.arange(n), rank))
+    position = positions_for(order)
+    for sweep in range(sweeps):
+        neighbors, nodes = (src, dst) if sweep % 2 == 0 else (dst, src)
+        total = np.bincount(nodes, weights=position[neighbors], minlength=n)
+        count = np.bincount(nodes, minlength=n)
+        barycenter = np.where(count > 0, total / np.maximum(count, 1), position)
+        order = np.lexsort((position, barycenter, rank))
+        position = positions_for(order)
+
+    # Columns are as wide as their widest node, and laid out left to right.
+    column_width = np.zeros(num_ranks)
+    np.maximum.at(column_width, rank, width)
+    column_x = np.concatenate(([0.0], np.cumsum(column_width + margin)[:-1]))
+    total_width = column_width.sum() + margin * (num_ranks - 1)
+    x = column_x[rank] - total_width / 2
+
+    # Nodes are stacked top to bottom within their column, centered around 0.
+    stacked = height[order] + margin
+    offset_in_column = np.cumsum(stacked) - stacked
+    column_start = offset_in_column[np.searchsorted(rank[order], np.arange(num_ranks))]
+    column_height = np.bincount(rank, weights=height + margin, minlength=num_ranks) - margin
+    top = np.empty(n)
+    top[order] = offset_in_column - column_start[rank[order]]
+    y = column_height[rank] / 2 - top - height
+
+    return {handle: (float(x[i]), float(y[i])) for i, handle in enumerate(sorted_handles)}
@@ -1,7 +1,16 @@
+import json
+import os
+import random
+import tempfile
 import unittest
 import logging
+from collections import Counter
 from parameterized import parameterized
-from graph_utils import bridge, topo_sort_handles, load_components
+from graph_utils import (bridge, topo_sort_handles, layout_nodes, load_components, plan_bridge,
+                         patch_plan, GraphPlan, ComponentRegistry, ComponentCache,
+                         find_components_producing_type, candidate_seeds, search_plans, score_plan,
+                         PLAN_METRICS, Feasibility, validate_plan, CostDatabase, descriptor_cost,
+                         IncrementalDAG, CompactGraph, layered_positions, DEFAULT_MAX_PLAN_DEPTH)
 from unittest.mock import MagicMock, patch
 
 # Add at the top of the file
@@ -17,9 +26,26 @@ class MockTDProxy:
         self.loaded_components = {}  # handle -> component_name
         self.node_geometry = {}  # handle -> (x, y, w, h)
         self.attributes = {}  # (handle, attr) -> value
-        self.io_handles = {}  # {input/output: [{type: type}]}
+        self.io_handles = {'inputs': [], 'outputs': []}  # {inputs/outputs: [handle]}
+        self.components = {}  # component_name -> descriptor
+        self.calls = []  # Names of the proxy methods called, in order
+        self.plan_jobs = []
+        self.posted_mutations = {}
+
+    def get_io_handles(self):
+        self.calls.append('get_io_handles')
+        return self.io_handles
+
+    def get_op_descriptor(self, handle):
+        self.calls.append('get_op_descriptor')
+        return self.components.get(self.loaded_components.get(handle))
+
+    def get_op_descriptors(self, handles):
+        self.calls.append('get_op_descriptors')
+        return [self.components.get(self.loaded_components.get(handle)) for handle in handles]
 
     def load(self, component_name):
+        self.calls.append('load')
         handle = self.next_handle
         self.next_handle += 1
         self.loaded_components[handle] = component_name
@@ -27,12 +53,88 @@ class MockTDProxy:
         return handle
 
     def connect(self, source_handle, source_idx, target_handle, target_idx):
+        self.calls.append('connect')
         key = (source_handle, source_idx)
         if key not in self.connections:
             self.connections[key] = []
         self.connections[key].append((target_handle, target_idx))
         logger.debug("Connected %s[%d] -> %s[%d]", source_handle, source_idx, target_handle,
                      target_idx)
+        return True
+
+    def disconnect(self, handle, in_indices, out_indices):
+        self.calls.append('disconnect')
+        for (src_h, src_idx), targets in self.connections.items():
+            targets[:] = [(tgt_h, tgt_idx)
+                          for tgt_h, tgt_idx in targets
+                          if not (tgt_h == handle and tgt_idx in in_indices)]
+            if src_h == handle and src_idx in out_indices:
+                targets.clear()
+        return True
+
+    def delete_op(self, handle):
+        self.calls.append('delete_op')
+        self.loaded_components.pop(handle)
+        self.connections = {
+            (src_h, src_idx): [(tgt_h, tgt_idx) for tgt_h, tgt_idx in targets if tgt_h != handle]
+            for (src_h, src_idx), targets in self.connections.items()
+            if src_h != handle
+        }
+        return True
+
+    def apply_plan(self, plan):
+        self.calls.append('apply_plan')
+        return self._apply_plan(plan)
+
+    def submit_plan(self, plan):
+        self.calls.append('submit_plan')
+        self.plan_jobs.append({'plan': plan, 'polls': 0})
+        return len(self.plan_jobs) - 1
+
+    def get_plan_status(self, job_id):
+        # Jobs take two polls to finish, like a plan split across frames.
+        self.calls.append('get_plan_status')
+        job = self.plan_jobs[job_id]
+        job['polls'] += 1
+        if job['polls'] < 2:
+            return {'finished': False, 'done': 0, 'total': 1}
+        return {'finished': True, 'done': 1, 'total': 1, 'result': self._apply_plan(job['plan'])}
+
+    def _apply_plan(self, plan):
+        for handle, input_index in plan['disconnect']:
+            self.disconnect(handle, [input_index], [])
+        for handle in plan['destroy']:
+            self.delete_op(handle)
+        handles = {}
+        for node in plan['nodes']:
+            handle = self.next_handle
+            self.next_handle += 1
+            self.loaded_components[handle] = node['component']
+            self.node_geometry[handle] = (0, 0, 100, 100)
+            handles[node['id']] = handle
+
+        def resolve(node):
+            return handles[node] if isinstance(node, str) else node
+
+        for source, source_idx, target, target_idx in plan['edges']:
+            self.connections.setdefault((resolve(source), source_idx), []).append(
+                (resolve(target), target_idx))
+        for node, attr, value in plan['attributes']:
+            self.attributes[(resolve(node), attr)] = value
+        return {'handles': handles, 'failed_edges': [], 'failed_attributes': []}
+
+    def post_mutation(self, pipeline, seq, method, args):
+        self.calls.append('post_mutation')
+        self.posted_mutations[seq] = (method, args)
+
+    def flush_mutations(self, pipeline, count):
+        self.calls.append('flush_mutations')
+        errors = []
+        for seq in range(count):
+            method, args = self.posted_mutations.pop(seq)
+            if getattr(self, method)(*args) is False:
+                errors.append({'seq': seq, 'method': method, 'args': args, 'error': 'failed'})
+        return {'applied': count - len(errors), 'errors': errors}
 
     def get_op_connectors(self, handle):
         logger.debug("Getting connectors for handle %d", handle)
@@ -54,12 +156,42 @@ class MockTDProxy:
         logger.debug("Found inputs: %s, outputs: %s", in_conns, out_conns)
         return {"in": in_conns, "out": out_conns}
 
+    def get_graph_snapshot(self, handles=None):
+        self.calls.append('get_graph_snapshot')
+        edges = [(src_h, src_idx, tgt_h, tgt_idx)
+                 for (src_h, src_idx), targets in self.connections.items()
+                 for tgt_h, tgt_idx in targets]
+        if handles is None:
+            nodes = set(self.loaded_components)
+        else:
+            # The requested handles, plus the handles directly feeding into them.
+            nodes = set(handles)
+            nodes.update(src_h for src_h, _, tgt_h, _ in edges if tgt_h in handles)
+        io_handles = self.io_handles['inputs'] + self.io_handles['outputs']
+        return {
+            'handles': list(nodes),
+            'components': [self.loaded_components.get(handle) for handle in nodes],
+            'reserved': [handle in io_handles for handle in nodes],
+            'edges': [edge for edge in edges if edge[0] in nodes and edge[2] in nodes],
+        }
+
     def get_op_node_geometry(self, handle):
         return self.node_geometry.get(handle, (0, 0, 100, 100))
 
+    def get_nodes_geometry(self, handles):
+        self.calls.append('get_nodes_geometry')
+        return [self.get_op_node_geometry(handle) for handle in handles]
+
     def set_op_attribute(self, handle, attr, value):
         self.attributes[(handle, attr)] = value
 
+    def set_nodes_positions(self, positions):
+        self.calls.append('set_nodes_positions')
+        for handle, (x, y) in positions.items():
+            self.attributes[(handle, 'nodeX')] = x
+            self.attributes[(handle, 'nodeY')] = y
+        return True
+
 
 class TestGraphUtils(unittest.TestCase):
 
@@ -71,7 +203,7 @@ class TestGraphUtils(unittest.TestCase):
         # Mock the components directory
         self.components_patcher = patch('graph_utils.load_components')
         self.mock_load_components = self.components_patcher.start()
-        self.mock_load_components.return_value = {
+        self.td_proxy.components = self.mock_load_components.return_value = {
             'rgb_to_tex': {
                 'inputs': [{
                     'type': 'rgb'
@@ -117,28 +249,11 @@ class TestGraphUtils(unittest.TestCase):
     def tearDown(self):
         self.components_patcher.stop()
 
-    @parameterized.expand([
-        (
-            "simple_chain",
-            [(1, 'waveform')],  # input_nodes
-            [(2, 'tex')],  # output_nodes
-            3),  # expected_node_count: audio_to_band -> unitary_to_rgb -> rgb_to_tex
-        ("reuse_outputs", [(1, 'waveform')], [(2, 'tex'), (3, 'tex')],
-         5),  # One extra rgb_to_tex for the second output
-    ])
-    def test_bridge(self, name, input_nodes, output_nodes, expected_node_count):
-        logger.debug("\nStarting bridge test: %s", name)
-        logger.debug("Input nodes: %s", input_nodes)
-        logger.debug("Output nodes: %s", output_nodes)
-
+    def set_up_io_nodes(self, input_nodes, output_nodes):
         # Set up IO handles to match the input/output nodes
         self.td_proxy.io_handles = {
-            'inputs': [{
-                'type': type
-            } for _, type in input_nodes],
-            'outputs': [{
-                'type': type
-            } for _, type in output_nodes]
+            'inputs': [handle for handle, _ in input_nodes],
+            'outputs': [handle for handle, _ in output_nodes]
         }
         logger.debug("IO handles configured: %s", self.td_proxy.io_handles)
 
@@ -157,6 +272,22 @@ class TestGraphUtils(unittest.TestCase):
             self.td_proxy.loaded_components[handle] = component_name
             logger.debug("Set up output node %d with descriptor: %s", handle, descriptor)
 
+    @parameterized.expand([
+        (
+            "simple_chain",
+            [(1, 'waveform')],  # input_nodes
+            [(2, 'tex')],  # output_nodes
+            3),  # expected_node_count: audio_to_band -> unitary_to_rgb -> rgb_to_tex
+        ("reuse_outputs", [(1, 'waveform')], [(2, 'tex'), (3, 'tex')],
+         5),  # One extra rgb_to_tex for the second output
+    ])
+    def test_bridge(self, name, input_nodes, output_nodes, expected_node_count):
+        logger.debug("\nStarting bridge test: %s", name)
+        logger.debug("Input nodes: %s", input_nodes)
+        logger.debug("Output nodes: %s", output_nodes)
+
+        self.set_up_io_nodes(input_nodes, output_nodes)
+
         # Extract just the handle numbers for bridge() call
         input_handles = [handle for handle, _ in input_nodes]
         output_handles = [handle for handle, _ in output_nodes]
@@ -194,6 +325,486 @@ class TestGraphUtils(unittest.TestCase):
                 self.assertLess(sorted_handles.index(created_handle),
                                 sorted_handles.index(out_handle))
 
+    def test_bridge_batch(self):
+        self.set_up_io_nodes([(1, 'waveform')], [(2, 'tex')])
+
+        created_nodes = bridge(self.td_proxy, [1], [2], reuse_weight=1, batch=True)
+
+        # The whole network is built with a single apply_plan call.
+        self.assertEqual(self.td_proxy.calls,
+                         ['get_io_handles', 'get_op_descriptors', 'apply_plan'])
+        self.assertEqual(len(created_nodes), 3)
+        self.assertEqual(
+            sorted(self.td_proxy.loaded_components[handle] for handle in created_nodes),
+            ['audio_to_band', 'rgb_to_tex', 'wrapped/unitary_to_rgb'])
+
+        sorted_handles = topo_sort_handles(self.td_proxy, [1] + created_nodes + [2])
+        self.assertEqual(sorted_handles[0], 1)
+        self.assertEqual(sorted_handles[-1], 2)
+
+    def test_bridge_chunked(self):
+        self.set_up_io_nodes([(1, 'waveform')], [(2, 'tex')])
+
+        created_nodes = bridge(self.td_proxy, [1], [2], reuse_weight=1, batch=True, chunked=True)
+
+        # The plan is submitted as a job, then polled until TouchDesigner has applied it.
+        self.assertEqual(self.td_proxy.calls, [
+            'get_io_handles', 'get_op_descriptors', 'submit_plan', 'get_plan_status',
+            'get_plan_status'
+        ])
+        self.assertEqual(
+            sorted(self.td_proxy.loaded_components[handle] for handle in created_nodes),
+            ['audio_to_band', 'rgb_to_tex', 'wrapped/unitary_to_rgb'])
+
+    def test_bridge_seed(self):
+        self.set_up_io_nodes([(1, 'waveform')], [(2, 'tex'), (3, 'tex')])
+        io_components = dict(self.td_proxy.loaded_components)
+
+        networks = []
+        for _ in range(2):
+            self.td_proxy.loaded_components = dict(io_components)
+            self.td_proxy.connections = {}
+            random.seed()  # The seed makes the network independent of the global state
+            created_nodes = bridge(self.td_proxy, [1], [2, 3], reuse_weight=0.5, seed=7)
+            networks.append(([self.td_proxy.loaded_components[h] for h in created_nodes],
+                             self.td_proxy.connections))
+            self.td_proxy.next_handle = 100
+
+        self.assertEqual(networks[0], networks[1])
+
+    def test_bridge_pipelined(self):
+        self.set_up_io_nodes([(1, 'waveform')], [(2, 'tex')])
+
+        created_nodes = bridge(self.td_proxy, [1], [2], reuse_weight=1, pipelined=True, seed=0)
+        sorted_handles = topo_sort_handles(self.td_proxy, [1] + created_nodes + [2])
+        layout_nodes(self.td_proxy, sorted_handles, pipelined=True)
+
+        # Connections and positions are posted, with a single flush after each.
+        calls = Counter(self.td_proxy.calls)
+        self.assertEqual(calls['post_mutation'], 7)  # 6 connections and the positions
+        self.assertEqual(calls['flush_mutations'], 2)
+        self.assertEqual(sorted_handles[0], 1)
+        self.assertEqual(sorted_handles[-1], 2)
+        self.assertIn((2, 'nodeX'), self.td_proxy.attributes)
+
+    def test_plan_bridge_offline(self):
+        components = self.mock_load_components.return_value
+        input_descriptors = {1: {'inputs': [], 'outputs': [{'type': 'waveform'}]}}
+        output_descriptors = {2: {'inputs': [{'type': 'tex'}], 'outputs': []}}
+
+        for seed in range(20):
+            plan = plan_bridge(components,
+                               input_descriptors,
+                               output_descriptors,
+                               reuse_weight=0.5,
+                               rng=random.Random(seed))
+
+            # Every edge connects ports of the same type.
+            for source, source_idx, target, target_idx in plan.edges:
+                self.assertEqual(plan.ports[source]['outputs'][source_idx],
+                                 plan.ports[target]['inputs'][target_idx])
+
+            # Every input port of every created node and output op is connected exactly once.
+            connected_inputs = [(target, target_idx) for _, _, target, target_idx in plan.edges]
+            expected_inputs = [(node, i)
+                               for node in plan.node_ids() + [2]
+                               for i in range(len(plan.ports[node]['inputs']))]
+            self.assertCountEqual(connected_inputs, expected_inputs)
+
+            # Plans survive a round trip through JSON.
+            restored = GraphPlan.from_dict(json.loads(json.dumps(plan.to_dict())), components)
+            self.assertEqual(restored.to_dict(), plan.to_dict())
+
+        # Nothing was sent to TouchDesigner.
+        self.assertEqual(self.td_proxy.calls, [])
+
+    def test_feasibility(self):
+        registry = ComponentRegistry(self.mock_load_components.return_value)
+        feasibility = Feasibility(registry, ['waveform'])
+
+        self.assertEqual(feasibility.type_depth, {'waveform': 0, 'unitary': 1, 'rgb': 2, 'tex': 3})
+        self.assertEqual(feasibility.type_cost['tex'], 5)
+        self.assertEqual(feasibility.component_cost['wrapped/unitary_to_rgb'], 4)
+        self.assertFalse(feasibility.is_feasible('xy'))
+
+    def test_plan_bridge_budgets(self):
+        registry = ComponentRegistry(self.mock_load_components.return_value)
+        input_descriptors = {1: {'inputs': [], 'outputs': [{'type': 'waveform'}]}}
+        output_descriptors = {2: {'inputs': [{'type': 'tex'}], 'outputs': []}}
+
+        # Without reuse, the plans would grow until out of budget. They stay within it.
+        for seed in range(20):
+            plan = plan_bridge(registry,
+                               input_descriptors,
+                               output_descriptors,
+                               reuse_weight=0.0,
+                               rng=random.Random(seed),
+                               max_nodes=8,
+                               max_depth=4)
+            validate_plan(plan, registry, max_nodes=8, max_depth=4)
+
+        # Out of time, the remaining inputs are satisfied the cheapest way.
+        plan = plan_bridge(registry,
+                           input_descriptors,
+                           output_descriptors,
+                           reuse_weight=0.0,
+                           max_seconds=0)
+        self.assertCountEqual([node['component'] for node in plan.nodes],
+                              ['rgb_to_tex', 'wrapped/unitary_to_rgb', 'audio_to_band'])
+
+        # Outputs that can't be produced fail before anything is planned.
+        with self.assertRaisesRegex(ValueError, 'deep'):
+            plan_bridge(registry, input_descriptors, output_descriptors, max_depth=2)
+        with self.assertRaisesRegex(ValueError, 'budget of 2'):
+            plan_bridge(registry, input_descriptors, output_descriptors, max_nodes=2)
+        with self.assertRaisesRegex(ValueError, "can't be produced"):
+            plan_bridge(registry, input_descriptors, {2: {'inputs': [{'type': 'xy'}]}})
+
+    def test_validate_plan(self):
+        components = self.mock_load_components.return_value
+        plan = GraphPlan()
+        plan.add_existing(1, {'outputs': [{'type': 'waveform'}]})
+        plan.add_existing(2, {'inputs': [{'type': 'tex'}]})
+        tex = plan.load('rgb_to_tex', components['rgb_to_tex'])
+        plan.connect(1, 0, tex, 0)
+        plan.connect(tex, 0, 2, 0)
+        plan.connect(tex, 0, 2, 0)
+        plan.load('missing', None)
+
+        with self.assertRaises(ValueError) as context:
+            validate_plan(plan, ComponentRegistry(components))
+        message = str(context.exception)
+        self.assertIn('Unknown component missing', message)
+        self.assertIn('connects waveform to rgb', message)
+        self.assertIn('Input 2:0 is connected 2 times', message)
+
+        self.td_proxy.io_handles = {'inputs': [], 'outputs': []}
+        with patch('graph_utils.plan_bridge', return_value=plan):
+            with self.assertRaises(ValueError):
+                bridge(self.td_proxy, [], [], include_io_config=False)
+        # The invalid plan wasn't applied.
+        self.assertNotIn('load', self.td_proxy.calls)
+
+    def test_plan_bridge_cost_budget(self):
+        components = {
+            'cheap_tex': {
+                'inputs': [{
+                    'type': 'rgb'
+                }],
+                'outputs': [{
+                    'type': 'tex'
+                }],
+                'cost': 0.5
+            },
+            'costly_tex': {
+                'inputs': [{
+                    'type': 'rgb'
+                }],
+                'outputs': [{
+                    'type': 'tex'
+                }],
+                'cost': {
+                    'cpu_ms': 1.0,
+                    'gpu_ms': 3.0
+                }
+            },
+        }
+        registry = ComponentRegistry(components)
+        input_descriptors = {1: {'outputs': [{'type': 'rgb'}]}}
+        output_descriptors = {2: {'inputs': [{'type': 'tex'}, {'type': 'tex'}]}}
+
+        def chosen(cost_budget, costs=None):
+            plans = [
+                plan_bridge(registry,
+                            input_descriptors,
+                            output_descriptors,
+                            reuse_weight=0.0,
+                            rng=random.Random(seed),
+                            cost_budget=cost_budget,
+                            costs=costs) for seed in range(100)
+            ]
+            for plan in plans:
+                validate_plan(plan, registry, cost_budget=cost_budget, costs=costs)
+            return Counter(node['component'] for plan in plans for node in plan.nodes)
+
+        # Costly components are drawn less the more of the budget they'd use.
+        self.assertGreater(chosen(10.0)['cheap_tex'], 1.5 * chosen(10.0)['costly_tex'])
+        self.assertEqual(set(chosen(4.5)), {'cheap_tex', 'costly_tex'})
+        self.assertEqual(set(chosen(4.0)), {'cheap_tex'})
+        # Measured costs take precedence over the descriptors'.
+        self.assertEqual(set(chosen(4.0, {'cheap_tex': 5.0, 'costly_tex': 0.1})), {'costly_tex'})
+        with self.assertRaisesRegex(ValueError, 'budget of 0.5 ms'):
+            plan_bridge(registry, input_descriptors, output_descriptors, cost_budget=0.5)
+
+    def test_cost_database(self):
+        self.assertEqual(descriptor_cost({'cost': {'cpu_ms': 0.25, 'gpu_ms': 1.0}}), 1.25)
+        self.assertEqual(descriptor_cost({}), 1.0)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'costs.json')
+            cost_db = CostDatabase(path, window=3)
+            self.assertEqual(
+                cost_db.update({
+                    10: {
+                        'component': 'zoom',
+                        'cpu_ms': 1.0,
+                        'gpu_ms': 2.0
+                    },
+                    11: {
+                        'component': 'ascii',
+                        'cpu_ms': 0.5,
+                        'gpu_ms': 0.0
+                    },
+                }), 2)
+            for milliseconds in (4.0, 5.0, 6.0):
+                cost_db.record('zoom', milliseconds)
+            cost_db.save()
+
+            # Only the last samples are kept, and they are reloaded from the file.
+            self.assertEqual(CostDatabase(path, window=3).costs(), {'zoom': 5.0, 'ascii': 0.5})
+            self.assertIsNone(cost_db.estimate('edge'))
+
+    def test_incremental_dag(self):
+        dag = IncrementalDAG.from_edges(['a', 'b', 'c', 'd'], [('c', 0, 'd', 0)])
+
+        # Edges against the order reorder the nodes in between.
+        self.assertTrue(dag.add_edge('d', 'a'))
+        self.assertTrue(dag.add_edge('b', 'c'))
+        self.assertTrue(dag.add_edge('b', 'c'))  # From another port
+        order = dag.topological_order()
+        self.assertLess(order.index('b'), order.index('c'))
+        self.assertLess(order.index('c'), order.index('d'))
+        self.assertLess(order.index('d'), order.index('a'))
+
+        self.assertTrue(dag.would_create_cycle('a', 'b'))
+        self.assertFalse(dag.add_edge('a', 'b'))
+        self.assertFalse(dag.add_edge('c', 'c'))
+        dag.remove_edge('b', 'c')
+        self.assertTrue(dag.would_create_cycle('c', 'b'))
+        dag.remove_edge('b', 'c')
+        self.assertFalse(dag.would_create_cycle('c', 'b'))
+        dag.remove_node('d')
+        self.assertTrue(dag.add_edge('a', 'c'))
+
+        with self.assertRaisesRegex(ValueError, 'cycles'):
+            IncrementalDAG.from_edges([1, 2], [(1, 0, 2, 0), (2, 0, 1, 0)])
+
+    def test_plan_bridge_without_depth_budget(self):
+        # Without a depth budget, the planner reuses any output not closing a cycle.
+        registry = ComponentRegistry(self.mock_load_components.return_value)
+        input_descriptors = {1: {'outputs': [{'type': 'waveform'}]}}
+        output_descriptors = {2: {'inputs': [{'type': 'tex'}]}}
+        for seed in range(20):
+            plan = plan_bridge(registry,
+                               input_descriptors,
+                               output_descriptors,
+                               reuse_weight=0.5,
+                               rng=random.Random(seed),
+                               max_depth=None)
+            validate_plan(plan, registry)
+
+    def test_plan_bridge_reuses_siblings(self):
+        # The band split created for the first input feeds the node created for the second,
+        # both one node from the outputs. Within the depth budget and without a cycle, the
+        # planner reuses its spare outputs rather than splitting the waveform again.
+        registry = ComponentRegistry(self.mock_load_components.return_value)
+        input_descriptors = {1: {'outputs': [{'type': 'waveform'}]}}
+        output_descriptors = {2: {'inputs': [{'type': 'unitary'}, {'type': 'rgb'}]}}
+        plan = plan_bridge(registry,
+                           input_descriptors,
+                           output_descriptors,
+                           reuse_weight=1.0,
+                           rng=random.Random(0))
+        validate_plan(plan, registry, max_depth=DEFAULT_MAX_PLAN_DEPTH)
+
+        self.assertCountEqual([node['component'] for node in plan.nodes],
+                              ['audio_to_band', 'wrapped/unitary_to_rgb'])
+        band, to_rgb = [node['id'] for node in plan.nodes]
+        self.assertEqual([source for source, _, target, _ in plan.edges if target == to_rgb],
+                         [band] * 3)
+
+    def test_plan_metrics(self):
+        components = self.mock_load_components.return_value
+        plan = GraphPlan()
+        plan.add_existing(1, {'outputs': [{'type': 'waveform'}]})
+        plan.add_existing(2, {'inputs': [{'type': 'unitary'}, {'type': 'unitary'}]})
+        band = plan.load('audio_to_band', components['audio_to_band'])
+        plan.connect(band, 0, 2, 0)
+        plan.connect(band, 0, 2, 1)
+        plan.connect(1, 0, band, 0)
+
+        score, metrics = score_plan(plan, ComponentRegistry(components),
+                                    {name: 1.0 for name in PLAN_METRICS})
+        self.assertEqual(
+            metrics, {
+                'node_count': 1,
+                'depth': 2,
+                'type_diversity': 2,
+                'cook_cost': 1.0,
+                'reuse_ratio': 2 / 3,
+                'max_fan_out': 2,
+            })
+        self.assertAlmostEqual(score, sum(metrics.values()))
+
+    def test_search_plans(self):
+        registry = ComponentRegistry(self.mock_load_components.return_value)
+        input_descriptors = {1: {'inputs': [], 'outputs': [{'type': 'waveform'}]}}
+        output_descriptors = {2: {'inputs': [{'type': 'tex'}], 'outputs': []}}
+
+        plan, report = search_plans(registry,
+                                    input_descriptors,
+                                    output_descriptors,
+                                    candidates=6,
+                                    reuse_weight=0.5,
+                                    weights={'node_count': -1},
+                                    seed=0,
+                                    processes=2)
+
+        # The smallest candidate wins, and is the plan its seed gives.
+        self.assertEqual(sorted(candidate['seed'] for candidate in report),
+                         sorted(candidate_seeds(0, 6)))
+        self.assertEqual(report[0]['metrics']['node_count'],
+                         min(candidate['metrics']['node_count'] for candidate in report))
+        self.assertEqual(len(plan.nodes), report[0]['metrics']['node_count'])
+        expected = plan_bridge(registry, input_descriptors, output_descriptors, 0.5,
+                               random.Random(report[0]['seed']))
+        self.assertEqual(plan.to_dict(), expected.to_dict())
+
+        # The next base seed (e.g. of the next rebuild) plans other candidates.
+        _, next_report = search_plans(registry,
+                                      input_descriptors,
+                                      output_descriptors,
+                                      candidates=6,
+                                      seed=1,
+                                      processes=2)
+        self.assertFalse({candidate['seed'] for candidate in report} &
+                         {candidate['seed'] for candidate in next_report})
+
+        for processes in (0, 2):
+            with self.assertRaises(TimeoutError):
+                search_plans(registry,
+                             input_descriptors,
+                             output_descriptors,
+                             deadline=0,
+                             processes=processes)
+
+    def test_component_registry(self):
+        components = self.mock_load_components.return_value
+        registry = ComponentRegistry(components)
+
+        for type_name in ['rgb', 'tex', 'unitary', 'waveform', 'xy']:
+            self.assertEqual(registry.producers_of(type_name),
+                             find_components_producing_type(type_name, components))
+        self.assertEqual(registry.consumers_of('unitary'), ['wrapped/unitary_to_rgb'])
+        self.assertEqual(registry.input_types['wrapped/unitary_to_rgb'],
+                         ('unitary', 'unitary', 'unitary'))
+        self.assertEqual(registry.output_types['audio_to_band'], ('unitary', 'unitary', 'unitary'))
+
+        # Weighted sampling only ever picks producers, in proportion to their weight.
+        components['other_audio_in'] = {'weight': 3, 'outputs': [{'type': 'waveform'}]}
+        registry = ComponentRegistry(components)
+        rng = random.Random(0)
+        samples = [registry.sample_producer('waveform', rng) for _ in range(4000)]
+        self.assertEqual(set(samples), {'audio_in', 'other_audio_in'})
+        self.assertAlmostEqual(samples.count('other_audio_in') / len(samples), 0.75, delta=0.05)
+
+    def test_load_components_cache(self):
+        with tempfile.TemporaryDirectory() as components_dir:
+
+            def write(name, descriptor):
+                path = os.path.join(components_dir, name)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'w') as f:
+                    json.dump(descriptor, f)
+
+            write('types.json', [])
+            write('a.json', {'outputs': [{'type': 'tex'}]})
+            write('io/b.json', {'inputs': [{'type': 'tex'}]})
+            snapshot_path = os.path.join(components_dir, 'cache.snapshot')
+
+            # Cold start parses everything.
+            cache = ComponentCache(snapshot_path)
+            components = load_components(components_dir, cache=cache)
+            self.assertCountEqual(components, ['a', 'io/b'])
+            self.assertEqual(cache.last_stats['parsed'], 3)
+
+            # Warm rebuilds parse nothing, and only changed files are re-parsed.
+            components = load_components(components_dir, exclude=['io/*'], cache=cache)
+            self.assertEqual(list(components), ['a'])
+            self.assertEqual(cache.last_stats['parsed'], 0)
+            write('a.json', {'outputs': [{'type': 'tex'}, {'type': 'rgb'}]})
+            components = load_components(components_dir, cache=cache)
+            self.assertEqual(cache.last_stats['parsed'], 1)
+            self.assertEqual(len(components['a']['outputs']), 2)
+
+            # A new process starts warm from the snapshot.
+            cache = ComponentCache(snapshot_path)
+            self.assertEqual(load_components(components_dir, cache=cache), components)
+            self.assertEqual(cache.last_stats['parsed'], 0)
+
+    def test_patch_plan(self):
+        components = self.mock_load_components.return_value
+        self.set_up_io_nodes([(1, 'waveform')], [(2, 'tex')])
+        input_descriptors = {1: components['input_1']}
+        output_descriptors = {2: components['output_2']}
+
+        def graph():
+            # The network as (source component, source index, target component, target index).
+            return sorted((self.td_proxy.loaded_components[src_h], src_idx,
+                           self.td_proxy.loaded_components[tgt_h], tgt_idx)
+                          for (src_h, src_idx), targets in self.td_proxy.connections.items()
+                          for tgt_h, tgt_idx in targets)
+
+        def plan_graph(plan, handles):
+            names = {node['id']: node['component'] for node in plan.nodes}
+            names.update(self.td_proxy.loaded_components)
+            return sorted((names[src], src_idx, names[tgt], tgt_idx)
+                          for src, src_idx, tgt, tgt_idx in plan.edges)
+
+        rng = random.Random(0)
+        plan = plan_bridge(components, input_descriptors, output_descriptors, 1, rng)
+        handles = patch_plan(self.td_proxy, plan)
+        self.assertEqual(self.td_proxy.calls.count('load'), 0)
+        self.assertEqual(len(handles), 3)
+        self.assertEqual(graph(), plan_graph(plan, handles))
+
+        # Patching with the same network again changes nothing.
+        self.td_proxy.calls = []
+        self.assertEqual(patch_plan(self.td_proxy, plan), handles)
+        self.assertEqual(self.td_proxy.calls, ['get_graph_snapshot', 'apply_plan'])
+        self.assertEqual(self.td_proxy.next_handle, 103)
+
+        # A different network only creates and destroys the difference.
+        for seed in range(10):
+            plan = plan_bridge(components, input_descriptors, output_descriptors, 0.5,
+                               random.Random(seed))
+            before = dict(self.td_proxy.loaded_components)
+            handles = patch_plan(self.td_proxy, plan, batch=False)
+            self.assertEqual(graph(), plan_graph(plan, handles))
+            self.assertEqual(set(self.td_proxy.loaded_components), set(handles.values()) | {1, 2})
+            # Every existing op of a planned component is kept.
+            existing = Counter(before[handle] for handle in before if handle not in (1, 2))
+            planned = Counter(node['component'] for node in plan.nodes)
+            kept = set(before) & set(handles.values())
+            self.assertEqual(len(kept), sum((existing & planned).values()))
+
+        # A patch closing a cycle with the ops it keeps fails before changing anything.
+        self.td_proxy.calls = []
+        snapshot = {
+            'handles': [10, 11],
+            'components': ['rgb_to_tex', 'rgb_to_tex'],
+            'reserved': [True, True],
+            'edges': [(10, 0, 11, 0)]
+        }
+        plan = GraphPlan()
+        for handle in (10, 11):
+            plan.add_existing(handle, {'inputs': [{'type': 'tex'}], 'outputs': [{'type': 'tex'}]})
+        plan.connect(10, 0, 11, 0)
+        plan.connect(11, 0, 10, 0)
+        with self.assertRaisesRegex(ValueError, 'cycle'):
+            patch_plan(self.td_proxy, plan, snapshot)
+        self.assertEqual(self.td_proxy.calls, [])
+
     @parameterized.expand([
         ("linear_chain", {
             (1, 0): [(2, 0)],
@@ -218,6 +829,91 @@ class TestGraphUtils(unittest.TestCase):
 
         sorted_handles = topo_sort_handles(self.td_proxy, handles)
         self.assertIn(sorted_handles, expected_orders)
+        # The whole graph is fetched with a single call.
+        self.assertEqual(self.td_proxy.calls.count('get_graph_snapshot'), 1)
+
+    def test_layout_nodes(self):
+        self.td_proxy.node_geometry = {1: (0, 0, 100, 50), 2: (0, 0, 200, 100), 3: (0, 0, 60, 80)}
+
+        layout_nodes(self.td_proxy, [1, 2, 3])
+
+        # One read and one write, whatever the number of nodes.
+        self.assertEqual(self.td_proxy.calls, ['get_nodes_geometry', 'set_nodes_positions'])
+        # 100 + 200 + 60 wide, plus two 20 unit margins, centered around 0.
+        self.assertEqual([self.td_proxy.attributes[(handle, 'nodeX')] for handle in [1, 2, 3]],
+                         [-200, -80, 140])
+        self.assertEqual([self.td_proxy.attributes[(handle, 'nodeY')] for handle in [1, 2, 3]],
+                         [-25, -50, -40])
+
+    def test_layout_nodes_layered(self):
+        # Two crossing edges: 1 -> 4 and 2 -> 3, then 3 and 4 both feed 5.
+        for src_h, tgt_h, tgt_idx in [(1, 4, 0), (2, 3, 0), (3, 5, 0), (4, 5, 1)]:
+            self.td_proxy.connect(src_h, 0, tgt_h, tgt_idx)
+        self.td_proxy.loaded_components = {handle: 'component' for handle in range(1, 6)}
+        self.td_proxy.calls = []
+
+        layout_nodes(self.td_proxy, [1, 2, 3, 4, 5], mode='layered')
+
+        self.assertEqual(self.td_proxy.calls,
+                         ['get_nodes_geometry', 'get_graph_snapshot', 'set_nodes_positions'])
+        x = {handle: self.td_proxy.attributes[(handle, 'nodeX')] for handle in range(1, 6)}
+        y = {handle: self.td_proxy.attributes[(handle, 'nodeY')] for handle in range(1, 6)}
+        # Columns by depth, centered around 0.
+        self.assertEqual(x[1], x[2])
+        self.assertEqual(x[3], x[4])
+        self.assertLess(x[1], x[3])
+        self.assertLess(x[3], x[5])
+        self.assertEqual(x[1] + 100, -x[5])
+        # 4 is moved above 3 so that the edges no longer cross.
+        self.assertGreater(y[1], y[2])
+        self.assertGreater(y[4], y[3])
+
+        # The same layout from the snapshot's graph.
+        graph = CompactGraph.from_snapshot(self.td_proxy.get_graph_snapshot())
+        geometry = self.td_proxy.get_nodes_geometry([1, 2, 3, 4, 5])
+        self.assertEqual(layered_positions([1, 2, 3, 4, 5], graph, geometry),
+                         {handle: (x[handle], y[handle]) for handle in range(1, 6)})
+
+    def test_compact_graph(self):
+        components = self.mock_load_components.return_value
+        plan = GraphPlan()
+        plan.add_existing(1, {'outputs': [{'type': 'waveform'}]})
+        plan.add_existing(2, {'inputs': [{'type': 'unitary'}, {'type': 'unitary'}]})
+        band = plan.load('audio_to_band', components['audio_to_band'])
+        plan.connect(band, 0, 2, 0)
+        plan.connect(band, 1, 2, 1)
+        plan.connect(1, 0, band, 0)
+
+        graph = plan.to_graph()
+        self.assertEqual((len(graph), graph.num_edges), (3, 3))
+        self.assertEqual(graph.ports(band), {'inputs': ['waveform'], 'outputs': ['unitary'] * 3})
+        self.assertEqual(graph.components, [None, None, 'audio_to_band'])
+        self.assertEqual(graph.successors(band), [2, 2])
+        self.assertEqual(graph.predecessors(band), [1])
+        self.assertEqual((graph.in_degree(2), graph.out_degree(2)), (2, 0))
+        self.assertEqual(graph.out_degrees().tolist(), [1, 0, 2])
+        self.assertEqual(graph.topological_order(), [1, band, 2])
+        self.assertEqual(graph.ranks().tolist(), [0, 2, 1])
+        self.assertEqual(list(graph.edges()), plan.edges)
+
+        graph.add_edge(2, 0, 1, 0)
+        with self.assertRaisesRegex(ValueError, 'cycles'):
+            graph.topological_order()
+
+        # Long chains take a single pass.
+        chain = CompactGraph()
+        for handle in range(100_000):
+            chain.add_node(handle, ['tex'], ['tex'])
+        for handle in range(99_999, 0, -1):
+            chain.add_edge(handle - 1, 0, handle, 0)
+        self.assertEqual(chain.topological_order(), list(range(100_000)))
+        self.assertEqual(int(chain.ranks().max()), 99_999)
+
+    def test_topo_sort_cycle(self):
+        self.td_proxy.connect(1, 0, 2, 0)
+        self.td_proxy.connect(2, 0, 1, 0)
+        with self.assertRaisesRegex(ValueError, 'cycles'):
+            topo_sort_handles(self.td_proxy, [1, 2])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,211 @@
+"""
+Runs the real `script_dat.py` outside TouchDesigner, against the emulated `td` module
+from `fake_td.py`, so that `client.py` can be exercised (and benchmarked) end to end:
+
+    python local_td.py --port 60883 --latency loadTox=0.02
+    python client.py --port 60883 --test-network
+
+The script DAT is cooked once per frame on a background thread, like TouchDesigner
+does, so requests are served by `PyroServerManager.poll_events` within its frame budget.
+"""
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+import types
+from typing import Dict
+
+from fake_td import FakeTD, LATENCY_OPERATIONS
+
+logger = logging.getLogger(__name__)
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRIPT_PATH = os.path.join(ROOT_DIR, "script_dat.py")
+COMPONENTS_DIR = os.path.join(ROOT_DIR, "components")
+IO_CONFIG_PATH = os.path.join(ROOT_DIR, "config", "io_config.json")
+
+
+class FakePar:
+
+    def __init__(self, value=""):
+        self.val = value
+
+    def eval(self):
+        return self.val
+
+
+class FakeScriptOp:
+    """The script DAT: `me` in the script, and the `scriptOp` passed to its callbacks."""
+
+    def __init__(self, io_config_path):
+        self.storage = {}
+        self.rows = []  # The DAT's contents as of the last cook
+        self.cooking_rows = []
+        self.par = types.SimpleNamespace(Ioconfig=FakePar(io_config_path),
+                                         Ioargs=FakePar("{}"),
+                                         Serveruri=FakePar(),
+                                         Dummycook=FakePar(0.0))
+
+    def storeStartupValue(self, key, value):
+        self.storage.setdefault(key, value)
+
+    def store(self, key, value):
+        self.storage[key] = value
+
+    def fetch(self, key, default=None):
+        return self.storage.get(key, default)
+
+    def clear(self):
+        self.cooking_rows = []
+
+    def appendRow(self, row):
+        self.cooking_rows.append(list(row))
+
+    def finish_cook(self):
+        self.rows = self.cooking_rows
+
+
+class LocalTouchDesigner:
+    """
+    The script DAT running in an emulated project, serving `TDProxy` over Pyro5.
+
+    Args:
+        components_dir: Components to load, in place of the script's `COMPONENTS_PATH`.
+        io_config_path: The I/O config, as set on the DAT's "I/O Config" parameter.
+        host: Host to serve on.
+        port: Port to serve on, any free port when 0.
+        fps: Frames (cooks) per second.
+        latencies: Seconds to spend in each emulated `td` operation, see `FakeTD`.
+    """
+
+    def __init__(self,
+                 components_dir: str = COMPONENTS_DIR,
+                 io_config_path: str = IO_CONFIG_PATH,
+                 host: str = "localhost",
+                 port: int = 0,
+                 fps: float = 60,
+                 latencies: Dict[str, float] = None,
+                 script_path: str = SCRIPT_PATH):
+        self.host = host
+        self.port = port
+        self.frame_time = 1 / fps
+        self.td = FakeTD(components_dir, latencies)
+        self.me = FakeScriptOp(io_config_path)
+        self.frames = 0
+        self.pulses = queue.Queue()
+        self.running = False
+        self.thread = None
+
+        self.td.install()
+        with open(script_path) as f:
+            code = compile(f.read(), script_path, "exec")
+        self.namespace = {"__name__": "script_dat", "me": self.me}
+        exec(code, self.namespace)
+        self.namespace["COMPONENTS_PATH"] = components_dir
+
+    @property
+    def server_manager(self):
+        return self.me.fetch("server_manager")
+
+    @property
+    def uri(self):
+        return self.server_manager.uri
+
+    def cook(self):
+        self.namespace["onCook"](self.me)
+        self.me.finish_cook()
+        self.frames += 1
+
+    def start(self):
+        """Start the server and the cook loop, returning the server URI."""
+        # Like in TouchDesigner, the first cook after the script is (re)loaded creates the
+        # server manager, and the next one replaces it.
+        self.cook()
+        self.cook()
+        self.server_manager.start_server(self.host, self.port)
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        logger.info("Serving on %s", self.uri)
+        return self.uri
+
+    def run(self):
+        next_frame = time.perf_counter()
+        while self.running:
+            while not self.pulses.empty():
+                self.namespace["onPulse"](types.SimpleNamespace(name=self.pulses.get()))
+            self.cook()
+            next_frame += self.frame_time
+            delay = next_frame - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Dropped frames, don't try to catch up.
+                next_frame = time.perf_counter()
+
+    def pulse(self, name: str):
+        """Press a pulse parameter of the DAT (e.g. "Iocallback") on the next frame."""
+        self.pulses.put(name)
+
+    def stop(self):
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.server_manager is not None:
+            self.server_manager.stop_server()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def parse_latency(value):
+    """Parse an OPERATION=SECONDS command line argument."""
+    operation, _, seconds = value.partition("=")
+    if operation not in LATENCY_OPERATIONS or not seconds:
+        raise argparse.ArgumentTypeError(
+            f"expected OPERATION=SECONDS with OPERATION one of {', '.join(LATENCY_OPERATIONS)}")
+    return operation, float(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=60883)
+    parser.add_argument("--fps", type=float, default=60)
+    parser.add_argument("--components", default=COMPONENTS_DIR)
+    parser.add_argument("--io-config", default=IO_CONFIG_PATH)
+    parser.add_argument(
+        "--latency",
+        type=parse_latency,
+        action="append",
+        default=[],
+        metavar="OPERATION=SECONDS",
+        help=f"Time spent in a td operation, one of {', '.join(LATENCY_OPERATIONS)}")
+    parser.add_argument("--log-level",
+                        choices=("DEBUG", "INFO", "WARNING", "ERROR"),
+                        default="INFO")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level, format='%(name)s - %(levelname)s - %(message)s')
+
+    local_td = LocalTouchDesigner(args.components, args.io_config, args.host, args.port, args.fps,
+                                  dict(args.latency))
+    with local_td:
+        print(f"Serving on {local_td.uri}, press Ctrl-C to stop")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import Pyro5.api
+
+from client import rebuild_graph
+from graph_utils import (CostDatabase, GraphPlan, MutationPipeline, apply_plan, topo_sort_snapshot)
+from local_td import COMPONENTS_DIR, LocalTouchDesigner
+from rpc_trace import RecordingProxy
+
+
+class TestLocalTouchDesigner(unittest.TestCase):
+
+    def setUp(self):
+        self.local_td = LocalTouchDesigner(fps=200, latencies={"loadTox": 0.001})
+        self.local_td.start()
+        self.td_proxy = Pyro5.api.Proxy(self.local_td.uri)
+
+    def tearDown(self):
+        self.td_proxy._pyroRelease()
+        self.local_td.stop()
+
+    def test_rebuild_graph(self):
+        io_handles = self.td_proxy.get_io_handles()
+        self.assertEqual(len(io_handles["inputs"]), 5)
+        self.assertEqual(len(io_handles["outputs"]), 1)
+
+        random.seed(0)
+        rebuild_graph(self.td_proxy, layout="layered")
+
+        # The whole network was built in the emulated project, and feeds the output.
+        snapshot = self.td_proxy.get_graph_snapshot()
+        created = [
+            handle for handle, reserved in zip(snapshot["handles"], snapshot["reserved"])
+            if not reserved
+        ]
+        self.assertGreater(len(created), 0)
+        network = self.local_td.td.project.op("network")
+        self.assertEqual(len(snapshot["handles"]), len(network.children))
+        order = topo_sort_snapshot(snapshot)
+        self.assertEqual(order[-1], io_handles["outputs"][0])
+        self.assertIn("Server running", self.local_td.me.rows[0][0])
+
+    def test_pipelined_mutations(self):
+        handles = [self.td_proxy.load("rgb_to_tex") for _ in range(3)]
+        pipeline = MutationPipeline(self.td_proxy)
+        pipeline.connect(handles[0], 0, handles[1], 0)
+        pipeline.connect(handles[1], 0, handles[2], 0)
+        pipeline.connect(handles[2], 0, 12345, 0)  # No such op
+        pipeline.set_op_attribute(handles[2], "nodeX", 300)
+
+        errors = pipeline.flush()
+
+        # Posting doesn't wait, but the flush returns once all of them are applied.
+        self.assertEqual([(error["seq"], error["method"]) for error in errors], [(2, "connect")])
+        snapshot = self.td_proxy.get_graph_snapshot(handles)
+        self.assertEqual(sorted(snapshot["edges"]), [(handles[0], 0, handles[1], 0),
+                                                     (handles[1], 0, handles[2], 0)])
+        self.assertEqual(self.td_proxy.get_nodes_geometry([handles[2]])[0][0], 300)
+        self.assertEqual(pipeline.flush(), [])
+
+    def test_concurrent_pipelines(self):
+        handles = [self.td_proxy.load("rgb_to_tex") for _ in range(4)]
+        other_proxy = Pyro5.api.Proxy(self.local_td.uri)
+        pipelines = [MutationPipeline(self.td_proxy), MutationPipeline(other_proxy)]
+
+        # Both pipelines start at sequence number 0, and flush separately.
+        pipelines[0].connect(handles[0], 0, handles[1], 0)
+        pipelines[1].connect(handles[2], 0, handles[3], 0)
+        pipelines[1].set_op_attribute(handles[3], "nodeX", 300)
+        self.assertEqual(pipelines[0].flush(), [])
+        pipelines[0].set_op_attribute(handles[1], "nodeX", 200)
+        self.assertEqual(pipelines[1].flush(), [])
+        self.assertEqual(pipelines[0].flush(), [])
+        other_proxy._pyroRelease()
+
+        snapshot = self.td_proxy.get_graph_snapshot(handles)
+        self.assertEqual(sorted(snapshot["edges"]), [(handles[0], 0, handles[1], 0),
+                                                     (handles[2], 0, handles[3], 0)])
+        geometry = self.td_proxy.get_nodes_geometry([handles[1], handles[3]])
+        self.assertEqual([position[0] for position in geometry], [200, 300])
+
+    def test_cook_times(self):
+        self.local_td.td.cook_times["rgb_to_tex"] = (0.5, 1.5)
+        handles = [self.td_proxy.load("rgb_to_tex") for _ in range(2)]
+        self.td_proxy.load("zoom")  # Hasn't cooked
+
+        cook_times = self.td_proxy.get_cook_times()
+        self.assertEqual(sorted(cook_times), handles)
+        self.assertEqual(cook_times[handles[0]], {
+            "component": "rgb_to_tex",
+            "cpu_ms": 0.5,
+            "gpu_ms": 1.5,
+            "cooks": 1
+        })
+        cost_db = CostDatabase()
+        cost_db.update(cook_times)
+        self.assertEqual(cost_db.costs(), {"rgb_to_tex": 2.0})
+
+    def test_double_buffered_rebuilds(self):
+        self.td_proxy.set_double_buffered(True)
+        for size in (3, 1, 1, 2, 3):
+            self.td_proxy.clear()
+            handles = [self.td_proxy.load("rgb_to_tex") for _ in range(size)]
+            # Ops parked in the front network are not handed out for the back one.
+            for handle in handles:
+                self.assertTrue(
+                    self.td_proxy.get_op_attribute(handle,
+                                                   "path").startswith("/project1/network_back/"))
+            self.td_proxy.swap_buffers()
+        self.assertGreater(self.td_proxy.get_pool_stats()["hits"], 0)
+
+    def test_swap_and_recycle(self):
+        self.td_proxy.set_double_buffered(True)
+
+        def rebuild(seed, double_buffered=True):
+            # The handles of the ops created by the rebuild.
+            recording = RecordingProxy(self.td_proxy)
+            rebuild_graph(recording, double_buffered=double_buffered, seed=seed)
+            result, = [call["result"] for call in recording.calls if call["method"] == "apply_plan"]
+            return list(result["handles"].values())
+
+        def assert_in_front(handles):
+            for handle in handles:
+                path = self.td_proxy.get_op_attribute(handle, "path")
+                self.assertTrue(path.startswith("/project1/network/"), path)
+
+        previous = rebuild(0)
+        assert_in_front(previous)
+
+        # The next rebuild is swapped in, and the previous graph is recycled over the next
+        # cooks, into the pool.
+        assert_in_front(rebuild(1))
+        deadline = time.monotonic() + 5
+        while any(self.td_proxy.get_op_attribute(handle, "path") for handle in previous):
+            self.assertLess(time.monotonic(), deadline)
+        self.assertGreater(self.td_proxy.get_pool_stats()["size"], 0)
+
+        assert_in_front(rebuild(0))
+        self.assertGreater(self.td_proxy.get_pool_stats()["hits"], 0)
+
+        # The ops parked in the back network are gone with it.
+        self.td_proxy.set_double_buffered(False)
+        self.assertEqual(self.td_proxy.eval_to_str("td.op('/project1/network_back')"), "None")
+        assert_in_front(rebuild(1, double_buffered=False))
+
+    def test_chunked_plan_spans_frames(self):
+        self.td_proxy.set_frame_budget(0.5)
+        job_id = self.td_proxy.submit_plan({
+            "nodes": [{
+                "id": f"n{i}",
+                "component": "rgb_to_tex"
+            } for i in range(20)],
+        })
+        frames = self.local_td.frames
+        while not (status := self.td_proxy.get_plan_status(job_id))["finished"]:
+            pass
+
+        self.assertEqual(len(status["result"]["handles"]), 20)
+        self.assertEqual(status["done"], 20)
+        # Loading takes at least 1 ms per op, so the 0.5 ms budget fits one op per frame.
+        self.assertGreaterEqual(self.local_td.frames - frames, 20)
+        stats = self.td_proxy.get_frame_stats()
+        self.assertGreater(max(frame["job_steps"] for frame in stats["frames"]), 0)
+
+    def test_rpc_stats(self):
+        self.td_proxy.enable_rpc_stats()
+        frames = self.local_td.frames
+        while self.local_td.frames < frames + 5:
+            time.sleep(0.001)
+        # The per-cook helpers aren't RPCs.
+        self.assertEqual(self.td_proxy.get_rpc_stats(), {})
+
+        self.td_proxy.load("rgb_to_tex")
+        job_id = self.td_proxy.submit_plan({"nodes": [{"id": "a", "component": "rgb_to_tex"}]})
+        while not self.td_proxy.get_plan_status(job_id)["finished"]:
+            pass
+        stats = self.td_proxy.get_rpc_stats()
+        # The job's loads are counted as such.
+        self.assertEqual(stats["load"]["count"], 2)
+        self.assertEqual(stats["submit_plan"]["count"], 1)
+        self.td_proxy.enable_rpc_stats(False)
+
+    def test_failing_plan_job(self):
+        plan = GraphPlan()
+        plan.load("rgb_to_tex")
+        plan.load("no_such_component")
+        plan.load("rgb_to_tex")
+        job_id = self.td_proxy.submit_plan(plan.to_dict())
+        while not (status := self.td_proxy.get_plan_status(job_id))["finished"]:
+            pass
+
+        # The job stops at the failing step, and the server keeps serving.
+        self.assertIn("FileNotFoundError", status["error"])
+        self.assertEqual((status["done"], len(status["result"]["handles"])), (1, 1))
+        self.assertEqual(self.td_proxy.get_frame_stats()["frames"][-1]["pending_jobs"], 0)
+        with self.assertRaisesRegex(RuntimeError, "failed after 1 of 3 steps"):
+            apply_plan(self.td_proxy, plan, chunked=True)
+        self.assertTrue(self.td_proxy.clear())
+
+
+class TestOpPool(unittest.TestCase):
+
+    def setUp(self):
+        # A copy of the components, whose descriptors the tests can change.
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.components_dir = os.path.join(self.temp_dir.name, "components")
+        shutil.copytree(COMPONENTS_DIR, self.components_dir)
+        self.local_td = LocalTouchDesigner(self.components_dir, fps=200)
+        self.local_td.start()
+        self.td_proxy = Pyro5.api.Proxy(self.local_td.uri)
+
+    def tearDown(self):
+        self.td_proxy._pyroRelease()
+        self.local_td.stop()
+        self.temp_dir.cleanup()
+
+    def path(self, handle):
+        return self.td_proxy.get_op_attribute(handle, "path")
+
+    def test_hit_after_release(self):
+        handle = self.td_proxy.load("rgb_to_tex")
+        path = self.path(handle)
+        self.assertTrue(self.td_proxy.release_op(handle))
+        self.assertIsNone(self.path(handle))
+        self.assertEqual(self.td_proxy.get_pool_stats()["by_component"], {"rgb_to_tex": 1})
+
+        # The parked op comes back under a new handle.
+        reused = self.td_proxy.load("rgb_to_tex")
+        self.assertNotEqual(reused, handle)
+        self.assertEqual(self.path(reused), path)
+        self.assertEqual(self.td_proxy.get_op_attribute(reused, "allowCooking"), "True")
+        stats = self.td_proxy.get_pool_stats()
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"]), (0, 1, 1))
+
+    def test_stale_descriptor(self):
+        self.td_proxy.release_op(self.td_proxy.load("rgb_to_tex"))
+        json_path = os.path.join(self.components_dir, "rgb_to_tex.json")
+        stat = os.stat(json_path)
+        os.utime(json_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        # The op parked with the previous descriptor is destroyed, not reused.
+        self.td_proxy.load("rgb_to_tex")
+        stats = self.td_proxy.get_pool_stats()
+        self.assertEqual((stats["size"], stats["hits"], stats["misses"], stats["evictions"]),
+                         (0, 0, 2, 1))
+
+    def test_eviction(self):
+        self.td_proxy.configure_pool(max_per_component=2, max_total=3)
+        handles = [self.td_proxy.load("rgb_to_tex") for _ in range(3)]
+        handles += [self.td_proxy.load("zoom") for _ in range(2)]
+        paths = [self.path(handle) for handle in handles]
+        for handle in handles:
+            self.td_proxy.release_op(handle)
+
+        # The first rgb_to_tex went over the per component limit, and the second one over
+        # the total, when the last zoom was parked.
+        stats = self.td_proxy.get_pool_stats()
+        self.assertEqual(stats["by_component"], {"rgb_to_tex": 1, "zoom": 2})
+        self.assertEqual(stats["evictions"], 2)
+        self.assertEqual(self.path(self.td_proxy.load("rgb_to_tex")), paths[2])
+        self.assertEqual(self.path(self.td_proxy.load("zoom")), paths[4])
+
+        stats = self.td_proxy.configure_pool(enabled=False)
+        self.assertEqual((stats["size"], stats["evictions"]), (0, 3))
+
+
+if __name__ == '__main__':
+    unittest.main()
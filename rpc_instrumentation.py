@@ -0,0 +1,136 @@
+import json
+import logging
+import time
+from typing import Dict, List
+
+import serpent
+
+logger = logging.getLogger(__name__)
+
+# Latency histograms use power of two buckets of microseconds: bucket i counts the calls
+# that took less than 2**i us (and at least 2**(i - 1) us). The last bucket is open ended.
+HISTOGRAM_BUCKETS = 24
+
+
+class Histogram:
+    """Power of two histogram of durations or sizes, with exact count, total and max."""
+
+    def __init__(self, buckets: int = HISTOGRAM_BUCKETS):
+        self.counts = [0] * buckets
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def add(self, value: int):
+        self.counts[min(value.bit_length(), len(self.counts) - 1)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction: float) -> int:
+        """Upper bound of the bucket holding the given fraction of the values."""
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= rank:
+                return min(2**i, self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0,
+            "max": self.max,
+            "p50": self.percentile(0.5),
+            "p90": self.percentile(0.9),
+            "p99": self.percentile(0.99),
+            "buckets": {
+                2**i: count for i, count in enumerate(self.counts) if count
+            },
+        }
+
+
+class MethodStats:
+    """What the client saw of the calls to one remote method."""
+
+    def __init__(self):
+        self.errors = 0
+        self.rtt_us = Histogram()
+        self.request_bytes = Histogram()
+        self.response_bytes = Histogram()
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.rtt_us.count,
+            "errors": self.errors,
+            "rtt_us": self.rtt_us.to_dict(),
+            "request_bytes": self.request_bytes.to_dict(),
+            "response_bytes": self.response_bytes.to_dict(),
+        }
+
+
+class InstrumentedProxy:
+    """
+    Wraps a `Pyro5.api.Proxy` (or anything with the same methods), recording the count,
+    round trip time and payload sizes of every call by method name.
+
+    Payload sizes are those of the serpent serialized arguments and result, which costs a
+    second serialization per call; pass `measure_payload=False` to skip it. Only wrap the
+    proxy when profiling, so there is nothing to pay otherwise:
+
+        td_proxy = InstrumentedProxy(td_proxy) if args.profile else td_proxy
+    """
+
+    def __init__(self, proxy, measure_payload: bool = True):
+        self._proxy = proxy
+        self._measure_payload = measure_payload
+        self.stats: Dict[str, MethodStats] = {}
+
+    def __getattr__(self, name):
+        attribute = getattr(self._proxy, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = MethodStats()
+            if self._measure_payload:
+                stats.request_bytes.add(len(serpent.dumps((args, kwargs))))
+            start = time.perf_counter()
+            try:
+                result = attribute(*args, **kwargs)
+            except Exception:
+                stats.errors += 1
+                raise
+            finally:
+                stats.rtt_us.add(int((time.perf_counter() - start) * 1e6))
+            if self._measure_payload:
+                stats.response_bytes.add(len(serpent.dumps(result)))
+            return result
+
+        return call
+
+    def get_client_stats(self) -> Dict[str, dict]:
+        return {name: stats.to_dict() for name, stats in sorted(self.stats.items())}
+
+    def reset_client_stats(self):
+        self.stats = {}
+
+    def slowest(self, n: int = 5) -> List[str]:
+        """The methods that took the most round trip time in total, slowest first."""
+        return sorted(self.stats, key=lambda name: self.stats[name].rtt_us.total, reverse=True)[:n]
+
+    def dump_json(self, path: str, include_server: bool = True):
+        """
+        Write the client stats to `path`, along with the stats `TDProxy` kept of the same
+        calls (server time, without the transport) when `include_server` is set.
+        """
+        report = {"client": self.get_client_stats()}
+        if include_server:
+            report["server"] = self._proxy.get_rpc_stats()
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info("Wrote RPC stats of %d methods to %s", len(self.stats), path)
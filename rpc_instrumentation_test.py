@@ -0,0 +1,90 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock
+
+from graph_utils import bridge, ComponentRegistry
+from graph_utils_test import MockTDProxy
+from rpc_instrumentation import Histogram, InstrumentedProxy
+
+
+class TestRpcInstrumentation(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in [1, 3, 3, 100, 5000]:
+            histogram.add(value)
+
+        self.assertEqual(histogram.count, 5)
+        self.assertEqual(histogram.total, 5107)
+        self.assertEqual(histogram.max, 5000)
+        # 3 falls in the [2, 4) bucket, 100 in [64, 128).
+        self.assertEqual(histogram.percentile(0.5), 4)
+        self.assertEqual(histogram.percentile(0.8), 128)
+        self.assertEqual(histogram.percentile(1.0), 5000)
+        self.assertEqual(histogram.to_dict()["buckets"], {2: 1, 4: 2, 128: 1, 8192: 1})
+
+    def test_bridge_call_counts(self):
+        mock_proxy = MockTDProxy()
+        mock_proxy.components = {
+            'input': {
+                'inputs': [],
+                'outputs': [{
+                    'type': 'waveform'
+                }]
+            },
+            'output': {
+                'inputs': [{
+                    'type': 'tex'
+                }],
+                'outputs': []
+            },
+            'waveform_to_tex': {
+                'inputs': [{
+                    'type': 'waveform'
+                }],
+                'outputs': [{
+                    'type': 'tex'
+                }]
+            },
+        }
+        mock_proxy.loaded_components = {1: 'input', 2: 'output'}
+        td_proxy = InstrumentedProxy(mock_proxy)
+
+        bridge(td_proxy, [1], [2],
+               reuse_weight=1,
+               batch=True,
+               registry=ComponentRegistry(mock_proxy.components))
+
+        stats = td_proxy.get_client_stats()
+        self.assertEqual(sorted(stats), ['apply_plan', 'get_io_handles', 'get_op_descriptors'])
+        for method_stats in stats.values():
+            self.assertEqual(method_stats["count"], 1)
+            self.assertEqual(method_stats["errors"], 0)
+            self.assertGreater(method_stats["request_bytes"]["total"], 0)
+            self.assertGreater(method_stats["response_bytes"]["total"], 0)
+        self.assertIn(td_proxy.slowest(1)[0], stats)
+
+    def test_errors_and_dump(self):
+        proxy = MagicMock()
+        proxy.load.side_effect = ValueError("No such component")
+        proxy.get_rpc_stats.return_value = {"load": {"count": 1, "errors": 1}}
+        td_proxy = InstrumentedProxy(proxy, measure_payload=False)
+
+        with self.assertRaises(ValueError):
+            td_proxy.load("missing")
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "rpc_stats.json")
+            td_proxy.dump_json(path)
+            with open(path) as f:
+                report = json.load(f)
+        self.assertEqual(report["client"]["load"]["count"], 1)
+        self.assertEqual(report["client"]["load"]["errors"], 1)
+        self.assertEqual(report["client"]["load"]["request_bytes"]["count"], 0)
+        self.assertEqual(report["server"], {"load": {"count": 1, "errors": 1}})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,291 @@
+"""
+Recording and replay of the `TDProxy` calls of a session.
+
+`RecordingProxy` wraps the client's proxy and records every call (method, arguments,
+result or error, start time and duration). `replay` makes the same calls against
+another proxy, e.g. the stand-in from `local_td.py`, mapping the handles of the recorded
+session to the ones of the replay, and reports how long each method took in both:
+
+    python client.py --seed 42 --record-trace show.trace --test-network
+    python rpc_trace.py show.trace --latency loadTox=0.02
+
+Traces are serpent encoded (like Pyro5 messages), so arguments and results come back
+with the same types, e.g. dicts keyed by handle.
+"""
+import argparse
+import logging
+import time
+from typing import Callable, Dict, List
+
+import serpent
+
+logger = logging.getLogger(__name__)
+
+TRACE_VERSION = 2
+
+# Not replayed: the recorded client's callback daemon is gone.
+SKIPPED_METHODS = ("register_io_callback",)
+
+
+class RecordingProxy:
+    """
+    Wraps a `Pyro5.api.Proxy` (or anything with the same methods), recording every call.
+
+    Args:
+        proxy: The proxy to forward the calls to.
+        metadata: Saved with the trace, e.g. the seed given to `bridge`.
+    """
+
+    def __init__(self, proxy, metadata: dict = None):
+        self._proxy = proxy
+        self.metadata = dict(metadata or {})
+        self.calls: List[dict] = []
+        self.start_time = time.perf_counter()
+
+    def __getattr__(self, name):
+        attribute = getattr(self._proxy, name)
+        if name.startswith("_") or not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            record = {"method": name, "args": args, "kwargs": kwargs}
+            start = time.perf_counter()
+            try:
+                record["result"] = attribute(*args, **kwargs)
+                return record["result"]
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                record["start"] = start - self.start_time
+                record["seconds"] = time.perf_counter() - start
+                self.calls.append(record)
+
+        return call
+
+    def save(self, path: str):
+        save_trace(path, self.calls, self.metadata)
+        logger.info("Wrote %d calls to %s", len(self.calls), path)
+
+
+def save_trace(path: str, calls: List[dict], metadata: dict = None):
+    trace = {"version": TRACE_VERSION, "metadata": metadata or {}, "calls": calls}
+    with open(path, "wb") as f:
+        f.write(serpent.dumps(trace, indent=True))
+
+
+def load_trace(path: str) -> dict:
+    with open(path, "rb") as f:
+        trace = serpent.loads(f.read())
+    if trace.get("version") != TRACE_VERSION:
+        raise ValueError(f"Unsupported trace version {trace.get('version')} in {path}")
+    return trace
+
+
+# Handles differ between the recorded session and the replay. These rewrite the handle
+# arguments of each method with the handles of the replay; other methods take none.
+
+
+def _remap_plan(plan, remap):
+    plan = dict(plan)
+    plan["disconnect"] = [(remap(handle), index) for handle, index in plan.get("disconnect", [])]
+    plan["destroy"] = [remap(handle) for handle in plan.get("destroy", [])]
+    plan["edges"] = [(remap(source), source_index, remap(target), target_index)
+                     for source, source_index, target, target_index in plan.get("edges", [])]
+    plan["attributes"] = [
+        (remap(node), attribute, value) for node, attribute, value in plan.get("attributes", [])
+    ]
+    return plan
+
+
+def _remap_first(args, remap):
+    return (remap(args[0]),) + tuple(args[1:])
+
+
+def _remap_connect(args, remap):
+    return remap(args[0]), args[1], remap(args[2]), args[3]
+
+
+def _remap_list(args, remap):
+    if not args or args[0] is None:
+        return args
+    return ([remap(handle) for handle in args[0]],) + tuple(args[1:])
+
+
+def _remap_positions(args, remap):
+    return ({remap(handle): position for handle, position in args[0].items()},)
+
+
+def _remap_plan_argument(args, remap):
+    return (_remap_plan(args[0], remap),)
+
+
+def _remap_mutation(args, remap):
+    pipeline, seq, method, mutation_args = args
+    return pipeline, seq, method, ARGUMENT_HANDLES[method](tuple(mutation_args), remap)
+
+
+ARGUMENT_HANDLES: Dict[str, Callable] = {
+    "connect": _remap_connect,
+    "disconnect": _remap_first,
+    "delete_op": _remap_first,
+    "release_op": _remap_first,
+    "get_op_descriptor": _remap_first,
+    "get_op_attribute": _remap_first,
+    "set_op_attribute": _remap_first,
+    "get_op_connectors": _remap_first,
+    "get_op_node_geometry": _remap_first,
+    "get_op_descriptors": _remap_list,
+    "get_nodes_geometry": _remap_list,
+    "get_graph_snapshot": _remap_list,
+    "get_cook_times": _remap_list,
+    "set_nodes_positions": _remap_positions,
+    "apply_plan": _remap_plan_argument,
+    "submit_plan": _remap_plan_argument,
+    "post_mutation": _remap_mutation,
+}
+
+
+def _learn_handles(method, recorded, replayed, handles: Dict[int, int]):
+    """Map the handles (and plan job ids) in a recorded result to those of the replay."""
+    if method in ("load", "create_op"):
+        handles[recorded] = replayed
+    elif method == "apply_plan" or (method == "get_plan_status" and recorded.get("finished")):
+        if method == "get_plan_status":
+            recorded, replayed = recorded["result"], replayed["result"]
+        for node_id, handle in recorded["handles"].items():
+            handles[handle] = replayed["handles"][node_id]
+    elif method == "get_io_handles":
+        for key in ("inputs", "outputs"):
+            handles.update(zip(recorded[key], replayed[key]))
+
+
+def replay(trace: dict, td_proxy, pace: bool = False) -> dict:
+    """
+    Make the calls of a trace against `td_proxy`, and compare their durations.
+
+    Args:
+        trace: A trace, as returned by `load_trace`.
+        td_proxy: The proxy to replay the calls against.
+        pace: Wait between calls as long as the recorded client did (e.g. while planning),
+            instead of making the calls back to back.
+
+    Returns:
+        A report with the recorded and replayed time of each method, their difference,
+        and the calls whose outcome (success or error) differed.
+    """
+    handles = {}
+    job_ids = {}
+    # Plans may take more (or fewer) polls to finish than when recorded: the final status
+    # of the jobs that finished before the recorded client saw them finish.
+    finished_jobs = {}
+
+    def remap(handle):
+        return handles.get(handle, handle) if isinstance(handle, int) else handle
+
+    methods = {}
+    mismatches = []
+    start = time.perf_counter()
+    for index, call in enumerate(trace["calls"]):
+        method = call["method"]
+        if method in SKIPPED_METHODS:
+            continue
+        args = tuple(call["args"])
+        if method in ARGUMENT_HANDLES:
+            args = ARGUMENT_HANDLES[method](args, remap)
+        if pace:
+            time.sleep(max(0.0, call["start"] - (time.perf_counter() - start)))
+
+        call_start = time.perf_counter()
+        error = None
+        if method == "get_plan_status" and args[0] in finished_jobs:
+            result = finished_jobs[args[0]]
+            if not call.get("result", {}).get("finished"):
+                result = {**result, "finished": False}
+        else:
+            if method in ("get_plan_status", "cancel_plan"):
+                args = (job_ids.get(args[0], args[0]),)
+            try:
+                result = getattr(td_proxy, method)(*args, **call["kwargs"])
+                while method == "get_plan_status" and call.get(
+                        "result", {}).get("finished") and not result["finished"]:
+                    result = getattr(td_proxy, method)(*args)
+            except Exception as e:
+                result, error = None, f"{type(e).__name__}: {e}"
+            if method == "get_plan_status" and error is None and result["finished"]:
+                finished_jobs[call["args"][0]] = result
+        seconds = time.perf_counter() - call_start
+
+        if (error is None) != ("error" not in call):
+            mismatches.append({
+                "index": index,
+                "method": method,
+                "recorded": call.get("error"),
+                "replayed": error
+            })
+        elif error is None:
+            if method == "submit_plan":
+                job_ids[call["result"]] = result
+            _learn_handles(method, call["result"], result, handles)
+
+        stats = methods.setdefault(method, {"count": 0, "recorded_ms": 0.0, "replayed_ms": 0.0})
+        stats["count"] += 1
+        stats["recorded_ms"] += call["seconds"] * 1000
+        stats["replayed_ms"] += seconds * 1000
+
+    for stats in methods.values():
+        stats["delta_ms"] = stats["replayed_ms"] - stats["recorded_ms"]
+    recorded_ms = sum(stats["recorded_ms"] for stats in methods.values())
+    replayed_ms = sum(stats["replayed_ms"] for stats in methods.values())
+    return {
+        "calls": sum(stats["count"] for stats in methods.values()),
+        "recorded_ms": recorded_ms,
+        "replayed_ms": replayed_ms,
+        "delta_ms": replayed_ms - recorded_ms,
+        "methods": methods,
+        "mismatches": mismatches,
+    }
+
+
+def main():
+    import Pyro5.api
+    from local_td import LocalTouchDesigner, parse_latency
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("trace", help="Trace recorded with client.py --record-trace")
+    parser.add_argument("--uri",
+                        help="Replay against a running TDProxy (e.g. PYRO:td@localhost:60883) "
+                        "instead of a local stand-in")
+    parser.add_argument("--latency",
+                        type=parse_latency,
+                        action="append",
+                        default=[],
+                        metavar="OPERATION=SECONDS",
+                        help="Latency of a td operation in the local stand-in")
+    parser.add_argument("--pace", action="store_true", help="Keep the recorded time between calls")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(name)s - %(levelname)s - %(message)s')
+
+    trace = load_trace(args.trace)
+    print(f"Replaying {len(trace['calls'])} calls, recorded with {trace['metadata']}")
+    if args.uri:
+        report = replay(trace, Pyro5.api.Proxy(args.uri), args.pace)
+    else:
+        with LocalTouchDesigner(latencies=dict(args.latency)) as local_td:
+            report = replay(trace, Pyro5.api.Proxy(local_td.uri), args.pace)
+
+    print(f"{'method':<24}{'calls':>8}{'recorded ms':>14}{'replayed ms':>14}{'delta ms':>12}")
+    for method, stats in sorted(report["methods"].items(), key=lambda item: -item[1]["delta_ms"]):
+        print(f"{method:<24}{stats['count']:>8}{stats['recorded_ms']:>14.2f}"
+              f"{stats['replayed_ms']:>14.2f}{stats['delta_ms']:>+12.2f}")
+    print(f"{'total':<24}{report['calls']:>8}{report['recorded_ms']:>14.2f}"
+          f"{report['replayed_ms']:>14.2f}{report['delta_ms']:>+12.2f}")
+    for mismatch in report["mismatches"]:
+        print(f"Call {mismatch['index']} ({mismatch['method']}) recorded error "
+              f"{mismatch['recorded']}, replayed error {mismatch['replayed']}")
+
+
+if __name__ == "__main__":
+    main()
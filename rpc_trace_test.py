@@ -0,0 +1,106 @@
+import os
+import tempfile
+import unittest
+
+from parameterized import parameterized
+
+from graph_utils import bridge, ComponentRegistry
+from graph_utils_test import MockTDProxy
+from rpc_trace import RecordingProxy, load_trace, replay
+
+COMPONENTS = {
+    'input': {
+        'inputs': [],
+        'outputs': [{
+            'type': 'waveform'
+        }]
+    },
+    'output': {
+        'inputs': [{
+            'type': 'tex'
+        }],
+        'outputs': []
+    },
+    'waveform_to_rgb': {
+        'inputs': [{
+            'type': 'waveform'
+        }],
+        'outputs': [{
+            'type': 'rgb'
+        }, {
+            'type': 'rgb'
+        }]
+    },
+    'mix_rgb': {
+        'inputs': [{
+            'type': 'rgb'
+        }, {
+            'type': 'rgb'
+        }],
+        'outputs': [{
+            'type': 'tex'
+        }]
+    },
+}
+
+
+def make_proxy(next_handle):
+    td_proxy = MockTDProxy()
+    td_proxy.components = COMPONENTS
+    td_proxy.loaded_components = {1: 'input', 2: 'output'}
+    td_proxy.next_handle = next_handle
+    return td_proxy
+
+
+def network(td_proxy):
+    """The connections between components, independent of the handles."""
+    components = td_proxy.loaded_components
+    return sorted((components[source], source_index, components[target], target_index)
+                  for (source, source_index), targets in td_proxy.connections.items()
+                  for target, target_index in targets)
+
+
+class TestRpcTrace(unittest.TestCase):
+
+    @parameterized.expand([("unbatched", False), ("batched", True)])
+    def test_record_and_replay(self, name, batch):
+        recorded_proxy = make_proxy(100)
+        td_proxy = RecordingProxy(recorded_proxy, {"seed": 3})
+        bridge(td_proxy, [1], [2],
+               reuse_weight=0.5,
+               batch=batch,
+               registry=ComponentRegistry(COMPONENTS),
+               seed=3)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "session.trace")
+            td_proxy.save(path)
+            trace = load_trace(path)
+        self.assertEqual(trace["metadata"], {"seed": 3})
+        self.assertEqual([call["method"] for call in trace["calls"]], recorded_proxy.calls)
+
+        # The replayed ops get other handles, but are connected the same way.
+        replayed_proxy = make_proxy(500)
+        report = replay(trace, replayed_proxy)
+        self.assertEqual(replayed_proxy.calls, recorded_proxy.calls)
+        self.assertEqual(network(replayed_proxy), network(recorded_proxy))
+        self.assertEqual(report["mismatches"], [])
+        self.assertEqual(sum(stats["count"] for stats in report["methods"].values()),
+                         len(trace["calls"]))
+
+    def test_replay_errors(self):
+        td_proxy = RecordingProxy(make_proxy(100))
+        with self.assertRaises(KeyError):
+            td_proxy.delete_op(42)
+        td_proxy.delete_op(1)
+
+        # The op was deleted when recording, but not in the replayed project.
+        replayed_proxy = make_proxy(100)
+        del replayed_proxy.loaded_components[1]
+        report = replay({"calls": td_proxy.calls}, replayed_proxy)
+        self.assertEqual([mismatch["index"] for mismatch in report["mismatches"]], [1])
+        self.assertEqual(report["methods"]["delete_op"]["count"], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
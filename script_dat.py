@@ -1,55 +1,315 @@
 import Pyro5.api
 import dataclasses
 import Pyro5.server
-from Pyro5.api import expose, config
+from Pyro5.api import config
 import json
+import logging
 import os
+import sys
 import td
 import select
+import collections
+import functools
+import threading
+import time
 
 # Set the Pyro server type to "multiplex" so that calls are handled synchronously.
 config.SERVERTYPE = "multiplex"
 
+# Level of the script DAT's log, changed at runtime with `TDProxy.set_log_level`.
+LOG_LEVEL = logging.INFO
+
+logger = logging.getLogger("graph_explorer.script_dat")
+if not logger.handlers:
+    # The module is executed again whenever the DAT is edited, but the logger outlives it.
+    handler = logging.StreamHandler(sys.stdout)  # Shown in the textport
+    handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    logger.addHandler(handler)
+    logger.propagate = False
+    logger.setLevel(LOG_LEVEL)
+
 NETWORK_COMPONENT_PATH = "/project1/network"
+# Hidden sibling of the network COMP that the next graph is built in, in double-buffered mode.
+BACK_NETWORK_COMPONENT_NAME = "network_back"
+COMPONENTS_PATH = "/Users/kevin/Projects/graph_explorer/components"
+# Time spent processing requests per cook, and the number of cooks stats are kept for.
+FRAME_BUDGET_MS = 2.0
+FRAME_STATS_WINDOW = 120
+# RPC latency histograms use power of two buckets of microseconds, the last one open ended.
+RPC_HISTOGRAM_BUCKETS = 24
+# Methods managing the stats, which are not recorded themselves.
+RPC_STATS_METHODS = ("enable_rpc_stats", "get_rpc_stats", "reset_rpc_stats")
+# Methods that can be sent with `post_mutation`, and how long `flush_mutations` waits for
+# mutations that haven't arrived yet.
+PIPELINED_METHODS = ("connect", "disconnect", "set_op_attribute", "set_nodes_positions")
+MUTATION_FLUSH_TIMEOUT = 5.0
 
 # -----------------------------------
 # TouchDesigner Op and Proxy Classes
 # -----------------------------------
 
 
+class DescriptorCache:
+    """Component descriptors by name, re-read only when the JSON file changes.
+
+    Every instance of a component shares the cached descriptor, so it must be treated
+    as read-only; per-instance data lives in `AnnotatedOp.instance`.
+    """
+
+    def __init__(self, components_path):
+        self.components_path = components_path
+        self.entries = {}  # name -> (mtime_ns, size, json_path, descriptor)
+
+    def get(self, name):
+        json_path = os.path.join(self.components_path, f"{name}.json")
+        stat = os.stat(json_path)
+        entry = self.entries.get(name)
+        if entry is None or entry[0] != stat.st_mtime_ns or entry[1] != stat.st_size:
+            logger.debug("Loading JSON from: %s", json_path)
+            with open(json_path) as f:
+                entry = (stat.st_mtime_ns, stat.st_size, json_path, json.load(f))
+            self.entries[name] = entry
+        return entry[2], entry[3]
+
+
 class AnnotatedOp:
 
-    def __init__(self, op, descriptor, reserved=False):
+    def __init__(self, op, descriptor, reserved=False, instance=None):
         self.op = op
-        self.descriptor = descriptor
+        # Shared, read-only component descriptor.
+        self.component_descriptor = descriptor
+        # Per-instance data, e.g. the component name and I/O config.
+        self.instance = instance or {}
         self.reserved = reserved
 
+    @property
+    def descriptor(self):
+        return {**self.component_descriptor, **self.instance}
+
     @classmethod
-    def load(cls, name, components_path, reserved=False, io_op_config=None):
-        json_path = os.path.join(components_path, f"{name}.json")
-        print(f"[DEBUG] Loading JSON from: {json_path}")
-        descriptor = json.load(open(json_path))
-        descriptor["name"] = name
+    def load(cls, name, descriptor_cache, network_op, reserved=False, io_op_config=None):
+        json_path, descriptor = descriptor_cache.get(name)
+        instance = {"name": name}
 
         if io_op_config is not None:
-            descriptor["io_op_config"] = io_op_config
+            instance["io_op_config"] = io_op_config
 
         # Handle either tox_file or td_component
         if "tox_file" in descriptor:
             # Load from specified tox file, relative to JSON location
             json_dir = os.path.dirname(json_path)
             tox_path = os.path.join(json_dir, descriptor["tox_file"])
-            print(f"[DEBUG] Loading Tox from: {tox_path}")
-            op = td.op(NETWORK_COMPONENT_PATH).loadTox(tox_path)
+            logger.debug("Loading Tox from: %s", tox_path)
+            op = network_op.loadTox(tox_path)
         elif "td_component" in descriptor:
             # Create built-in TD component
-            print(f"[DEBUG] Creating TD component: {descriptor['td_component']}")
-            op = td.op(NETWORK_COMPONENT_PATH).create(descriptor['td_component'])
+            logger.debug("Creating TD component: %s", descriptor['td_component'])
+            op = network_op.create(descriptor['td_component'])
         else:
             raise ValueError(
                 f"Component descriptor must specify either 'tox_file' or 'td_component'")
 
-        return cls(op, descriptor, reserved)
+        return cls(op, descriptor, reserved, instance)
+
+
+class OpPool:
+    """Released ops, parked for reuse by the next `load` of the same component.
+
+    Parked ops are disconnected, have their custom parameters reset, stop cooking and
+    are hidden from the network editor. They stay in the network COMP they were loaded
+    in, and are only reused by loads into that COMP. The pool holds at most
+    `max_per_component` ops per component and `max_total` ops overall, evicting
+    (destroying) the least recently parked op when full.
+    """
+
+    def __init__(self, max_per_component=16, max_total=128):
+        self.max_per_component = max_per_component
+        self.max_total = max_total
+        self.parked = collections.OrderedDict()  # id(op) -> AnnotatedOp, oldest first
+        self.by_component = {}  # name -> [AnnotatedOp], oldest first
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def acquire(self, name, descriptor, network_op):
+        """Return a parked op of the given component in `network_op`, or None.
+
+        Ops parked before the component descriptor changed are discarded. Ops parked in
+        another network (the front one, while double buffered) are kept for when it is
+        built in again.
+        """
+        ops = self.by_component.get(name, [])
+        for index in range(len(ops) - 1, -1, -1):
+            op = ops[index]
+            if op.component_descriptor is not descriptor:
+                del ops[index]
+                del self.parked[id(op)]
+                self.evict(op)
+            elif op.op.parent() == network_op:
+                del ops[index]
+                del self.parked[id(op)]
+                self.hits += 1
+                self.unpark(op.op)
+                return op
+        self.misses += 1
+        return None
+
+    def release(self, op):
+        name = op.instance.get("name")
+        self.park(op.op)
+        self.parked[id(op)] = op
+        self.by_component.setdefault(name, []).append(op)
+        self.trim()
+
+    def trim(self):
+        """Evict the least recently parked ops until the pool is within its limits."""
+        for ops in self.by_component.values():
+            while len(ops) > self.max_per_component:
+                oldest = ops.pop(0)
+                del self.parked[id(oldest)]
+                self.evict(oldest)
+        while len(self.parked) > self.max_total:
+            _, oldest = self.parked.popitem(last=False)
+            self.by_component[oldest.instance.get("name")].remove(oldest)
+            self.evict(oldest)
+
+    def evict(self, op):
+        self.evictions += 1
+        try:
+            op.op.destroy()
+        except Exception as e:
+            logger.warning("Error destroying pooled op: %s", e)
+
+    def clear(self, network_op=None):
+        """Evict the parked ops, or only those in `network_op` when given."""
+        for key, op in list(self.parked.items()):
+            if network_op is None or op.op.parent() == network_op:
+                del self.parked[key]
+                self.by_component[op.instance.get("name")].remove(op)
+                self.evict(op)
+
+    def stats(self):
+        return {
+            "size": len(self.parked),
+            "by_component": {
+                name: len(ops) for name, ops in self.by_component.items() if ops
+            },
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "max_per_component": self.max_per_component,
+            "max_total": self.max_total,
+        }
+
+    @staticmethod
+    def park(native_op):
+        for connector in native_op.inputConnectors:
+            connector.disconnect()
+        for connector in native_op.outputConnectors:
+            connector.disconnect()
+        for par in getattr(native_op, "customPars", []):
+            try:
+                par.val = par.default
+            except Exception:
+                pass
+        native_op.store("handle", None)
+        native_op.store("pooled", True)
+        if hasattr(native_op, "allowCooking"):
+            native_op.allowCooking = False
+        else:
+            native_op.bypass = True
+        native_op.expose = False
+
+    @staticmethod
+    def unpark(native_op):
+        native_op.store("pooled", False)
+        if hasattr(native_op, "allowCooking"):
+            native_op.allowCooking = True
+        else:
+            native_op.bypass = False
+        native_op.expose = True
+
+
+class RpcStats:
+    """Call counts and server time histograms of the TDProxy methods, by method name."""
+
+    def __init__(self):
+        self.methods = {}  # name -> [errors, [bucket counts], count, total_us, max_us]
+
+    def record(self, name, elapsed_us, failed):
+        stats = self.methods.get(name)
+        if stats is None:
+            stats = self.methods[name] = [0, [0] * RPC_HISTOGRAM_BUCKETS, 0, 0, 0]
+        stats[0] += failed
+        stats[1][min(elapsed_us.bit_length(), RPC_HISTOGRAM_BUCKETS - 1)] += 1
+        stats[2] += 1
+        stats[3] += elapsed_us
+        stats[4] = max(stats[4], elapsed_us)
+
+    @staticmethod
+    def percentile(buckets, count, max_us, fraction):
+        seen = 0
+        for i, bucket in enumerate(buckets):
+            seen += bucket
+            if bucket and seen >= fraction * count:
+                return min(2**i, max_us)
+        return max_us
+
+    def to_dict(self):
+        result = {}
+        for name, (errors, buckets, count, total_us, max_us) in sorted(self.methods.items()):
+            result[name] = {
+                "count": count,
+                "errors": errors,
+                "server_us": {
+                    "count": count,
+                    "total": total_us,
+                    "mean": total_us / count,
+                    "max": max_us,
+                    "p50": self.percentile(buckets, count, max_us, 0.5),
+                    "p90": self.percentile(buckets, count, max_us, 0.9),
+                    "p99": self.percentile(buckets, count, max_us, 0.99),
+                    "buckets": {
+                        2**i: bucket for i, bucket in enumerate(buckets) if bucket
+                    },
+                },
+            }
+        return result
+
+
+def timed(proxy, name, method):
+    """Wrap a bound TDProxy method so that its outermost calls are recorded in `rpc_stats`.
+
+    Calls made from within another timed method (e.g. `load` from `apply_plan`) are
+    counted as part of the outer call only.
+    """
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        if proxy.rpc_depth:
+            return method(*args, **kwargs)
+        proxy.rpc_depth += 1
+        start = time.perf_counter()
+        failed = False
+        try:
+            return method(*args, **kwargs)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            proxy.rpc_depth -= 1
+            proxy.rpc_stats.record(name, int((time.perf_counter() - start) * 1e6), failed)
+
+    return wrapper
+
+
+def expose(method):
+    """`Pyro5.api.expose`, also marking the method as an RPC for `enable_rpc_stats`.
+
+    `TDProxy` is exposed as a whole, which marks its per-cook helpers too.
+    """
+    method._tdRpc = True
+    return Pyro5.api.expose(method)
 
 
 @Pyro5.api.expose
@@ -70,6 +330,39 @@ class TDProxy:
 
         self.network_op = None
 
+        # Double buffering: the graph is built in `build_network_op`, which is the back
+        # network while double buffered, and shown once `swap_buffers` is called.
+        self.double_buffered = False
+        self.back_network_op = None
+        self.build_network_op = None
+        self.front_io_handles = ([], [])  # I/O handles of the front network when double buffered
+        self.output_switches = []  # One switch per network output, picking front or back
+        self.front_switch_index = 0  # Switch input showing the front network
+        self.pending_recycle = collections.deque()  # Handles of ops left in the back network
+
+        self.descriptor_cache = DescriptorCache(COMPONENTS_PATH)
+        self.op_pool = OpPool()
+        self.pooling_enabled = True
+
+        # Plans submitted with `submit_plan`, applied a few steps per cook.
+        self.plan_jobs = {}
+        self.job_queue = collections.deque()
+        self.next_job_id = 0
+
+        # Mutations posted with `post_mutation`, by pipeline id, each with its own sequence
+        # numbers, applied in order a few per cook. They arrive on Pyro's oneway call
+        # threads, hence the condition.
+        self.pipelines = {}  # id -> {"posted": {seq: (method, args)}, "next": seq, "errors": []}
+        self.mutations_posted = threading.Condition()
+
+        # Time-slicing of the request processing in `PyroServerManager.poll_events`.
+        self.frame_budget_ms = FRAME_BUDGET_MS
+        self.frame_stats = collections.deque(maxlen=FRAME_STATS_WINDOW)
+
+        # Per-method stats, only kept (and only costing anything) once enabled.
+        self.rpc_stats = None
+        self.rpc_depth = 0
+
         self.maybe_create_network_op()
 
     def maybe_create_network_op(self):
@@ -89,38 +382,52 @@ class TDProxy:
             self.io_config_path = None
         else:
             self.network_op = td.op(NETWORK_COMPONENT_PATH)
+        self.build_network_op = self.network_op
 
         # Then, register the network op.
-        self.insert_op(AnnotatedOp(self.network_op, {"name": "network"}, reserved=True))
+        self.insert_op(AnnotatedOp(self.network_op, {}, reserved=True,
+                                   instance={"name": "network"}))
 
         # Maybe adopt the operators already present within the network.
         try:
             inputs_by_index = {}
             outputs_by_index = {}
             for op in self.network_op.children:
-                descriptor = op.fetch("descriptor", {})
-                reserved = 'io_op_config' in descriptor
+                if op.fetch("pooled", False):
+                    # The pool does not survive restarts.
+                    op.destroy()
+                    continue
+                instance = op.fetch("instance", None)
+                if instance is None:
+                    # Ops stored by older versions carry a full copy of the descriptor.
+                    instance = op.fetch("descriptor", {})
+                descriptor = self.get_component_descriptor(instance.get("name"))
+                reserved = 'io_op_config' in instance
                 handle = op.fetch("handle", None)
-                print(
-                    f"[DEBUG] Adopting op: {op} descriptor: {descriptor} reserved: {reserved} handle: {handle}"
-                )
-                self.ops_by_handle[handle] = AnnotatedOp(op, descriptor, reserved=reserved)
-
-                if 'input_index' in descriptor['io_op_config']:
-                    inputs_by_index[descriptor['io_op_config']['input_index']] = handle
-                if 'output_index' in descriptor['io_op_config']:
-                    outputs_by_index[descriptor['io_op_config']['output_index']] = handle
+                logger.debug("Adopting op: %s instance: %s reserved: %s handle: %s", op, instance,
+                             reserved, handle)
+                self.ops_by_handle[handle] = AnnotatedOp(op,
+                                                         descriptor,
+                                                         reserved=reserved,
+                                                         instance=instance)
+
+                io_op_config = instance.get('io_op_config', {})
+                if 'input_index' in io_op_config:
+                    inputs_by_index[io_op_config['input_index']] = handle
+                if 'output_index' in io_op_config:
+                    outputs_by_index[io_op_config['output_index']] = handle
 
             self.input_handles = [inputs_by_index[i] for i in range(len(inputs_by_index))]
             self.output_handles = [outputs_by_index[i] for i in range(len(outputs_by_index))]
 
-            self.current_handle = len(self.ops_by_handle)
+            self.current_handle = max(self.ops_by_handle, default=-1) + 1
         except Exception as e:
-            print(f"[DEBUG] Error adopting operators: {e}")
+            logger.warning("Error adopting operators: %s", e)
 
     def load_io_config(self, io_config_path):
         if self.io_config_path != io_config_path:
-            print(f"[DEBUG] Loading IO config from: {io_config_path} network_op: {self.network_op}")
+            logger.debug("Loading IO config from: %s network_op: %s", io_config_path,
+                         self.network_op)
             self.set_io_config(json.load(open(io_config_path)))
             self.io_config_path = io_config_path
 
@@ -131,15 +438,27 @@ class TDProxy:
         outputs = io_config["outputs"]
 
         if len(inputs) == len(self.input_handles) and len(outputs) == len(self.output_handles):
-            print(f"[DEBUG] Input and output handle counts match, assuming no changes.")
+            logger.debug("Input and output handle counts match, assuming no changes.")
             return
 
+        # The back network is rebuilt from the new config.
+        double_buffered = self.double_buffered
+        self.set_double_buffered(False)
+
         # Delete old ops
         for handle in self.input_handles:
             self.delete_op(handle)
         for handle in self.output_handles:
             self.delete_op(handle)
 
+        self.input_handles, self.output_handles = self.load_io_ops(io_config)
+        self.set_double_buffered(double_buffered)
+
+    def load_io_ops(self, io_config):
+        """Load the I/O ops of the config into the build network, returning their handles."""
+        inputs = io_config["inputs"]
+        outputs = io_config["outputs"]
+
         new_input_handles = []
         new_output_handles = []
 
@@ -159,20 +478,146 @@ class TDProxy:
             self.get_op(output_handle).op.name = f"out{index + 1}"
             new_output_handles.append(output_handle)
 
-        self.input_handles = new_input_handles
-        self.output_handles = new_output_handles
+        return new_input_handles, new_output_handles
+
+    @expose
+    def set_double_buffered(self, enabled):
+        """Build graphs in a hidden back network, shown atomically by `swap_buffers`.
+
+        While enabled, `get_io_handles`, `load`, `clear` and `get_graph_snapshot` all
+        operate on the back network, and the front network keeps rendering. Each
+        network output feeds the rest of the project through a switch, so swapping
+        changes what is shown within a single frame.
+        """
+        if enabled == self.double_buffered:
+            return True
+        if enabled:
+            self.create_back_network()
+            self.front_io_handles = (self.input_handles, self.output_handles)
+            self.input_handles, self.output_handles = self.back_io_handles
+            self.build_network_op = self.back_network_op
+        else:
+            self.destroy_back_network()
+        self.double_buffered = enabled
+        return True
+
+    def create_back_network(self):
+        parent = self.network_op.parent()
+        back_network_op = parent.op(BACK_NETWORK_COMPONENT_NAME)
+        if back_network_op is not None:
+            # Left over from a previous session, we have no handles for its ops.
+            back_network_op.destroy()
+        back_network_op = parent.create('baseCOMP')
+        back_network_op.name = BACK_NETWORK_COMPONENT_NAME
+        back_network_op.expose = False
+        self.back_network_op = back_network_op
+        self.insert_op(
+            AnnotatedOp(back_network_op, {}, reserved=True, instance={"name": "network_back"}))
+
+        self.build_network_op = back_network_op
+        self.back_io_handles = self.load_io_ops(self.io_config)
+        self.build_network_op = self.network_op
+
+        # Feed the back network from the same sources as the front network.
+        for index, connector in enumerate(self.network_op.inputConnectors):
+            for source in connector.connections:
+                source.connect(back_network_op.inputConnectors[index])
+
+        # Route each output through a switch, whose input 0 is this network and input 1
+        # the other one.
+        self.output_switches = []
+        self.front_switch_index = 0
+        for index, connector in enumerate(self.network_op.outputConnectors):
+            targets = list(connector.connections)
+            switch_name = f"network_switch{index + 1}"
+            if stale_switch := parent.op(switch_name):
+                # Left over from a previous session.
+                targets = list(stale_switch.outputConnectors[0].connections)
+                stale_switch.destroy()
+            switch = parent.create('switchTOP' if connector.isTOP else 'switchCHOP')
+            switch.name = switch_name
+            switch.par.index = self.front_switch_index
+            connector.connect(switch.inputConnectors[0])
+            back_network_op.outputConnectors[index].connect(switch.inputConnectors[1])
+            for target in targets:
+                switch.outputConnectors[0].connect(target)
+            self.output_switches.append(switch)
+
+    def destroy_back_network(self):
+        """Drop the back network, and connect the front one directly to the outputs again."""
+        self.finish_recycling()
+        self.clear()
+        for handle in self.input_handles + self.output_handles:
+            self.delete_op(handle)
+        for index, switch in enumerate(self.output_switches):
+            for target in list(switch.outputConnectors[0].connections):
+                self.network_op.outputConnectors[index].connect(target)
+            switch.destroy()
+        self.output_switches = []
+
+        for handle, op in list(self.ops_by_handle.items()):
+            if op.op == self.back_network_op:
+                self.ops_by_handle.pop(handle)
+        self.op_pool.clear(self.back_network_op)
+        self.back_network_op.destroy()
+        self.back_network_op = None
+        self.input_handles, self.output_handles = self.front_io_handles
+        self.build_network_op = self.network_op
+
+    @expose
+    def swap_buffers(self):
+        """Show the back network, and start recycling the ops of the previous front one."""
+        if not self.double_buffered:
+            return False
+        self.finish_jobs()
+        # Switch every output over at once, so the new graph shows up in a single frame.
+        self.front_switch_index = 1 - self.front_switch_index
+        for switch in self.output_switches:
+            switch.par.index = self.front_switch_index
+
+        front, back = self.back_network_op, self.network_op
+        # Keep the front network at NETWORK_COMPONENT_PATH, so it is adopted on restart.
+        back.name = BACK_NETWORK_COMPONENT_NAME + "_swap"
+        front.name, back.name = "network", BACK_NETWORK_COMPONENT_NAME
+        front.expose, back.expose = True, False
+        self.network_op, self.back_network_op = front, back
+
+        front_io_handles = (self.input_handles, self.output_handles)
+        self.input_handles, self.output_handles = self.front_io_handles
+        self.front_io_handles = front_io_handles
+        self.build_network_op = back
+
+        # The previous front network is recycled over the next cooks.
+        self.pending_recycle.extend(handle for handle, op in self.ops_by_handle.items()
+                                    if not op.reserved and op.op.parent() == back)
+        logger.info("Swapped buffers, %d ops to recycle", len(self.pending_recycle))
+        return True
+
+    def recycle_step(self, max_ops=8):
+        """Release up to `max_ops` ops of the previous front network (called once per cook)."""
+        for _ in range(min(max_ops, len(self.pending_recycle))):
+            self.release_op(self.pending_recycle.popleft())
+
+    def finish_recycling(self):
+        self.recycle_step(len(self.pending_recycle))
 
     def insert_op(self, op):
         self.ops_by_handle[self.current_handle] = op
         self.current_handle += 1
-        print(f"[DEBUG] Inserted op with handle {self.current_handle - 1}")
+        logger.debug("Inserted op with handle %s", self.current_handle - 1)
         return self.current_handle - 1
 
+    def get_component_descriptor(self, name):
+        try:
+            return self.descriptor_cache.get(name)[1]
+        except (OSError, TypeError, ValueError):
+            return {}
+
     def get_handle_for_native_op(self, native_op):
         return native_op.fetch("handle", None)
 
     def get_op(self, handle):
-        print(f"[DEBUG] Retrieving op with handle {handle}")
+        logger.debug("Retrieving op with handle %s", handle)
         return self.ops_by_handle.get(handle)
 
     def io_callback(self, io_args):
@@ -181,12 +626,12 @@ class TDProxy:
                 # Call the specific method on the proxy
                 self.io_callback_.notify(io_args)
             except Exception as e:
-                print(f"Error calling IO callback: {e}")
+                logger.warning("Error calling IO callback: %s", e)
 
     @expose
     def register_io_callback(self, callback_uri):
         # Store the URI and create a proxy to the callback object
-        print(f"[DEBUG] Registering callback with URI: {callback_uri}")
+        logger.debug("Registering callback with URI: %s", callback_uri)
         self.io_callback_ = Pyro5.api.Proxy(callback_uri)
 
     @expose
@@ -198,28 +643,36 @@ class TDProxy:
 
     @expose
     def create_op(self, name):
-        print(f"[DEBUG] Creating op: {name}")
-        native_op = td.op(NETWORK_COMPONENT_PATH).create(name)
-        handle = self.insert_op(AnnotatedOp(native_op, {"name": name}))
+        logger.debug("Creating op: %s", name)
+        self.finish_recycling()
+        native_op = self.build_network_op.create(name)
+        op = AnnotatedOp(native_op, {}, instance={"name": name})
+        handle = self.insert_op(op)
         native_op.store("handle", handle)
-        op.op.store("descriptor", op.descriptor)
-        print(f"[DEBUG] Created op with handle {handle}")
+        native_op.store("instance", op.instance)
+        logger.debug("Created op with handle %s", handle)
         return handle
 
     @expose
     def list_ops(self):
-        print("[DEBUG] Listing ops")
+        logger.debug("Listing ops")
         return [(handle, op.descriptor) for handle, op in self.ops_by_handle.items()]
 
     @expose
     def load(self, name, reserved=False, io_op_config=None):
-        print(f"[DEBUG] Loading component: {name}")
-        op = AnnotatedOp.load(name, "/Users/kevin/Projects/graph_explorer/components", reserved,
-                              io_op_config)
+        logger.debug("Loading component: %s", name)
+        self.finish_recycling()
+        op = None
+        if self.pooling_enabled and not reserved:
+            op = self.op_pool.acquire(name, self.get_component_descriptor(name),
+                                      self.build_network_op)
+        if op is None:
+            op = AnnotatedOp.load(name, self.descriptor_cache, self.build_network_op, reserved,
+                                  io_op_config)
         handle = self.insert_op(op)
         op.op.store("handle", handle)
-        op.op.store("descriptor", op.descriptor)
-        print(f"[DEBUG] Tox loaded with handle {handle}")
+        op.op.store("instance", op.instance)
+        logger.debug("Tox loaded with handle %s", handle)
         return handle
 
     @expose
@@ -236,149 +689,575 @@ class TDProxy:
             native_op.nodeHeight,
         )
 
+    @expose
+    def get_nodes_geometry(self, handles):
+        geometry = []
+        for handle in handles:
+            native_op = self.ops_by_handle[handle].op
+            geometry.append(
+                (native_op.nodeX, native_op.nodeY, native_op.nodeWidth, native_op.nodeHeight))
+        return geometry
+
+    @expose
+    def set_nodes_positions(self, positions):
+        """Move nodes, given a dict of handle -> (nodeX, nodeY)."""
+        for handle, (x, y) in positions.items():
+            native_op = self.ops_by_handle[handle].op
+            native_op.nodeX = x
+            native_op.nodeY = y
+        return True
+
     @expose
     def get_op_descriptor(self, handle):
         return self.get_op(handle).descriptor
 
+    @expose
+    def get_op_descriptors(self, handles):
+        return [self.get_op_descriptor(handle) for handle in handles]
+
+    @expose
+    def apply_plan(self, plan):
+        """Apply a whole graph plan in a single call.
+
+        The plan is a dict with the following (optional) keys, applied in this order:
+            "disconnect": [(handle, input_index), ...]
+            "destroy": [handle, ...]
+            "nodes": [{"id": node_id, "component": component_name}, ...]
+            "edges": [(source, source_index, target, target_index), ...]
+            "attributes": [(node, attribute, value), ...]
+
+        Sources, targets and attribute nodes are either the string id of a node in
+        the plan, or the integer handle of an existing op.
+
+        Returns a dict with the handle assigned to each plan node id, and the list of
+        edges and attributes that could not be applied.
+        """
+        result = {}
+        for _ in self.plan_steps(plan, result):
+            pass
+        return result
+
+    def plan_steps(self, plan, result):
+        """Apply a plan one op at a time, yielding after each step.
+
+        `result` is filled in as the plan is applied, and complete once the generator is
+        exhausted. See `apply_plan` for the plan format.
+        """
+        logger.debug("Applying plan with %d nodes and %d edges", len(plan.get('nodes', [])),
+                     len(plan.get('edges', [])))
+        handles = result.setdefault("handles", {})
+        failed_edges = result.setdefault("failed_edges", [])
+        failed_attributes = result.setdefault("failed_attributes", [])
+
+        for handle, input_index in plan.get("disconnect", []):
+            self.disconnect(handle, [input_index], [])
+            yield
+        for handle in plan.get("destroy", []):
+            self.release_op(handle)
+            yield
+
+        for node in plan.get("nodes", []):
+            handles[node["id"]] = self.load(node["component"])
+            yield
+
+        def resolve(node):
+            return handles[node] if isinstance(node, str) else node
+
+        for source, source_index, target, target_index in plan.get("edges", []):
+            if not self.connect(resolve(source), source_index, resolve(target), target_index):
+                failed_edges.append((source, source_index, target, target_index))
+            yield
+
+        for node, attribute, value in plan.get("attributes", []):
+            try:
+                applied = self.set_op_attribute(resolve(node), attribute, value)
+            except Exception as e:
+                logger.warning("Setting attribute failed: %s", e)
+                applied = False
+            if not applied:
+                failed_attributes.append((node, attribute, value))
+            yield
+
+    @expose
+    def submit_plan(self, plan):
+        """Queue a plan to be applied over the next cooks, within the frame budget.
+
+        Unlike `apply_plan`, a large plan does not stall a single frame. Returns a job id
+        to poll with `get_plan_status`.
+        """
+        job_id = self.next_job_id
+        self.next_job_id += 1
+        total = sum(
+            len(plan.get(key, []))
+            for key in ("disconnect", "destroy", "nodes", "edges", "attributes"))
+        result = {}
+        self.plan_jobs[job_id] = {
+            "steps": self.plan_steps(plan, result),
+            "result": result,
+            "done": 0,
+            "total": total,
+            "finished": False,
+        }
+        self.job_queue.append(job_id)
+        return job_id
+
+    @expose
+    def get_plan_status(self, job_id):
+        """Progress of a submitted plan, with its result once it has been fully applied.
+
+        A plan that stopped on a failing step is finished with an "error", and the partial
+        result of the steps before it.
+        """
+        job = self.plan_jobs.get(job_id)
+        if job is None:
+            raise KeyError(f"Unknown plan job {job_id}")
+        status = {"finished": job["finished"], "done": job["done"], "total": job["total"]}
+        if job["finished"]:
+            status["result"] = job["result"]
+            if "error" in job:
+                status["error"] = job["error"]
+            del self.plan_jobs[job_id]
+        return status
+
+    @expose
+    def cancel_plan(self, job_id):
+        """Stop applying a submitted plan, e.g. when a newer one replaces it.
+
+        The steps already taken are kept, to be cleared along with the rest of the network.
+        Returns the status of the job as of its cancellation.
+        """
+        job = self.plan_jobs.pop(job_id, None)
+        if job is None:
+            raise KeyError(f"Unknown plan job {job_id}")
+        if not job["finished"]:
+            self.job_queue.remove(job_id)
+            job["steps"].close()
+        return {"finished": job["finished"], "done": job["done"], "total": job["total"]}
+
+    def run_jobs(self, deadline):
+        """Step the queued plan jobs until `deadline` (a `time.perf_counter` value).
+
+        At least one step is taken per call, so jobs progress even on frames whose budget
+        was used up by requests. Returns the number of steps taken.
+        """
+        steps = 0
+        while self.job_queue:
+            job_id = self.job_queue[0]
+            job = self.plan_jobs[job_id]
+            try:
+                next(job["steps"])
+                job["done"] += 1
+            except StopIteration:
+                job["finished"] = True
+                self.job_queue.popleft()
+            except Exception as e:
+                # The plan can't go on, report it with the job rather than out of the cook.
+                logger.warning("Plan job %s failed: %s", job_id, e)
+                job["error"] = f"{type(e).__name__}: {e}"
+                job["finished"] = True
+                self.job_queue.popleft()
+            steps += 1
+            if time.perf_counter() >= deadline:
+                break
+        return steps
+
+    def finish_jobs(self):
+        """Apply the queued plan jobs right away, before an operation that depends on them."""
+        while self.job_queue:
+            self.run_jobs(float("inf"))
+
+    def pending_job_steps(self):
+        return sum(self.plan_jobs[job_id]["total"] - self.plan_jobs[job_id]["done"]
+                   for job_id in self.job_queue)
+
+    @expose
+    @Pyro5.api.oneway
+    def post_mutation(self, pipeline, seq, method, args):
+        """Queue a call to one of `PIPELINED_METHODS`, without the client waiting for it.
+
+        Pyro5 runs oneway calls on their own thread, so the call is only queued here and
+        applied on the cook thread, in `seq` order among the calls of the same `pipeline`
+        (an id unique to the client's pipeline, so that clients don't mix their sequences).
+        Failures are reported by `flush_mutations`, which the client calls after its last
+        mutation.
+        """
+        with self.mutations_posted:
+            self.pipeline_state(pipeline)["posted"][seq] = (method, args)
+            self.mutations_posted.notify()
+
+    def pipeline_state(self, pipeline):
+        return self.pipelines.setdefault(pipeline, {"posted": {}, "next": 0, "errors": []})
+
+    def run_mutations(self, deadline):
+        """Apply the posted mutations that are next in sequence until `deadline`."""
+        applied = 0
+        with self.mutations_posted:
+            pipelines = list(self.pipelines.values())
+        for state in pipelines:
+            while time.perf_counter() < deadline:
+                with self.mutations_posted:
+                    mutation = state["posted"].pop(state["next"], None)
+                if mutation is None:
+                    break
+                self.apply_mutation(state, state["next"], *mutation)
+                state["next"] += 1
+                applied += 1
+        return applied
+
+    def apply_mutation(self, state, seq, method, args):
+        error = None
+        if method not in PIPELINED_METHODS:
+            error = f"{method} can't be pipelined, expected one of {PIPELINED_METHODS}"
+        else:
+            try:
+                if getattr(self, method)(*args) is False:
+                    error = "failed"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+        if error is not None:
+            logger.warning("Pipelined %s%s failed: %s", method, tuple(args), error)
+            state["errors"].append({"seq": seq, "method": method, "args": args, "error": error})
+
+    @expose
+    def flush_mutations(self, pipeline, count, timeout=MUTATION_FLUSH_TIMEOUT):
+        """Apply the first `count` mutations posted to `pipeline` and report the ones that
+        failed.
+
+        Mutations still on their way are waited for, up to `timeout` seconds. The sequence
+        numbers of the pipeline start over from 0 afterwards.
+        """
+        with self.mutations_posted:
+            state = self.pipeline_state(pipeline)
+        deadline = time.perf_counter() + timeout
+        while state["next"] < count:
+            with self.mutations_posted:
+                arrived = self.mutations_posted.wait_for(lambda: state["next"] in state["posted"],
+                                                         deadline - time.perf_counter())
+                if not arrived:
+                    break
+                mutation = state["posted"].pop(state["next"])
+            self.apply_mutation(state, state["next"], *mutation)
+            state["next"] += 1
+        for seq in range(state["next"], count):
+            state["errors"].append({
+                "seq": seq,
+                "method": None,
+                "args": None,
+                "error": "not received"
+            })
+
+        with self.mutations_posted:
+            self.pipelines.pop(pipeline, None)
+        errors = state["errors"]
+        return {"applied": count - len(errors), "errors": errors}
+
     @expose
     def get_op_attribute(self, handle, attribute, dir_output=False):
-        print(f"[DEBUG] Getting attribute '{attribute}' from op with handle {handle}")
+        logger.debug("Getting attribute '%s' from op with handle %s", attribute, handle)
         if op := self.get_op(handle):
             x = op.op
             for attr in attribute.split("."):
                 if attr == '':
                     continue
                 x = getattr(x, attr)
-            print(f"[DEBUG] Retrieved attribute value: {x}")
+            logger.debug("Retrieved attribute value: %s", x)
             if dir_output:
                 return str(dir(x))
             return str(x)
-        print("[DEBUG] No op found for given handle.")
+        logger.debug("No op found for given handle.")
         return None
 
     @expose
     def set_op_attribute(self, handle, attribute, value):
-        print(f"[DEBUG] Setting attribute '{attribute}' on op with handle {handle} to {value}")
+        logger.debug("Setting attribute '%s' on op with handle %s to %s", attribute, handle, value)
         if op := self.get_op(handle):
             x = op.op
             attrs = attribute.split(".")
             for attr in attrs[:-1]:
                 x = getattr(x, attr)
             setattr(x, attrs[-1], value)
-            print("[DEBUG] Attribute set.")
+            logger.debug("Attribute set.")
             return True
-        print("[DEBUG] No op found for given handle.")
+        logger.debug("No op found for given handle.")
         return False
 
     @expose
     def get_op_connectors(self, handle) -> tuple[list, list]:
-        print(f"[DEBUG] Getting connectors for op with handle {handle}")
+        logger.debug("Getting connectors for op with handle %s", handle)
         if op := self.get_op(handle):
             in_connectors = []
             out_connectors = []
 
             if handle not in self.input_handles:
                 for connector in op.op.inputConnectors:
-                    print(f"[DEBUG] Input connector: {connector}")
+                    logger.debug("Input connector: %s", connector)
                     index = connector.index
                     owner_handle = self.get_handle_for_native_op(connector.owner)
-                target_handles_and_indices = [(self.get_handle_for_native_op(target.owner),
-                                               target.index) for target in connector.connections]
+                    target_handles_and_indices = [(self.get_handle_for_native_op(target.owner),
+                                                   target.index)
+                                                  for target in connector.connections]
 
-                in_connector = {
-                    "owner": (owner_handle, index),
-                    "targets": target_handles_and_indices,
-                }
-                print(f"[DEBUG] Converted connector: {in_connector}")
-                in_connectors.append(in_connector)
+                    in_connector = {
+                        "owner": (owner_handle, index),
+                        "targets": target_handles_and_indices,
+                    }
+                    logger.debug("Converted connector: %s", in_connector)
+                    in_connectors.append(in_connector)
 
             if handle not in self.output_handles:
                 for connector in op.op.outputConnectors:
-                    print(f"[DEBUG] Output connector: {connector}")
+                    logger.debug("Output connector: %s", connector)
                     index = connector.index
                     owner_handle = self.get_handle_for_native_op(connector.owner)
-                target_handles_and_indices = [(self.get_handle_for_native_op(target.owner),
-                                               target.index) for target in connector.connections]
+                    target_handles_and_indices = [(self.get_handle_for_native_op(target.owner),
+                                                   target.index)
+                                                  for target in connector.connections]
 
-                out_connector = {
-                    "owner": (owner_handle, index),
-                    "targets": target_handles_and_indices,
-                }
-                print(f"[DEBUG] Converted connector: {out_connector}")
-                out_connectors.append(out_connector)
+                    out_connector = {
+                        "owner": (owner_handle, index),
+                        "targets": target_handles_and_indices,
+                    }
+                    logger.debug("Converted connector: %s", out_connector)
+                    out_connectors.append(out_connector)
 
             result = {"in": in_connectors, "out": out_connectors}
-            print(f"[DEBUG] Retrieved connectors: {result}")
+            logger.debug("Retrieved connectors: %s", result)
             return result
         raise ValueError("No op found for given handle.")
 
+    @expose
+    def get_graph_snapshot(self, handles=None):
+        """Return the nodes and edges of the network in one compact payload.
+
+        With `handles=None` the snapshot covers every op in the (build) network. Otherwise it
+        covers the given handles plus the ops directly feeding into them.
+
+        Returns a dict of parallel lists "handles", "components" and "reserved" (one
+        entry per node), and "edges" as (source, source_index, target, target_index).
+        """
+        if handles is None:
+            handles = [
+                handle for handle, op in self.ops_by_handle.items()
+                if op.op.parent() == self.build_network_op
+            ]
+
+        def input_edges(handle, op):
+            if handle in self.input_handles:
+                return
+            for connector in op.op.inputConnectors:
+                for source in connector.connections:
+                    source_handle = self.get_handle_for_native_op(source.owner)
+                    if source_handle is not None and source_handle not in self.output_handles:
+                        yield (source_handle, source.index, handle, connector.index)
+
+        nodes = {}
+        edges = []
+        for handle in handles:
+            if op := self.ops_by_handle.get(handle):
+                nodes[handle] = op
+                edges.extend(input_edges(handle, op))
+
+        # Pull in the ops feeding into the requested handles.
+        for source_handle, _, _, _ in list(edges):
+            if source_handle not in nodes and (op := self.ops_by_handle.get(source_handle)):
+                nodes[source_handle] = op
+                edges.extend(input_edges(source_handle, op))
+
+        return {
+            "handles": list(nodes),
+            "components": [op.instance.get("name") for op in nodes.values()],
+            "reserved": [op.reserved for op in nodes.values()],
+            "edges": [edge for edge in edges if edge[0] in nodes],
+        }
+
+    @expose
+    def get_cook_times(self, handles=None):
+        """Return the measured cook times of component ops, for costing components.
+
+        With `handles=None` this covers every component op in the network being shown
+        (the front network when double buffered); I/O ops are left out. Times are those
+        of the op's last cook, its children included, in milliseconds. Ops that haven't
+        cooked yet are left out.
+
+        Returns a dict of handle -> {"component", "cpu_ms", "gpu_ms", "cooks"}.
+        """
+        if handles is None:
+            handles = [
+                handle for handle, op in self.ops_by_handle.items()
+                if op.op.parent() == self.network_op
+            ]
+        cook_times = {}
+        for handle in handles:
+            op = self.ops_by_handle.get(handle)
+            if op is None or op.reserved or not op.op.totalCooks:
+                continue
+            native_op = op.op
+            cook_times[handle] = {
+                "component": op.instance.get("name"),
+                "cpu_ms": native_op.cpuCookTime + native_op.childrenCPUCookTime,
+                "gpu_ms": native_op.gpuCookTime + native_op.childrenGPUCookTime,
+                "cooks": native_op.totalCooks,
+            }
+        return cook_times
+
     @expose
     def connect(self, output_handle, output_index, input_handle, input_index):
-        print(
-            f"[DEBUG] Connecting output {output_index} of op {output_handle} to input {input_index} of op {input_handle}"
-        )
+        logger.debug("Connecting output %s of op %s to input %s of op %s", output_index,
+                     output_handle, input_index, input_handle)
         try:
             if output_op := self.get_op(output_handle):
                 if input_op := self.get_op(input_handle):
                     output_op.op.outputConnectors[output_index].connect(
                         input_op.op.inputConnectors[input_index])
-                    print("[DEBUG] Connection successful.")
+                    logger.debug("Connection successful.")
                     return True
         except Exception as e:
-            print(f"[DEBUG] Connection failed: {e}")
+            logger.warning("Connection failed: %s", e)
         return False
 
     @expose
     def disconnect(self, handle, in_indices, out_indices):
-        print(
-            f"[DEBUG] Disconnecting inputs {in_indices} and outputs {out_indices} from op with handle {handle}"
-        )
+        logger.debug("Disconnecting inputs %s and outputs %s from op with handle %s", in_indices,
+                     out_indices, handle)
         try:
             if op := self.get_op(handle):
                 for in_index in in_indices:
                     op.op.inputConnectors[in_index].disconnect()
                 for out_index in out_indices:
                     op.op.outputConnectors[out_index].disconnect()
-                print("[DEBUG] Disconnection successful.")
+                logger.debug("Disconnection successful.")
                 return True
         except Exception as e:
-            print(f"[DEBUG] Disconnection failed: {e}")
+            logger.warning("Disconnection failed: %s", e)
         return False
 
     @expose
     def delete_op(self, handle):
-        print(f"[DEBUG] Deleting op with handle {handle}")
+        logger.debug("Deleting op with handle %s", handle)
         if op := self.get_op(handle):
             op.op.destroy()
             self.ops_by_handle.pop(handle)
             return True
         return False
 
+    @expose
+    def release_op(self, handle):
+        """Remove an op from the network, parking it in the pool when pooling is enabled."""
+        op = self.get_op(handle)
+        if op is None or op.reserved:
+            return False
+        self.ops_by_handle.pop(handle)
+        if self.pooling_enabled:
+            self.op_pool.release(op)
+        else:
+            op.op.destroy()
+        return True
+
+    @expose
+    def configure_pool(self, enabled=True, max_per_component=16, max_total=128):
+        self.pooling_enabled = enabled
+        self.op_pool.max_per_component = max_per_component
+        self.op_pool.max_total = max_total
+        if enabled:
+            self.op_pool.trim()
+        else:
+            self.op_pool.clear()
+        return self.op_pool.stats()
+
+    @expose
+    def get_pool_stats(self):
+        return self.op_pool.stats()
+
+    @classmethod
+    def exposed_method_names(cls):
+        return [
+            name for name, member in vars(cls).items()
+            if callable(member) and getattr(member, "_tdRpc", False)
+        ]
+
+    @expose
+    def enable_rpc_stats(self, enabled=True):
+        """Start (or stop) recording the count and server time of every method call.
+
+        The methods are wrapped on this instance while enabled, and the wrappers removed
+        when disabled, so the class methods are called directly again.
+        """
+        if enabled and self.rpc_stats is None:
+            self.rpc_stats = RpcStats()
+            for name in self.exposed_method_names():
+                # Oneway calls run on Pyro's threads, their mutations are recorded when applied.
+                if name not in RPC_STATS_METHODS and name != "post_mutation":
+                    setattr(self, name, timed(self, name, getattr(self, name)))
+        elif not enabled and self.rpc_stats is not None:
+            for name in self.exposed_method_names():
+                self.__dict__.pop(name, None)
+            self.rpc_stats = None
+
+    @expose
+    def get_rpc_stats(self):
+        return self.rpc_stats.to_dict() if self.rpc_stats is not None else {}
+
+    @expose
+    def reset_rpc_stats(self):
+        if self.rpc_stats is not None:
+            self.rpc_stats = RpcStats()
+
+    @expose
+    def set_log_level(self, level):
+        """Set the level of the script DAT's log, by name (e.g. "DEBUG") or number."""
+        logger.setLevel(level.upper() if isinstance(level, str) else level)
+        return logging.getLevelName(logger.level)
+
+    @expose
+    def set_frame_budget(self, budget_ms):
+        self.frame_budget_ms = budget_ms
+
+    @expose
+    def get_frame_stats(self):
+        """Per-cook request processing stats, oldest first, over the last few cooks."""
+        frames = list(self.frame_stats)
+        times = [frame["ms"] for frame in frames]
+        return {
+            "budget_ms": self.frame_budget_ms,
+            "frames": frames,
+            "mean_ms": sum(times) / len(times) if times else 0.0,
+            "max_ms": max(times, default=0.0),
+            "over_budget": sum(frame["ms"] > self.frame_budget_ms for frame in frames),
+        }
+
     @expose
     def clear(self):
-        print("[DEBUG] Clearing all ops")
+        logger.debug("Clearing all ops")
         try:
+            self.finish_jobs()
+            self.finish_recycling()
             handles_to_remove = []
             for handle, op in self.ops_by_handle.items():
                 if op.reserved:
                     # Skip the network and I/O ops, otherwise we crash.
                     continue
+                if op.op.parent() != self.build_network_op:
+                    # Leave the front network alone while double buffered.
+                    continue
                 try:
-                    op.op.destroy()
+                    if self.pooling_enabled:
+                        self.op_pool.release(op)
+                    else:
+                        op.op.destroy()
                     handles_to_remove.append(handle)
                 except Exception as e:
-                    print(f"[DEBUG] Error destroying op with handle {handle}: {str(e)}")
+                    logger.warning("Error destroying op with handle %s: %s", handle, e)
                     # Continue with other ops even if one fails
                     continue
 
             for handle in handles_to_remove:
                 self.ops_by_handle.pop(handle)
 
-            self.current_handle = len(self.ops_by_handle)
+            self.current_handle = max(self.ops_by_handle, default=-1) + 1
             return True
         except Exception as e:
             # Convert any TD errors to a standard Python error message
-            print(f"[DEBUG] Error during clear operation: {str(e)}")
+            logger.warning("Error during clear operation: %s", e)
             raise RuntimeError(f"Failed to clear operators: {str(e)}")
 
 
@@ -405,66 +1284,89 @@ class PyroServerManager:
     def io_callback(self):
         self.td_proxy.io_callback(self.io_args)
 
-    def start_server(self):
+    def start_server(self, host=None, port=0):
+        """Start serving TDProxy, on a free port unless `port` is given."""
         if self.server is not None:
-            print("[DEBUG] Server is already running.")
+            logger.debug("Server is already running.")
             return
 
         # Create the Pyro daemon.
-        self.server = Pyro5.api.Daemon()
-        print("[DEBUG] Pyro daemon created.")
+        self.server = Pyro5.api.Daemon(host=host, port=port)
+        logger.info("Pyro daemon created.")
         try:
             # Unregister any previous registration for "td"
             self.server.unregister("td")
-            print("[DEBUG] Previous 'td' registration unregistered.")
+            logger.debug("Previous 'td' registration unregistered.")
         except Exception as ex:
-            print(f"[DEBUG] Failed to unregister previous object: {ex}")
+            logger.debug("Failed to unregister previous object: %s", ex)
         try:
             # Register our proxy. Save the URI.
             uri = self.server.register(self.td_proxy, objectId="td", force=True)
             self.uri = str(uri)
-            print(f"[DEBUG] Pyro server running at {self.uri}")
+            logger.info("Pyro server running at %s", self.uri)
         except Exception as e:
-            print(f"[DEBUG] Error registering td_proxy: {e}")
+            logger.warning("Error registering td_proxy: %s", e)
             self.server = None
             return
 
         self.running = True
-        print("[DEBUG] Server started in synchronous mode (multiplex).")
+        logger.info("Server started in synchronous mode (multiplex).")
 
         # Create the network op if it doesn't exist.
         self.td_proxy.maybe_create_network_op()
 
     def poll_events(self):
+        """Process pending requests until the frame budget is used up.
+
+        Requests left over are processed on the next cooks, and the remaining budget goes
+        to the queued plan jobs.
+        """
         if self.server and self.running:
-            sockets = self.server.sockets
+            start = time.perf_counter()
+            deadline = start + self.td_proxy.frame_budget_ms / 1000
+            requests = 0
+            pending_requests = 0
             while True:
                 try:
-                    ready, _, _ = select.select(sockets, [], [], 0.01)
-                    if ready:
-                        for sock in ready:
-                            print(f"[DEBUG] Processing socket with fileno: {sock.fileno()}")
-                        self.server.events(ready)
-                    else:
+                    # The socket list changes as clients connect, so fetch it every time.
+                    ready, _, _ = select.select(self.server.sockets, [], [], 0)
+                    if not ready:
+                        break
+                    if requests and time.perf_counter() >= deadline:
+                        pending_requests = len(ready)
                         break
+                    self.server.events(ready)
+                    requests += len(ready)
                 except Exception as e:
-                    print(f"[DEBUG] Exception in poll_events: {e}")
+                    logger.warning("Exception in poll_events: %s", e)
                     break
+            mutations = self.td_proxy.run_mutations(deadline)
+            job_steps = self.td_proxy.run_jobs(deadline)
+            self.td_proxy.recycle_step()
+            self.td_proxy.frame_stats.append({
+                "ms": (time.perf_counter() - start) * 1000,
+                "requests": requests,
+                "mutations": mutations,
+                "job_steps": job_steps,
+                "pending_requests": pending_requests,
+                "pending_jobs": len(self.td_proxy.job_queue),
+                "pending_job_steps": self.td_proxy.pending_job_steps(),
+            })
         else:
-            print("[DEBUG] Server not running; poll_events skipped.")
+            logger.debug("Server not running; poll_events skipped.")
 
     def stop_server(self):
         if self.server:
             try:
                 self.server.shutdown()
-                print("[DEBUG] Server shut down successfully.")
+                logger.info("Server shut down successfully.")
             except Exception as e:
-                print(f"[DEBUG] Error during server shutdown: {e}")
+                logger.warning("Error during server shutdown: %s", e)
             self.running = False
             self.server = None
             self.uri = None
         else:
-            print("[DEBUG] No server to shut down.")
+            logger.debug("No server to shut down.")
 
 
 # -------------------------------------------------
@@ -493,15 +1395,15 @@ def onSetupParameters(scriptOp):
     scriptOp.par.Dummycook.expr = "me.time.seconds"
     scriptOp.par.Dummycook.readOnly = True
 
-    print("[DEBUG] onSetupParameters: Parameters set up.")
+    logger.debug("onSetupParameters: Parameters set up.")
 
 
 def onPulse(par):
     # Fetch the stored server manager.
     server_manager = me.fetch('server_manager', None)
-    print(f"[DEBUG] onPulse triggered: {par.name}")
+    logger.debug("onPulse triggered: %s", par.name)
     if server_manager is None:
-        print("[DEBUG] No server manager found!")
+        logger.debug("No server manager found!")
         return
     if par.name == 'Startserver':
         server_manager.start_server()
@@ -541,21 +1443,27 @@ def onCook(scriptOp):
         server_manager.poll_events()
         uri_str = str(server_manager.uri) if server_manager.uri else "Unknown"
         scriptOp.appendRow(["Server running on port: " + uri_str])
+        if server_manager.td_proxy.frame_stats:
+            frame = server_manager.td_proxy.frame_stats[-1]
+            scriptOp.appendRow([
+                f"Last cook: {frame['ms']:.2f} ms, {frame['requests']} requests, "
+                f"{frame['pending_requests']} pending, {frame['pending_job_steps']} plan steps queued"
+            ])
         # Update the custom parameter on the DAT (if it exists)
         try:
             # Update the parameter value. Adjust the syntax if needed.
             scriptOp.par.Serveruri = uri_str
         except Exception as e:
-            print(f"[DEBUG] Error updating Serveruri parameter: {e}")
+            logger.warning("Error updating Serveruri parameter: %s", e)
 
         io_args = scriptOp.par.Ioargs.eval()
         try:
             server_manager.set_io_args(io_args)
         except Exception as e:
-            print(f"[DEBUG] Error setting io args: {e}")
+            logger.warning("Error setting io args: %s", e)
     else:
         scriptOp.appendRow(["Server not running."])
         try:
             scriptOp.par.Serveruri = ""
         except Exception as e:
-            print(f"[DEBUG] Error updating Serveruri parameter: {e}")
+            logger.warning("Error updating Serveruri parameter: %s", e)